@@ -0,0 +1,101 @@
+# app_logging.py - Logging con niveles, buffer acotado y escritura en un thread aparte
+import atexit
+import logging
+import queue
+import sys
+import threading
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s %(message)s'
+
+_handler = None
+
+
+class AsyncLogHandler(logging.Handler):
+    """emit() solo encola (no bloquea el request); un thread formatea y escribe en lotes"""
+
+    def __init__(self, stream=None, max_buffer=10000, batch_size=256):
+        super().__init__()
+        self.stream = stream or sys.stderr
+        self.batch_size = batch_size
+        self.dropped = 0
+        self.written = 0
+        self._queue = queue.Queue(maxsize=max_buffer)
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def emit(self, record):
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            # Con el buffer lleno se descarta: nunca frenar un request por un log
+            self.dropped += 1
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch):
+        lines = []
+        for record in batch:
+            try:
+                lines.append(self.format(record))
+            except Exception:
+                self.handleError(record)
+        if lines:
+            try:
+                self.stream.write('\n'.join(lines) + '\n')
+                self.stream.flush()
+            except Exception:
+                pass
+            self.written += len(lines)
+
+    def flush(self):
+        """Escribir lo pendiente desde el thread actual (al salir del proceso)"""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._write(batch)
+
+    def stats(self):
+        return {
+            'buffered': self._queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped
+        }
+
+
+def configure_logging(level='INFO', max_buffer=10000):
+    """Instalar el handler asíncrono en el logger 'despegar' (idempotente)"""
+    global _handler
+    logger = logging.getLogger('despegar')
+    logger.setLevel(getattr(logging, str(level).upper(), logging.INFO))
+    if _handler is None:
+        _handler = AsyncLogHandler(max_buffer=max_buffer)
+        _handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        logger.addHandler(_handler)
+        logger.propagate = False
+        atexit.register(_handler.flush)
+    return _handler
+
+
+def get_logger(name):
+    """Logger hijo de 'despegar' (p.ej. 'despegar.toqan')"""
+    return logging.getLogger(f"despegar.{name}")
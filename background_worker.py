@@ -0,0 +1,317 @@
+# background_worker.py - Worker de los jobs programados (notificaciones y pronósticos), uno por host
+#
+#   python background_worker.py             # sale si ya hay otro worker en este host
+#   python background_worker.py --standby   # espera el lock: toma el lugar del worker si se cae
+#   python background_worker.py --once      # un ciclo de cada job y termina (cron / pruebas)
+#
+# Los workers web (gunicorn o hypercorn) no corren estos jobs: mandan la actividad de los
+# usuarios por la cola local (SQLite) y aplican las notificaciones y pronósticos que publica
+# el worker. Un flock sobre WORKER_LOCK_PATH garantiza que haya uno solo por host.
+import argparse
+import asyncio
+import fcntl
+import os
+import signal
+import sys
+import threading
+import time
+
+from app_logging import get_logger
+from local_queue import ACTIVITY, FORECASTS, NOTIFICATIONS
+
+log = get_logger('worker')
+
+
+class WorkerLock:
+    """flock exclusivo sobre un archivo: lo tiene un solo proceso por host y se libera si muere"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def acquire(self, wait=False):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    def held_elsewhere(self):
+        """¿Hay un worker vivo con el lock? (lo prueban los workers web)"""
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        else:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            return False
+        finally:
+            os.close(fd)
+
+
+class BackgroundWorker:
+    """Dueño de los jobs programados del host: aplica la actividad que llega por la cola y publica resultados"""
+
+    def __init__(self, agent, scheduler, queue, poll_interval=1.0, retention=10800, batch_size=500):
+        self.agent = agent
+        self.scheduler = scheduler
+        self.queue = queue
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.batch_size = batch_size
+        self.applied = 0
+        self.published = {NOTIFICATIONS: 0, FORECASTS: 0}
+        self._outbox = {NOTIFICATIONS: [], FORECASTS: []}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._last_prune = 0.0
+
+    def _publish(self, topic, payload):
+        with self._lock:
+            self._outbox[topic].append(payload)
+
+    def _notified(self, user_id, notifications):
+        self._publish(NOTIFICATIONS, {'user_id': user_id, 'notifications': notifications})
+
+    def _forecast_fetched(self, city, slots):
+        self._publish(FORECASTS, {'city': city, 'slots': slots, 'fetched_at': time.time()})
+
+    def attach(self):
+        """Lo que generan los jobs sale por la cola además de quedar en este proceso"""
+        self.agent.notification_hub.on_publish = self._notified
+        self.agent.forecast_prefetcher.on_fetch = self._forecast_fetched
+        # Sesiones y caches del último snapshot de los workers web (solo lectura)
+        if self.agent.snapshots.restore():
+            self.agent.snapshots.fill()
+
+    def apply_activity(self):
+        """Sesiones y destinos nuevos que mandaron los workers web; devuelve cuántos mensajes"""
+        applied = 0
+        while True:
+            items = self.queue.take(ACTIVITY, self.batch_size)
+            if not items:
+                return applied
+            # Con un backend compartido (SQLite) la sesión ya la guardó el worker web
+            mirror = not self.agent.active_users.backend.shared
+            destinations = set()
+            for kind, user_id, context in items:
+                if mirror:
+                    if kind == 'chat':
+                        session = self.agent.active_users.record_chat(user_id, context)
+                    else:
+                        session = self.agent.active_users.update_context(user_id, context)
+                    destinations.add(session.destination)
+                else:
+                    destinations.add(context.get('destination'))
+            for destination in destinations:
+                self.agent.forecast_prefetcher.want(destination)
+            applied += len(items)
+            self.applied += len(items)
+
+    def flush(self):
+        with self._lock:
+            outbox, self._outbox = self._outbox, {NOTIFICATIONS: [], FORECASTS: []}
+        for topic, payloads in outbox.items():
+            self.queue.put_many(topic, payloads)
+            self.published[topic] += len(payloads)
+
+    def poll(self):
+        """Una vuelta del loop principal: actividad entrante, resultados salientes y limpieza"""
+        self.apply_activity()
+        self.flush()
+        now = time.time()
+        if now - self._last_prune >= 60:
+            self.queue.prune(now - self.retention)
+            self._last_prune = now
+
+    def run_once(self):
+        """Un ciclo de cada job, sin threads"""
+        self.attach()
+        self.apply_activity()
+        self.agent.forecast_prefetcher.run_cycle()
+        self.scheduler.run_cycle()
+        self.flush()
+
+    def run(self):
+        self.attach()
+        for name, target in (('notifications', self.scheduler.run_forever),
+                             ('forecasts', self.agent.forecast_prefetcher.run_forever)):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        log.info("worker_started pid=%s", os.getpid())
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception as e:
+                log.exception("worker_poll_error error=%s", e)
+        self.scheduler.stop()
+        self.agent.forecast_prefetcher.stop()
+        self.flush()
+        log.info("worker_stopped pid=%s", os.getpid())
+
+    def stop(self, *_):
+        self._stop.set()
+
+    def stats(self):
+        return {
+            'applied_activity': self.applied,
+            'published': dict(self.published),
+            'scheduler': self.scheduler.stats(),
+            'prefetch': self.agent.forecast_prefetcher.stats()
+        }
+
+
+class WorkerBridge:
+    """Lado web: manda la actividad al worker por la cola local y aplica lo que el worker publica"""
+
+    def __init__(self, agent, queue, lock, poll_interval=1.0, retention=10800, batch_size=500, max_outbox=10000):
+        self.agent = agent
+        self.queue = queue
+        self.lock = lock
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.batch_size = batch_size
+        self.max_outbox = max_outbox
+        self.sent = 0
+        self.dropped = 0
+        self.received = {NOTIFICATIONS: 0, FORECASTS: 0}
+        self.worker_alive = None
+        self._outbox = []
+        self._lock = threading.Lock()
+        # Notificaciones desde ahora; los pronósticos retenidos sirven para arrancar con la tabla llena
+        self._cursors = {NOTIFICATIONS: queue.last_id(NOTIFICATIONS), FORECASTS: 0}
+        self._stop = threading.Event()
+        self._last_prune = 0.0
+
+    def record(self, kind, user_id, context):
+        """Actividad de un usuario ('chat' o 'update'); sale en el próximo sync, en lote"""
+        with self._lock:
+            if len(self._outbox) >= self.max_outbox:
+                self.dropped += 1
+                return
+            self._outbox.append((kind, user_id, context))
+
+    def sync(self):
+        """Mandar la actividad acumulada y aplicar lo nuevo de la cola"""
+        alive = self.lock.held_elsewhere()
+        if alive != self.worker_alive:
+            if alive:
+                log.info("background_worker_up lock=%s", self.lock.path)
+            else:
+                log.warning("background_worker_down lock=%s", self.lock.path)
+            self.worker_alive = alive
+
+        with self._lock:
+            outbox, self._outbox = self._outbox, []
+        # Sin worker la actividad igual se encola: el que arranque la procesa (la vieja se poda)
+        self.queue.put_many(ACTIVITY, outbox)
+        self.sent += len(outbox)
+
+        for _, payload in self._read(NOTIFICATIONS):
+            self._deliver(payload)
+        for _, payload in self._read(FORECASTS):
+            self.agent.forecasts.put(payload['city'], payload['slots'], fetched_at=payload['fetched_at'])
+
+        now = time.time()
+        if now - self._last_prune >= 60:
+            self.queue.prune(now - self.retention)
+            self._last_prune = now
+
+    def _read(self, topic):
+        while True:
+            messages = self.queue.read(topic, self._cursors[topic], self.batch_size)
+            if not messages:
+                return
+            self._cursors[topic] = messages[-1][0]
+            self.received[topic] += len(messages)
+            yield from messages
+
+    def _deliver(self, payload):
+        # Con sesiones en memoria cada worker web encola solo a los usuarios que conoce
+        user_id = payload['user_id']
+        if user_id in self.agent.active_users:
+            self.agent.notification_hub.publish(user_id, payload['notifications'])
+
+    def run_forever(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.sync()
+            except Exception as e:
+                log.exception("worker_bridge_error error=%s", e)
+
+    async def arun_forever(self):
+        """Lo mismo para el modo ASGI: SQLite va a un thread"""
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await asyncio.to_thread(self.sync)
+            except Exception as e:
+                log.exception("worker_bridge_error error=%s", e)
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {
+            'worker_alive': self.worker_alive,
+            'lock_path': self.lock.path,
+            'activity_sent': self.sent,
+            'activity_dropped': self.dropped,
+            'received': dict(self.received)
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Jobs programados de Despegar AI Chat (uno por host)')
+    parser.add_argument('--standby', action='store_true', help='esperar el lock en vez de salir')
+    parser.add_argument('--once', action='store_true', help='un ciclo de cada job y salir')
+    args = parser.parse_args()
+
+    from config_free import FreeConfig
+    from local_queue import LocalQueue
+
+    lock = WorkerLock(FreeConfig.WORKER_LOCK_PATH)
+    if not lock.acquire(wait=args.standby):
+        print(f"⚠️ Ya hay un worker corriendo en este host (lock {FreeConfig.WORKER_LOCK_PATH})", file=sys.stderr)
+        sys.exit(1)
+
+    # El import arma el agente pero no arranca threads
+    from despegar_ai_chat_toqan_backend_REAL import ai_agent, notification_scheduler
+
+    worker = BackgroundWorker(
+        ai_agent,
+        notification_scheduler,
+        LocalQueue(FreeConfig.WORKER_QUEUE_PATH),
+        poll_interval=FreeConfig.WORKER_POLL_INTERVAL,
+        retention=FreeConfig.WORKER_QUEUE_RETENTION
+    )
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    try:
+        if args.once:
+            worker.run_once()
+        else:
+            worker.run()
+    finally:
+        lock.release()
+
+
+if __name__ == '__main__':
+    main()
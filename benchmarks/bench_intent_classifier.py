@@ -0,0 +1,86 @@
+# bench_intent_classifier.py - Precisión y costo por mensaje del clasificador de intenciones
+#
+#   python benchmarks/bench_intent_classifier.py [--rounds 2000]
+#
+# Compara el escaneo original por substrings (una lista de keywords por rama)
+# contra el índice precompilado de intent_classifier.py, usando el fixture
+# etiquetado intent_fixture.jsonl.
+import argparse
+import json
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from intent_classifier import IntentClassifier  # noqa: E402
+
+# INTENT_KEYWORDS tal como estaba antes del índice (matcheo por substring)
+LEGACY_KEYWORDS = [
+    ('weather', ['clima', 'tiempo', 'lluvia', 'temperatura']),
+    ('food', ['restaurante', 'comida', 'comer', 'almorzar', 'cenar']),
+    ('lodging', ['hotel', 'alojamiento', 'dormir', 'check']),
+    ('transport', ['transporte', 'metro', 'taxi', 'bus', 'movimiento']),
+    ('money', ['moneda', 'dinero', 'cambio', 'pagar']),
+    ('language', ['idioma', 'hablar', 'frases', 'comunicar']),
+    ('safety', ['seguridad', 'peligro', 'cuidado', 'emergencia']),
+    ('activities', ['actividades', 'hacer', 'visitar', 'turismo'])
+]
+
+
+def legacy_classify(message):
+    message_lower = message.lower()
+    for intent, keywords in LEGACY_KEYWORDS:
+        if any(word in message_lower for word in keywords):
+            return intent
+    return None
+
+
+def load_fixture(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def measure(classify, fixture, rounds):
+    correct = sum(1 for row in fixture if classify(row['message']) == row['intent'])
+    messages = [row['message'] for row in fixture]
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for message in messages:
+            classify(message)
+    elapsed = time.perf_counter() - started
+    return correct / len(fixture), elapsed / (rounds * len(messages)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=2000)
+    parser.add_argument('--fixture', default=os.path.join(HERE, 'intent_fixture.jsonl'))
+    parser.add_argument('--show-errors', action='store_true')
+    args = parser.parse_args()
+
+    fixture = load_fixture(args.fixture)
+    started = time.perf_counter()
+    classifier = IntentClassifier.from_file()
+    compile_ms = (time.perf_counter() - started) * 1000
+
+    print(f"📊 {len(fixture)} mensajes etiquetados, {args.rounds} rondas (índice compilado en {compile_ms:.2f} ms)")
+    print(f"{'clasificador':<14}{'precisión':>11}{'µs/mensaje':>13}")
+    # memo_size=0: cada palabra se pliega y resuelve de nuevo (peor caso, vocabulario siempre nuevo)
+    cold = IntentClassifier.from_file()
+    cold.memo_size = 0
+    runs = (('substrings', legacy_classify), ('precompilado', classifier.classify), ('sin memo', cold.classify))
+    for name, classify in runs:
+        accuracy, per_message = measure(classify, fixture, args.rounds)
+        print(f"{name:<14}{accuracy:>10.1%}{per_message:>13.2f}")
+
+    if args.show_errors:
+        for row in fixture:
+            got = classifier.classify(row['message'])
+            if got != row['intent']:
+                print(f"  ✗ {row['message']!r}: esperado {row['intent']}, obtenido {got}")
+
+
+if __name__ == '__main__':
+    main()
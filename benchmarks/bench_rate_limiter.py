@@ -0,0 +1,117 @@
+# bench_rate_limiter.py - Costo por request y memoria por key del rate limiter
+#
+#   python benchmarks/bench_rate_limiter.py [--requests 200000] [--threads 8]
+#
+# Mide TokenBucketLimiter.acquire() solo (sin Flask) con distintas cantidades de
+# keys activas, el costo extra sobre un request real del test client de Flask y
+# los bytes por bucket guardado.
+import argparse
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from rate_limiter import TokenBucketLimiter  # noqa: E402
+
+
+def per_call(limiter, keys, requests):
+    started = time.perf_counter()
+    for i in range(requests):
+        limiter.acquire(keys[i % len(keys)])
+    return (time.perf_counter() - started) / requests * 1e9
+
+
+def contended(limiter, keys, requests, threads):
+    per_thread = requests // threads
+
+    def worker(offset):
+        for i in range(per_thread):
+            limiter.acquire(keys[(i + offset) % len(keys)])
+
+    pool = [threading.Thread(target=worker, args=(n * 7919,)) for n in range(threads)]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return (time.perf_counter() - started) / (per_thread * threads) * 1e9
+
+
+def bytes_per_key(count):
+    limiter = TokenBucketLimiter(rate=1, burst=10, max_keys=count * 2)
+    keys = [f"user_{i}" for i in range(count)]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for key in keys:
+        limiter.acquire(key)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    grown = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    return grown / count
+
+
+def flask_overhead(requests):
+    """Mismo GET trivial con y sin pasar por rate_limited() (IP + usuario)"""
+    os.environ.setdefault('RATE_LIMIT_IP_PER_MINUTE', '1000000000')
+    os.environ.setdefault('RATE_LIMIT_IP_BURST', '1000000000')
+    import despegar_ai_chat_toqan_backend_REAL as backend
+
+    @backend.app.route('/bench/limited')
+    def bench_limited():
+        return backend.rate_limited('bench_user') or 'ok'
+
+    @backend.app.route('/bench/plain')
+    def bench_plain():
+        return 'ok'
+
+    client = backend.app.test_client()
+    results = {}
+    for path in ('/bench/plain', '/bench/limited'):
+        for _ in range(200):
+            client.get(path)
+        started = time.perf_counter()
+        for _ in range(requests):
+            client.get(path)
+        results[path] = (time.perf_counter() - started) / requests * 1e6
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--flask-requests', type=int, default=5000)
+    args = parser.parse_args()
+
+    print(f"📊 acquire() con {args.requests} requests")
+    print(f"{'keys activas':>14}{'ns/request':>13}{f'{args.threads} threads':>14}{'keys al final':>15}")
+    for active in (1, 1000, 100000):
+        keys = [f"user_{i}" for i in range(active)]
+        limiter = TokenBucketLimiter(rate=1000, burst=1000, max_keys=100000)
+        single = per_call(limiter, keys, args.requests)
+        limiter = TokenBucketLimiter(rate=1000, burst=1000, max_keys=100000)
+        threaded = contended(limiter, keys, args.requests, args.threads)
+        print(f"{active:>14}{single:>13.0f}{threaded:>14.0f}{len(limiter):>15}")
+
+    # Keys que no vuelven: con idle_ttl = burst/rate se desalojan solas
+    limiter = TokenBucketLimiter(rate=100, burst=1, max_keys=100000)
+    for i in range(50000):
+        limiter.acquire(f"one_shot_{i}")
+    time.sleep(limiter.idle_ttl)
+    limiter.acquire('trigger')
+    print(f"🧹 50000 keys de un solo uso tras {limiter.idle_ttl * 1000:.0f} ms inactivas -> {len(limiter)} en memoria")
+
+    print(f"💾 {bytes_per_key(50000):.0f} bytes por key")
+
+    timings = flask_overhead(args.flask_requests)
+    plain, limited = timings['/bench/plain'], timings['/bench/limited']
+    print(f"🌐 Flask test client: {plain:.1f} µs sin limiter, {limited:.1f} µs con limiter "
+          f"(+{limited - plain:.1f} µs por request)")
+
+
+if __name__ == '__main__':
+    main()
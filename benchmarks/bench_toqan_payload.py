@@ -0,0 +1,141 @@
+# bench_toqan_payload.py - CPU por request al armar el body de Toqan: f-string + dict + json vs template precodificado
+#
+#   python benchmarks/bench_toqan_payload.py [--requests 50000]
+#
+# "antes" es lo que hacía build_toqan_payload (prompt f-string, dict anidado,
+# varios datetime.now()) más la serialización que hace requests con json=.
+# "después" es ToqanPayloadEncoder con data/prompts.json, con orjson si está
+# instalado y con el json de la stdlib.
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import prompt_templates  # noqa: E402
+from prompt_templates import PromptTemplate, ToqanPayloadEncoder  # noqa: E402
+
+SPACE_ID = '29ba8bb2-ad08-48f0-9568-9e9fa1196173'
+
+CONTEXTS = [
+    {'user_id': f"user_{i}", 'session_id': f"session_user_{i}_1700000000.0", 'destination': destination,
+     'traveler_type': traveler_type, 'travel_phase': phase}
+    for i, (destination, traveler_type, phase) in enumerate([
+        ('Cancún, México', 'relax', 'exploring'),
+        ('París, Francia', 'romantico', 'booked'),
+        ('Tokio, Japón', 'aventura', 'traveling'),
+        ('Buenos Aires, Argentina', 'familia', 'returning')
+    ])
+]
+MESSAGES = ['¿Qué hacer hoy?', 'Recomendame un restaurante con comida típica cerca del centro', '¿Va a llover mañana?']
+HISTORY = "Usuario: ¿Dónde cambio dinero?\nAsistente: En las casas de cambio del centro 💱, evitá el aeropuerto."
+
+
+def legacy_payload(user_message, user_context, history):
+    """build_toqan_payload tal como estaba antes de los templates"""
+    history_section = f"""
+            HISTORIAL DE LA CONVERSACIÓN (del más viejo al más nuevo):
+{history}
+            """ if history else ''
+    travel_prompt = f"""
+            Eres un asistente experto de viajes para Despegar.com. Tu nombre es "Despegar AI Assistant".
+
+            CONTEXTO DEL USUARIO:
+            - Destino: {user_context.get('destination', 'No especificado')}
+            - Tipo de viajero: {user_context.get('traveler_type', 'general')}
+            - Fase del viaje: {user_context.get('travel_phase', 'planning')}
+            {history_section}
+            CONSULTA DEL USUARIO: {user_message}
+
+            INSTRUCCIONES:
+            - Responde de manera amigable, práctica y específica para viajes
+            - Usa emojis para hacer la conversación más amigable
+            - Sé conciso pero completo
+            - Si no tienes información exacta, sugiere alternativas
+            - Enfócate en ayudar con el viaje específico del usuario
+            - Usa el historial para entender preguntas de seguimiento, sin repetirlo
+            - Siempre incluye tips prácticos y útiles
+            """
+    payload = {
+        "message": travel_prompt,
+        "spaceId": SPACE_ID,
+        "sessionId": user_context.get('session_id', f"session_{datetime.now().timestamp()}"),
+        "userId": user_context.get('user_id', 'anonymous'),
+        "context": {
+            "destination": user_context.get('destination'),
+            "traveler_type": user_context.get('traveler_type'),
+            "travel_phase": user_context.get('travel_phase'),
+            "timestamp": datetime.now().isoformat()
+        }
+    }
+    # Lo que hace requests con json=payload
+    return json.dumps(payload, allow_nan=False).encode('utf-8')
+
+
+def measure(build, requests, history, repeat=20):
+    """Mejor de `repeat` vueltas (µs por request), pico de memoria y tamaño del body"""
+    cases = [(MESSAGES[i % len(MESSAGES)], CONTEXTS[i % len(CONTEXTS)]) for i in range(requests // repeat)]
+    for message, context in cases[:1000]:
+        build(message, context, history)
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for message, context in cases:
+            build(message, context, history)
+        best = min(best, time.perf_counter() - started)
+    per_request = best / len(cases) * 1e6
+
+    tracemalloc.start()
+    for message, context in cases[:2000]:
+        build(message, context, history)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    size = len(build(cases[0][0], cases[0][1], history))
+    return per_request, peak, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=50000)
+    args = parser.parse_args()
+
+    template = PromptTemplate.from_file()
+    encoder = ToqanPayloadEncoder(template, SPACE_ID)
+
+    def templated(message, context, history):
+        return encoder.encode(message, context, history=history)
+
+    sample = json.loads(templated(MESSAGES[0], CONTEXTS[0], HISTORY))
+    assert sample['context']['prompt_version'] == template.version
+    assert MESSAGES[0] in sample['message'] and CONTEXTS[0]['destination'] in sample['message']
+
+    # El mismo encoder con el json de la stdlib (como si orjson no estuviera instalado)
+    stdlib_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=str)
+    variants = [
+        ('antes (f-string + dict + json)', legacy_payload, None),
+        ('template + stdlib json', templated, lambda value: stdlib_encoder.encode(value).encode('utf-8'))
+    ]
+    if prompt_templates.orjson is not None:
+        variants.append(('template + orjson', templated, None))
+
+    print(f"📊 {args.requests} payloads, template v{template.version}, "
+          f"orjson {'sí' if prompt_templates.orjson else 'no'}")
+    print(f"{'variante':<32}{'historial':>10}{'µs/request':>12}{'pico KB':>10}{'bytes':>8}")
+    default_dumps = prompt_templates.dumps
+    for history in ('', HISTORY):
+        for name, build, dumps in variants:
+            prompt_templates.dumps = dumps or default_dumps
+            try:
+                per_request, peak, size = measure(build, args.requests, history)
+            finally:
+                prompt_templates.dumps = default_dumps
+            print(f"{name:<32}{'sí' if history else 'no':>10}{per_request:>12.2f}{peak / 1024:>10.1f}{size:>8}")
+
+
+if __name__ == '__main__':
+    main()
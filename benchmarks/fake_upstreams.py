@@ -0,0 +1,182 @@
+# fake_upstreams.py - Toqan y OpenWeatherMap falsos para benchmarks sin red
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+
+TOQAN_PATH = '/v1/chat'
+WEATHER_PATH = '/data/2.5/weather'
+FORECAST_PATH = '/data/2.5/forecast'
+STREAM_TOKENS = ['✈️ Respuesta ', 'simulada ', 'de Toqan ', 'para el ', 'benchmark.']
+
+
+# Todo el tráfico de un benchmark sale de 127.0.0.1: sin esto medirían el rate limiting
+UNLIMITED = '1000000000'
+BENCH_LIMITS = {
+    'RATE_LIMIT_IP_PER_MINUTE': UNLIMITED,
+    'RATE_LIMIT_IP_BURST': UNLIMITED,
+    'RATE_LIMIT_USER_PER_MINUTE': UNLIMITED,
+    'RATE_LIMIT_USER_BURST': UNLIMITED,
+    'TOQAN_DAILY_QUOTA': UNLIMITED,
+    'WEATHER_DAILY_QUOTA': UNLIMITED
+}
+
+
+def app_env(upstream, **overrides):
+    """Entorno para arrancar la app contra los upstreams falsos"""
+    return {
+        **os.environ,
+        'TOQAN_API_URL': upstream.toqan_url,
+        'WEATHER_API_URL': upstream.weather_url,
+        'WEATHER_FORECAST_API_URL': upstream.forecast_url,
+        'FLASK_DEBUG': 'false',
+        'SNAPSHOT_PATH': '',  # cada corrida arranca en frío
+        'BACKGROUND_JOBS': 'inline',  # sin background_worker.py aparte
+        **BENCH_LIMITS,
+        **overrides
+    }
+
+
+class FakeUpstreamServer:
+    """Servidor HTTP/1.1 keep-alive mínimo (asyncio) con latencia y errores configurables"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.5, weather_latency=0.05, error_rate=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.weather_latency = weather_latency
+        self.error_rate = error_rate
+        self.calls = Counter()
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    @property
+    def toqan_url(self):
+        return f"http://{self.host}:{self.port}{TOQAN_PATH}"
+
+    @property
+    def weather_url(self):
+        return f"http://{self.host}:{self.port}{WEATHER_PATH}"
+
+    @property
+    def forecast_url(self):
+        return f"http://{self.host}:{self.port}{FORECAST_PATH}"
+
+    def start(self):
+        """Arrancar el servidor en un thread propio y esperar a que escuche"""
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port, backlog=4096)
+            )
+            self.port = self._server.sockets[0].getsockname()[1]
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                method, target, _ = request_line.split(' ', 2)
+                headers = {}
+                for line in header_lines:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0) or 0)
+                body = await reader.readexactly(length) if length else b''
+
+                path = target.split('?', 1)[0]
+                if path == TOQAN_PATH and self._wants_stream(body):
+                    await self._stream_toqan(writer)
+                    continue
+
+                status, payload = await self._route(method, path, body)
+                data = json.dumps(payload).encode('utf-8')
+                writer.write(
+                    f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\nConnection: keep-alive\r\n\r\n".encode('latin-1') + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _wants_stream(body):
+        try:
+            return json.loads(body).get('stream') is True
+        except (ValueError, AttributeError):
+            return False
+
+    async def _stream_toqan(self, writer):
+        """Respuesta SSE chunked: la latencia total se reparte entre los tokens"""
+        self.calls[TOQAN_PATH] += 1
+        events = [f"data: {json.dumps({'delta': token})}\n\n" for token in STREAM_TOKENS]
+        events.append("data: [DONE]\n\n")
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+            b"Transfer-Encoding: chunked\r\nConnection: keep-alive\r\n\r\n"
+        )
+        for event in events:
+            await asyncio.sleep(self.latency / len(events))
+            chunk = event.encode('utf-8')
+            writer.write(f"{len(chunk):x}\r\n".encode('latin-1') + chunk + b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _route(self, method, path, body):
+        self.calls[path] += 1
+        failing = self.error_rate and random.random() < self.error_rate
+
+        if path == TOQAN_PATH and method == 'POST':
+            await asyncio.sleep(self.latency)
+            if failing:
+                return 503, {'error': 'injected'}
+            return 200, {'response': '✈️ Respuesta simulada de Toqan para el benchmark.'}
+
+        if path == WEATHER_PATH:
+            await asyncio.sleep(self.weather_latency)
+            if failing:
+                return 503, {'error': 'injected'}
+            return 200, {
+                'main': {'temp': 21.5, 'humidity': 60},
+                'weather': [{'id': 800, 'description': 'cielo claro'}],
+                'clouds': {'all': 10}
+            }
+
+        if path == FORECAST_PATH:
+            await asyncio.sleep(self.weather_latency)
+            if failing:
+                return 503, {'error': 'injected'}
+            # Slots de 3 horas desde la hora actual; llueve la tarde del día siguiente
+            start = int(time.time()) // 10800 * 10800
+            return 200, {'list': [{
+                'dt': start + i * 10800,
+                'main': {'temp': 21.5 - (i % 8) * 0.5, 'humidity': 60},
+                'weather': [{'id': 500 if 9 <= i <= 10 else 800,
+                             'description': 'lluvia ligera' if 9 <= i <= 10 else 'cielo claro'}],
+                'clouds': {'all': 90 if 8 <= i <= 11 else 10},
+                'pop': 0.8 if 9 <= i <= 10 else 0.05
+            } for i in range(16)]}
+
+        return 404, {'error': 'not found'}
@@ -0,0 +1,142 @@
+# load_test_async_vs_sync.py - Comparar la app Flask (gunicorn) contra el modo ASGI
+#
+#   python benchmarks/load_test_async_vs_sync.py --concurrency 1000 --requests 3000
+#
+# Levanta un Toqan/OpenWeatherMap falso con latencia fija, arranca cada app como
+# subproceso apuntando a él y dispara chats concurrentes contra /api/chat.
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import aiohttp
+
+from fake_upstreams import FakeUpstreamServer, app_env
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def start_app(command, env, base_url, timeout=30):
+    """Arrancar la app y esperar a que /api/health responda"""
+    proc = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{base_url}/api/health", timeout=1) as response:
+                if response.status == 200:
+                    return proc
+        except OSError:
+            pass
+        time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"La app no arrancó: {' '.join(command)}")
+
+
+async def drive(base_url, total, concurrency, timeout):
+    """Enviar `total` chats con `concurrency` en vuelo; devolver latencias y errores"""
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as client:
+        async def one(i):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    async with client.post(f"{base_url}/api/chat", json={
+                        'user_id': f"load_{i % concurrency}",
+                        'message': 'Qué hacer hoy',
+                        'context': {'destination': 'Cancún, México', 'traveler_type': 'relax', 'travel_phase': 'exploring'}
+                    }) as response:
+                        if response.status != 200 or not (await response.json()).get('success'):
+                            errors += 1
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - started
+
+    return latencies, errors, elapsed
+
+
+def run_case(name, command, env, args):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    command = [part.format(port=port) for part in command]
+    proc = start_app(command, env, base_url)
+    try:
+        latencies, errors, elapsed = asyncio.run(drive(base_url, args.requests, args.concurrency, args.timeout))
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+    return {
+        'name': name,
+        'rps': args.requests / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'errors': errors
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.5, help='latencia simulada de Toqan (s)')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--sync-workers', type=int, default=2)
+    parser.add_argument('--sync-threads', type=int, default=8)
+    parser.add_argument('--only', choices=['sync', 'async'])
+    args = parser.parse_args()
+
+    upstream = FakeUpstreamServer(latency=args.latency).start()
+    env = app_env(upstream)
+
+    cases = {
+        'sync (gunicorn)': [
+            sys.executable, '-m', 'gunicorn', '-w', str(args.sync_workers), '--threads', str(args.sync_threads),
+            '-b', '127.0.0.1:{port}', 'despegar_ai_chat_toqan_backend_REAL:app'
+        ],
+        'async (hypercorn)': [
+            sys.executable, '-m', 'hypercorn', '-b', '127.0.0.1:{port}', 'despegar_ai_chat_async:app'
+        ]
+    }
+
+    results = []
+    for name, command in cases.items():
+        if args.only and not name.startswith(args.only):
+            continue
+        results.append(run_case(name, command, env, args))
+    upstream.stop()
+
+    print(f"\n📊 {args.requests} chats, {args.concurrency} en vuelo, Toqan simulado a {args.latency}s")
+    print(f"{'modo':<20}{'req/s':>10}{'p50':>9}{'p95':>9}{'p99':>9}{'errores':>9}")
+    for r in results:
+        print(f"{r['name']:<20}{r['rps']:>10.1f}{r['p50']:>9.3f}{r['p95']:>9.3f}{r['p99']:>9.3f}{r['errors']:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+# replay.py - Reproducir una mezcla de requests grabada contra la app y los upstreams falsos
+#
+#   python benchmarks/replay.py [--mix benchmarks/mixes/default.jsonl] [--app both] [--requests 2000]
+#   python benchmarks/replay.py --app sync --max-p99 0.5 --min-rps 200 --json-out replay.json
+#
+# Cada línea del mix es {"method": "GET"|"POST", "path": "/api/...", "body": {...}}.
+# Las líneas se reparten en ciclo hasta completar --requests. Por endpoint se reporta
+# throughput y latencia p50/p95/p99; además las llamadas que recibieron los upstreams
+# falsos y cuánto creció la memoria (RSS) del proceso de la app y sus workers.
+# Con --max-p99 / --min-rps / --max-rss-growth sale con código 1 si algo empeoró,
+# para correrlo en CI sin red.
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+
+import aiohttp
+
+from fake_upstreams import FakeUpstreamServer, app_env
+from load_test_async_vs_sync import free_port, percentile, start_app
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+APPS = {
+    'sync': lambda args: [
+        sys.executable, '-m', 'gunicorn', '-w', str(args.sync_workers), '--threads', str(args.sync_threads),
+        '-b', '127.0.0.1:{port}', 'despegar_ai_chat_toqan_backend_REAL:app'
+    ],
+    'async': lambda args: [
+        sys.executable, '-m', 'hypercorn', '-b', '127.0.0.1:{port}', 'despegar_ai_chat_async:app'
+    ]
+}
+
+# /api/notifications/replay_3 y /api/notifications/replay_7 son el mismo endpoint
+_ENDPOINT_PARAMS = (
+    (re.compile(r"^/api/notifications/[^/]+"), '/api/notifications/<user_id>'),
+    (re.compile(r"^/api/weather/[^/]+"), '/api/weather/<city>')
+)
+
+
+def load_mix(path):
+    """Leer el mix JSONL (ignora líneas vacías y comentarios '#')"""
+    entries = []
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            entry = json.loads(line)
+            if 'path' not in entry:
+                raise ValueError(f"{path}:{number}: falta 'path'")
+            entry.setdefault('method', 'POST' if 'body' in entry else 'GET')
+            entry['endpoint'] = endpoint_name(entry['path'])
+            entries.append(entry)
+    if not entries:
+        raise ValueError(f"{path}: el mix está vacío")
+    return entries
+
+
+def endpoint_name(path):
+    path = path.split('?', 1)[0]
+    for pattern, name in _ENDPOINT_PARAMS:
+        if pattern.match(path):
+            return name
+    return path
+
+
+def process_rss(pid):
+    """RSS en bytes del proceso y todos sus descendientes (workers de gunicorn), leído de /proc"""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+async def replay(base_url, mix, total, concurrency, timeout):
+    """Enviar `total` requests del mix con `concurrency` en vuelo; latencias y errores por endpoint"""
+    latencies = {}
+    errors = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as client:
+        async def one(entry):
+            endpoint = entry['endpoint']
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    async with client.request(entry['method'], base_url + entry['path'],
+                                              json=entry.get('body')) as response:
+                        await response.read()
+                        failed = response.status != 200
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    failed = True
+                latencies.setdefault(endpoint, []).append(time.perf_counter() - started)
+                if failed:
+                    errors[endpoint] = errors.get(endpoint, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(mix[i % len(mix)]) for i in range(total)))
+        elapsed = time.perf_counter() - started
+
+    return latencies, errors, elapsed
+
+
+def run_app(name, mix, upstream, args):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    command = [part.format(port=port) for part in APPS[name](args)]
+    upstream.calls.clear()
+    proc = start_app(command, app_env(upstream), base_url)
+    try:
+        # Una vuelta de calentamiento para no medir imports perezosos ni caches vacías como crecimiento
+        asyncio.run(replay(base_url, mix, len(mix), args.concurrency, args.timeout))
+        rss_before = process_rss(proc.pid)
+        upstream.calls.clear()
+        latencies, errors, elapsed = asyncio.run(replay(base_url, mix, args.requests, args.concurrency, args.timeout))
+        rss_after = process_rss(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+    every = [value for values in latencies.values() for value in values]
+    return {
+        'app': name,
+        'requests': args.requests,
+        'elapsed_s': round(elapsed, 3),
+        'rps': round(args.requests / elapsed, 1) if elapsed else 0.0,
+        'p50': percentile(every, 50),
+        'p95': percentile(every, 95),
+        'p99': percentile(every, 99),
+        'errors': sum(errors.values()),
+        'endpoints': {
+            endpoint: {
+                'count': len(values),
+                'rps': round(len(values) / elapsed, 1) if elapsed else 0.0,
+                'p50': percentile(values, 50),
+                'p95': percentile(values, 95),
+                'p99': percentile(values, 99),
+                'errors': errors.get(endpoint, 0)
+            }
+            for endpoint, values in sorted(latencies.items())
+        },
+        'upstream_calls': dict(upstream.calls),
+        'rss_before_mb': round(rss_before / 1048576, 1),
+        'rss_growth_mb': round((rss_after - rss_before) / 1048576, 1)
+    }
+
+
+def print_report(result):
+    print(f"\n📊 {result['app']}: {result['requests']} requests en {result['elapsed_s']}s "
+          f"-> {result['rps']} req/s, p99 {result['p99'] * 1000:.1f} ms, {result['errors']} errores")
+    print(f"{'endpoint':<32}{'n':>7}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errores':>9}")
+    for endpoint, r in result['endpoints'].items():
+        print(f"{endpoint:<32}{r['count']:>7}{r['rps']:>9.1f}{r['p50'] * 1000:>9.1f}"
+              f"{r['p95'] * 1000:>9.1f}{r['p99'] * 1000:>9.1f}{r['errors']:>9}")
+    calls = ', '.join(f"{path}={count}" for path, count in sorted(result['upstream_calls'].items())) or 'ninguna'
+    print(f"🌐 llamadas a upstreams: {calls}")
+    print(f"💾 RSS {result['rss_before_mb']} MB tras el calentamiento, {result['rss_growth_mb']:+.1f} MB durante el replay")
+
+
+def regressions(result, args):
+    """Umbrales de CI que no se cumplen (lista vacía = ok)"""
+    failures = []
+    if args.max_p99 is not None and result['p99'] > args.max_p99:
+        failures.append(f"p99 {result['p99']:.3f}s > {args.max_p99}s")
+    if args.min_rps is not None and result['rps'] < args.min_rps:
+        failures.append(f"{result['rps']} req/s < {args.min_rps}")
+    if args.max_rss_growth is not None and result['rss_growth_mb'] > args.max_rss_growth:
+        failures.append(f"RSS +{result['rss_growth_mb']} MB > {args.max_rss_growth} MB")
+    if args.max_errors is not None and result['errors'] > args.max_errors:
+        failures.append(f"{result['errors']} errores > {args.max_errors}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--mix', default=os.path.join(HERE, 'mixes', 'default.jsonl'))
+    parser.add_argument('--app', choices=['sync', 'async', 'both'], default='both')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--latency', type=float, default=0.05, help='latencia simulada de Toqan (s)')
+    parser.add_argument('--weather-latency', type=float, default=0.02, help='latencia simulada de OpenWeather (s)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fracción de respuestas 5xx de los upstreams')
+    parser.add_argument('--sync-workers', type=int, default=2)
+    parser.add_argument('--sync-threads', type=int, default=8)
+    parser.add_argument('--json-out', help='guardar los resultados en este archivo')
+    parser.add_argument('--max-p99', type=float, help='falla si el p99 global supera estos segundos')
+    parser.add_argument('--min-rps', type=float, help='falla si el throughput queda por debajo')
+    parser.add_argument('--max-rss-growth', type=float, help='falla si el RSS crece más de estos MB')
+    parser.add_argument('--max-errors', type=int, help='falla si hay más requests con error')
+    args = parser.parse_args()
+
+    mix = load_mix(args.mix)
+    upstream = FakeUpstreamServer(latency=args.latency, weather_latency=args.weather_latency,
+                                  error_rate=args.error_rate).start()
+    apps = ['sync', 'async'] if args.app == 'both' else [args.app]
+    try:
+        results = [run_app(name, mix, upstream, args) for name in apps]
+    finally:
+        upstream.stop()
+
+    print(f"\n🔁 mix {os.path.relpath(args.mix)} ({len(mix)} líneas), {args.concurrency} en vuelo, "
+          f"Toqan a {args.latency}s, clima a {args.weather_latency}s, error_rate {args.error_rate}")
+    failed = False
+    for result in results:
+        print_report(result)
+        failures = regressions(result, args)
+        result['regressions'] = failures
+        for failure in failures:
+            print(f"❌ {result['app']}: {failure}")
+        failed = failed or bool(failures)
+
+    if args.json_out:
+        with open(args.json_out, 'w', encoding='utf-8') as f:
+            json.dump({'mix': args.mix, 'results': results}, f, indent=2, ensure_ascii=False)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
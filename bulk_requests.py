@@ -0,0 +1,135 @@
+# bulk_requests.py - Cuerpos JSON/NDJSON de los endpoints batch y resultados en NDJSON
+import json
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+NDJSON_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'  # cada línea sale apenas se calcula
+}
+
+
+def is_ndjson(mimetype):
+    return mimetype in (NDJSON_MIMETYPE, 'application/jsonl', 'application/json-seq')
+
+
+def ndjson_line(data):
+    return json.dumps(data, ensure_ascii=False) + '\n'
+
+
+def json_items(data, key):
+    """Ítems de un body JSON: un array o un objeto {key: [...]}; [(índice, ítem)]"""
+    if isinstance(data, dict):
+        data = data.get(key)
+    if not isinstance(data, list):
+        raise ValueError(f"Se esperaba un array o un objeto con '{key}'")
+    return list(enumerate(data))
+
+
+def parse_ndjson_line(index, line):
+    """(índice, ítem) de una línea NDJSON; None si la línea está vacía"""
+    if isinstance(line, bytes):
+        line = line.decode('utf-8', errors='replace')
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        return index, json.loads(line)
+    except ValueError:
+        return index, ValueError('JSON inválido')
+
+
+def ndjson_items(lines):
+    """Ítems de un body NDJSON a medida que llegan las líneas"""
+    for index, line in enumerate(lines):
+        item = parse_ndjson_line(index, line)
+        if item is not None:
+            yield item
+
+
+async def andjson_items(chunks):
+    """ndjson_items para un body que llega en chunks de bytes (Quart)"""
+    buffer = b''
+    index = 0
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            item = parse_ndjson_line(index, line)
+            index += 1
+            if item is not None:
+                yield item
+    item = parse_ndjson_line(index, buffer)
+    if item is not None:
+        yield item
+
+
+def batched(items, size):
+    """Agrupar en listas de a `size` sin leer más de lo necesario"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def abatched(items, size):
+    """batched para un body NDJSON async (Quart) o una lista ya parseada"""
+    if not hasattr(items, '__aiter__'):
+        for batch in batched(items, size):
+            yield batch
+        return
+    batch = []
+    async for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def parse_context_update(item):
+    """{"user_id": ..., "context": {...}} -> (user_id, context)"""
+    if isinstance(item, Exception):
+        raise item
+    if not isinstance(item, dict):
+        raise ValueError('Se esperaba un objeto {"user_id", "context"}')
+    user_id = item.get('user_id')
+    context = item.get('context', {})
+    if not user_id or not isinstance(user_id, str):
+        raise ValueError('Falta user_id')
+    if not isinstance(context, dict):
+        raise ValueError('context debe ser un objeto')
+    return user_id, context
+
+
+def parse_user_id(item):
+    """Acepta 'user_1' o {"user_id": "user_1"}"""
+    if isinstance(item, Exception):
+        raise item
+    if isinstance(item, dict):
+        item = item.get('user_id')
+    if not item or not isinstance(item, str):
+        raise ValueError('Falta user_id')
+    return item
+
+
+def ndjson_lines(records):
+    """Varias líneas en un solo chunk, en el orden del body"""
+    return ''.join(ndjson_line(record) for record in sorted(records, key=lambda record: record['index']))
+
+
+def split_valid(batch, parse):
+    """Separar un lote en ([(índice, valor)], [líneas de error])"""
+    valid = []
+    errors = []
+    for index, item in batch:
+        try:
+            valid.append((index, parse(item)))
+        except ValueError as e:
+            errors.append({'index': index, 'success': False, 'error': str(e)})
+    return valid, errors
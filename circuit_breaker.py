@@ -0,0 +1,126 @@
+# circuit_breaker.py - Circuit breaker con umbrales de error y de latencia para Toqan
+import threading
+import time
+from collections import deque
+
+from app_logging import get_logger
+
+log = get_logger('breaker')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Ventana de los últimos N llamados; abre por tasa de errores o de llamados lentos"""
+
+    def __init__(self, name, window=20, min_calls=5, error_threshold=0.5, slow_call_seconds=5.0,
+                 slow_threshold=0.5, open_seconds=30.0, half_open_probes=1, clock=time.monotonic):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_threshold = error_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_threshold = slow_threshold
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)  # (falló, lento) por llamado
+        self._opened_at = 0.0
+        self._probes = 0  # probes en vuelo durante half_open
+
+        self.state = CLOSED
+        self.transitions = {}
+        self.short_circuited = 0
+        self.last_error = None
+
+    def allow(self):
+        """¿Se puede llamar al upstream? False = ir directo al fallback local"""
+        with self._lock:
+            if self.state == OPEN:
+                if self._clock() - self._opened_at < self.open_seconds:
+                    self.short_circuited += 1
+                    return False
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_probes:
+                    self.short_circuited += 1
+                    return False
+                self._probes += 1
+            return True
+
+    def record_success(self, latency):
+        """Llamado OK; si tardó más de slow_call_seconds cuenta como lento"""
+        self._record(False, latency >= self.slow_call_seconds, None)
+
+    def record_failure(self, error):
+        """Timeout, error de conexión o status != 200"""
+        self._record(True, False, str(error))
+
+    def release(self):
+        """Llamado abandonado sin resultado (cliente desconectado): solo libera el probe"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes = max(self._probes - 1, 0)
+
+    def _record(self, failed, slow, error):
+        with self._lock:
+            if error is not None:
+                self.last_error = error
+            if self.state == HALF_OPEN:
+                self._probes = max(self._probes - 1, 0)
+                if failed or slow:
+                    self._open()
+                else:
+                    self._outcomes.clear()
+                    self._transition(CLOSED)
+                return
+            if self.state == OPEN:
+                # Llamado admitido antes de abrir; ya no cambia nada
+                return
+
+            self._outcomes.append((failed, slow))
+            calls = len(self._outcomes)
+            if calls < self.min_calls:
+                return
+            failures = sum(1 for f, _ in self._outcomes if f)
+            slow_calls = sum(1 for _, s in self._outcomes if s)
+            if failures / calls >= self.error_threshold or slow_calls / calls >= self.slow_threshold:
+                self._open()
+
+    def _open(self):
+        self._opened_at = self._clock()
+        self._probes = 0
+        self._transition(OPEN)
+        log.warning("breaker_open name=%s open_seconds=%.0f last_error=%s", self.name, self.open_seconds, self.last_error)
+
+    def _transition(self, state):
+        key = f"{self.state}->{state}"
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        self.state = state
+
+    def stats(self):
+        """Métricas para /api/health y /api/test-toqan"""
+        with self._lock:
+            calls = len(self._outcomes)
+            retry_in = 0.0
+            if self.state == OPEN:
+                retry_in = max(self.open_seconds - (self._clock() - self._opened_at), 0.0)
+            return {
+                'state': self.state,
+                'window_calls': calls,
+                'error_rate': round(sum(1 for f, _ in self._outcomes if f) / calls, 4) if calls else 0.0,
+                'slow_rate': round(sum(1 for _, s in self._outcomes if s) / calls, 4) if calls else 0.0,
+                'short_circuited': self.short_circuited,
+                'transitions': dict(self.transitions),
+                'retry_in_seconds': round(retry_in, 2),
+                'last_error': self.last_error,
+                'thresholds': {
+                    'error_rate': self.error_threshold,
+                    'slow_rate': self.slow_threshold,
+                    'slow_call_seconds': self.slow_call_seconds,
+                    'min_calls': self.min_calls,
+                    'open_seconds': self.open_seconds
+                }
+            }
@@ -19,6 +19,10 @@ class FreeConfig:
     HOST = os.getenv('HOST', '0.0.0.0')
     PORT = int(os.getenv('PORT', 5000))
     
+    # Logging asíncrono (DEBUG muestra cada request a Toqan)
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_BUFFER_SIZE = int(os.getenv('LOG_BUFFER_SIZE', 10000))  # registros en cola antes de descartar
+    
     # Configuración de CORS
     ALLOWED_ORIGINS = [
         'https://www.despegar.com',
@@ -28,9 +32,110 @@ class FreeConfig:
     
     # Configuración optimizada para versión gratuita
     NOTIFICATION_INTERVAL = int(os.getenv('NOTIFICATION_INTERVAL', 600))  # 10 minutos
+    # 'worker': notificaciones y pronósticos en `python background_worker.py` (uno por host, con lock);
+    # 'inline': en el mismo proceso web (un solo proceso, p.ej. desarrollo)
+    BACKGROUND_JOBS = os.getenv('BACKGROUND_JOBS', 'worker')
+    WORKER_LOCK_PATH = os.getenv('WORKER_LOCK_PATH', 'background_worker.lock')
+    WORKER_QUEUE_PATH = os.getenv('WORKER_QUEUE_PATH', 'background_queue.db')  # cola local web <-> worker
+    WORKER_POLL_INTERVAL = float(os.getenv('WORKER_POLL_INTERVAL', 1.0))  # segundos
+    WORKER_QUEUE_RETENTION = int(os.getenv('WORKER_QUEUE_RETENTION', 10800))  # mensajes más viejos se borran
     MAX_ACTIVE_USERS = int(os.getenv('MAX_ACTIVE_USERS', 100))
+    SESSION_IDLE_TTL = int(os.getenv('SESSION_IDLE_TTL', 86400))  # desalojar tras 24h sin actividad
+    # 'memory' (por proceso) o 'sqlite' (compartido entre workers de gunicorn del mismo host)
+    SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'memory')
+    SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', 'sessions.db')
+    # Snapshot de sesiones y caches para arrancar en caliente ('' lo desactiva); con varios workers gana el último
+    SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', 'warm_state.snap')
+    SNAPSHOT_INTERVAL = int(os.getenv('SNAPSHOT_INTERVAL', 300))  # además se guarda al apagar
     CACHE_RESPONSES = True
     
+    # Historial de conversación por usuario (en memoria del proceso) que va en el prompt
+    HISTORY_MAX_TURNS = int(os.getenv('HISTORY_MAX_TURNS', 12))  # preguntas + respuestas
+    HISTORY_MAX_TOKENS = int(os.getenv('HISTORY_MAX_TOKENS', 700))  # estimado, ~4 caracteres por token
+    HISTORY_MAX_CHARS = int(os.getenv('HISTORY_MAX_CHARS', 2800))
+    HISTORY_TURN_MAX_CHARS = int(os.getenv('HISTORY_TURN_MAX_CHARS', 500))  # respuestas largas se cortan
+    HISTORY_MAX_SESSIONS = int(os.getenv('HISTORY_MAX_SESSIONS', 1000))
+    
+    # Tabla de keywords del fallback (orden = prioridad)
+    INTENTS_PATH = os.getenv('INTENTS_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'intents.json'))
+    # Prompt de Toqan versionado (se compila al arrancar)
+    PROMPTS_PATH = os.getenv('PROMPTS_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'prompts.json'))
+    
+    # Notificaciones push (SSE)
+    NOTIFICATION_QUEUE_SIZE = int(os.getenv('NOTIFICATION_QUEUE_SIZE', 50))  # por usuario
+    NOTIFICATION_DEDUP_WINDOW = int(os.getenv('NOTIFICATION_DEDUP_WINDOW', 10800))  # 3 horas
+    NOTIFICATION_KEEPALIVE = int(os.getenv('NOTIFICATION_KEEPALIVE', 15))  # segundos
+    NOTIFICATION_FETCH_PARALLELISM = int(os.getenv('NOTIFICATION_FETCH_PARALLELISM', 8))  # ciudades a la vez
+    NOTIFICATION_ACTIVE_WINDOW = int(os.getenv('NOTIFICATION_ACTIVE_WINDOW', 7200))  # 2 horas
+    
+    # Endpoints batch: ítems por lote (un lock / una transacción por lote)
+    BULK_BATCH_SIZE = int(os.getenv('BULK_BATCH_SIZE', 500))
+    
+    # Cache de clima por ciudad (ahorra calls del free tier)
+    WEATHER_CACHE_TTL = int(os.getenv('WEATHER_CACHE_TTL', 600))  # segundos
+    WEATHER_CACHE_MAX_ENTRIES = int(os.getenv('WEATHER_CACHE_MAX_ENTRIES', 256))
+    
+    # Pronóstico (/data/2.5/forecast) de los destinos activos, traído en background
+    FORECAST_PREFETCH_INTERVAL = int(os.getenv('FORECAST_PREFETCH_INTERVAL', 900))  # segundos entre ciclos
+    FORECAST_REFRESH_AFTER = int(os.getenv('FORECAST_REFRESH_AFTER', 1800))  # re-traer una ciudad pasado esto
+    FORECAST_MAX_AGE = int(os.getenv('FORECAST_MAX_AGE', 10800))  # no servir pronósticos más viejos
+    FORECAST_ALERT_HOURS = int(os.getenv('FORECAST_ALERT_HOURS', 6))  # ventana de la alerta de lluvia
+    FORECAST_SLOTS = int(os.getenv('FORECAST_SLOTS', 16))  # slots de 3 horas por request (48 h)
+    FORECAST_MAX_CITIES = int(os.getenv('FORECAST_MAX_CITIES', 256))
+    FORECAST_MAX_CITIES_PER_CYCLE = int(os.getenv('FORECAST_MAX_CITIES_PER_CYCLE', 50))  # cuida la cuota diaria
+    FORECAST_PREFETCH_PARALLELISM = int(os.getenv('FORECAST_PREFETCH_PARALLELISM', 4))
+    
+    # Cache de respuestas de Toqan: TTL (segundos) por intención del mensaje
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 2000))
+    RESPONSE_CACHE_TTLS = {
+        'weather': 900,  # el clima cambia rápido
+        'food': 6 * 3600,
+        'lodging': 24 * 3600,
+        'transport': 24 * 3600,
+        'money': 6 * 3600,
+        'language': 7 * 24 * 3600,  # las frases útiles no cambian
+        'safety': 24 * 3600,
+        'activities': 24 * 3600,
+        'general': 3600
+    }
+    
+    # Pool HTTP keep-alive por upstream (timeouts en segundos)
+    TOQAN_POOL_SIZE = int(os.getenv('TOQAN_POOL_SIZE', 20))
+    TOQAN_CONNECT_TIMEOUT = float(os.getenv('TOQAN_CONNECT_TIMEOUT', 3))
+    TOQAN_READ_TIMEOUT = float(os.getenv('TOQAN_READ_TIMEOUT', 15))
+    WEATHER_POOL_SIZE = int(os.getenv('WEATHER_POOL_SIZE', 10))
+    WEATHER_CONNECT_TIMEOUT = float(os.getenv('WEATHER_CONNECT_TIMEOUT', 2))
+    WEATHER_READ_TIMEOUT = float(os.getenv('WEATHER_READ_TIMEOUT', 5))
+    # Presupuesto de latencia de Toqan: acota el read timeout (antes 15s por request)
+    TOQAN_LATENCY_BUDGET = float(os.getenv('TOQAN_LATENCY_BUDGET', 8))
+    HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', 2))
+    HTTP_BACKOFF_BASE = float(os.getenv('HTTP_BACKOFF_BASE', 0.2))
+    
+    # Circuit breaker de Toqan: abierto = fallback local inmediato
+    TOQAN_BREAKER_WINDOW = int(os.getenv('TOQAN_BREAKER_WINDOW', 20))  # últimos N llamados
+    TOQAN_BREAKER_MIN_CALLS = int(os.getenv('TOQAN_BREAKER_MIN_CALLS', 5))
+    TOQAN_BREAKER_ERROR_RATE = float(os.getenv('TOQAN_BREAKER_ERROR_RATE', 0.5))
+    TOQAN_BREAKER_SLOW_CALL = float(os.getenv('TOQAN_BREAKER_SLOW_CALL', 5))  # segundos
+    TOQAN_BREAKER_SLOW_RATE = float(os.getenv('TOQAN_BREAKER_SLOW_RATE', 0.5))
+    TOQAN_BREAKER_OPEN_SECONDS = float(os.getenv('TOQAN_BREAKER_OPEN_SECONDS', 30))
+    TOQAN_BREAKER_HALF_OPEN_PROBES = int(os.getenv('TOQAN_BREAKER_HALF_OPEN_PROBES', 1))
+    
+    # Rate limiting por token bucket (por proceso) en /api/chat, /api/weather y /api/test-toqan
+    RATE_LIMIT_USER_PER_MINUTE = float(os.getenv('RATE_LIMIT_USER_PER_MINUTE', 20))
+    RATE_LIMIT_USER_BURST = int(os.getenv('RATE_LIMIT_USER_BURST', 10))
+    RATE_LIMIT_IP_PER_MINUTE = float(os.getenv('RATE_LIMIT_IP_PER_MINUTE', 60))
+    RATE_LIMIT_IP_BURST = int(os.getenv('RATE_LIMIT_IP_BURST', 30))
+    RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', 100000))
+    
+    # Cuota diaria por upstream (por proceso); pasado QUOTA_SOFT_RATIO se estira el cache
+    WEATHER_DAILY_QUOTA = int(os.getenv('WEATHER_DAILY_QUOTA', 1000))  # free tier de OpenWeatherMap
+    TOQAN_DAILY_QUOTA = int(os.getenv('TOQAN_DAILY_QUOTA', 10000))
+    QUOTA_SOFT_RATIO = float(os.getenv('QUOTA_SOFT_RATIO', 0.8))
+    
+    # Modo ASGI: un proceso mantiene muchas más conexiones en vuelo
+    ASYNC_TOQAN_POOL_SIZE = int(os.getenv('ASYNC_TOQAN_POOL_SIZE', 500))
+    ASYNC_WEATHER_POOL_SIZE = int(os.getenv('ASYNC_WEATHER_POOL_SIZE', 50))
+    
     @classmethod
     def validate(cls):
         print("✅ Configuración 100% GRATUITA validada")
@@ -0,0 +1,172 @@
+# conversation_history.py - Historial de conversación acotado por usuario para el prompt de Toqan
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+from warm_snapshot import SnapshotMixin
+
+ROLE_LABELS = {'user': 'Usuario', 'assistant': 'Asistente'}
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def estimate_tokens(text):
+    """Aproximación barata (~4 caracteres por token) sin depender de un tokenizer"""
+    return (len(text) + 3) // 4
+
+
+def clip(text, max_chars):
+    """Colapsar espacios y cortar en max_chars con '…'"""
+    text = _WHITESPACE.sub(' ', text or '').strip()
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars - 1].rstrip() + '…'
+
+
+class ConversationLog:
+    """Ring buffer de turnos ya renderizados, con totales de caracteres y tokens"""
+    __slots__ = ('turns', 'chars', 'tokens', 'topics', 'last_seen', 'rendered')
+
+    def __init__(self, max_topics):
+        self.turns = deque()  # (línea renderizada, tokens, tema si era del usuario)
+        self.chars = 0
+        self.tokens = 0
+        self.topics = deque(maxlen=max_topics)  # resumen: preguntas que ya salieron del buffer
+        self.last_seen = 0.0
+        self.rendered = None  # texto armado una vez por cambio, no por prompt
+
+
+class ConversationStore(SnapshotMixin):
+    """Historial por usuario con presupuesto de tokens/caracteres y desalojo LRU + inactividad"""
+    SNAPSHOT_ENTRIES = '_logs'
+    SNAPSHOT_CAPACITY = 'max_sessions'
+
+    def __init__(self, max_sessions=1000, idle_ttl=86400, max_turns=12, max_tokens=700, max_chars=2800,
+                 turn_max_chars=500, max_topics=4, topic_max_chars=80, clock=time.time):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.max_chars = max_chars
+        self.turn_max_chars = turn_max_chars
+        self.max_topics = max_topics
+        self.topic_max_chars = topic_max_chars
+        self._clock = clock
+        self._logs = OrderedDict()  # user_id -> ConversationLog, el menos reciente primero
+        self._lock = threading.Lock()
+        self.turns_dropped = 0
+        self.evictions = 0
+
+    def append_exchange(self, user_id, user_message, ai_response):
+        """Agregar pregunta y respuesta; los turnos viejos salen del buffer y quedan como temas"""
+        now = self._clock()
+        with self._lock:
+            log = self._logs.get(user_id) or self._fault_in(user_id)
+            if log is None:
+                log = self._logs[user_id] = ConversationLog(self.max_topics)
+            else:
+                self._logs.move_to_end(user_id)
+            log.last_seen = now
+            self._append(log, 'user', user_message)
+            self._append(log, 'assistant', ai_response)
+            log.rendered = None
+            self._evict(now)
+
+    def _append(self, log, role, text):
+        text = clip(text, self.turn_max_chars)
+        line = f"{ROLE_LABELS[role]}: {text}"
+        topic = clip(text, self.topic_max_chars) if role == 'user' else None
+        log.turns.append((line, estimate_tokens(line), topic))
+        log.chars += len(line)
+        log.tokens += log.turns[-1][1]
+        # Siempre queda al menos el último turno, aunque solo exceda el presupuesto
+        while len(log.turns) > 1 and (len(log.turns) > self.max_turns or
+                                      log.tokens > self.max_tokens or log.chars > self.max_chars):
+            self._drop_oldest(log)
+
+    def _drop_oldest(self, log):
+        line, tokens, topic = log.turns.popleft()
+        log.chars -= len(line)
+        log.tokens -= tokens
+        if topic:
+            log.topics.append(topic)
+        self.turns_dropped += 1
+
+    def render(self, user_id):
+        """Historial listo para el prompt ('' si no hay); se arma una vez por intercambio"""
+        if not user_id:
+            return ''
+        with self._lock:
+            log = self._logs.get(user_id) or self._fault_in(user_id)
+            if log is None:
+                return ''
+            if log.rendered is None:
+                lines = []
+                if log.topics:
+                    lines.append(f"(Antes preguntó por: {'; '.join(log.topics)})")
+                lines.extend(line for line, _, _ in log.turns)
+                log.rendered = '\n'.join(lines)
+            return log.rendered
+
+    def has_history(self, user_id):
+        if not user_id:
+            return False
+        if user_id in self._logs:
+            return True
+        if self._snapshot is None:
+            return False
+        with self._lock:
+            return self._fault_in(user_id) is not None
+
+    def forget(self, user_id):
+        with self._lock:
+            self._logs.pop(user_id, None)
+            self._snapshot_discard(user_id)
+
+    def evict(self):
+        with self._lock:
+            self._evict(self._clock())
+
+    def _evict(self, now):
+        idle_before = now - self.idle_ttl
+        logs = self._logs
+        while logs:
+            user_id = next(iter(logs))
+            if len(logs) <= self.max_sessions and logs[user_id].last_seen >= idle_before:
+                break
+            del logs[user_id]
+            self.evictions += 1
+
+    def encode_snapshot(self, log, now):
+        return [list(log.turns), list(log.topics), log.last_seen]
+
+    def decode_snapshot(self, user_id, value, now):
+        turns, topics, last_seen = value
+        if last_seen < now - self.idle_ttl:
+            return None
+        log = ConversationLog(self.max_topics)
+        for line, tokens, topic in turns:
+            log.turns.append((line, tokens, topic))
+            log.chars += len(line)
+            log.tokens += tokens
+        log.topics.extend(topics)
+        log.last_seen = last_seen
+        return log
+
+    def __len__(self):
+        return len(self._logs)
+
+    def stats(self):
+        """Métricas para /api/health"""
+        with self._lock:
+            sessions = len(self._logs)
+            tokens = sum(log.tokens for log in self._logs.values())
+            return {
+                'sessions': sessions,
+                'max_sessions': self.max_sessions,
+                'avg_tokens': round(tokens / sessions, 1) if sessions else 0.0,
+                'budget': {'turns': self.max_turns, 'tokens': self.max_tokens, 'chars': self.max_chars},
+                'turns_dropped': self.turns_dropped,
+                'evictions': self.evictions
+            }
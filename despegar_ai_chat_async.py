@@ -0,0 +1,633 @@
+# despegar_ai_chat_async.py - MODO ASGI (Quart + aiohttp) PARA MILES DE CHATS EN VUELO
+#
+# Mismas rutas que despegar_ai_chat_toqan_backend_REAL.py, pero las llamadas a
+# Toqan y OpenWeatherMap no bloquean: un solo proceso mantiene miles de chats
+# esperando a Toqan sin ocupar un worker por cada uno.
+#
+#   hypercorn despegar_ai_chat_async:app --bind 0.0.0.0:5000
+import asyncio
+import time
+from datetime import datetime
+from functools import partial
+
+from quart import Quart, Response, g, render_template, request, jsonify, stream_with_context
+from quart_cors import cors
+
+from app_logging import get_logger
+from bulk_requests import (
+    NDJSON_HEADERS,
+    NDJSON_MIMETYPE,
+    abatched,
+    andjson_items,
+    is_ndjson,
+    json_items,
+    ndjson_line,
+    ndjson_lines,
+    parse_context_update,
+    parse_user_id,
+    split_valid,
+)
+from config_free import FreeConfig
+from http_clients import AsyncUpstreamClient
+from notification_scheduler import NotificationScheduler
+from streaming import SSE_HEADERS, STREAM_DONE, is_event_stream, parse_toqan_stream_line, sse_event
+from weather_forecast import parse_forecast
+from despegar_ai_chat_toqan_backend_REAL import (
+    DespegarAIAgent,
+    TOQAN_API_KEY,
+    TOQAN_API_URL,
+    TOQAN_SPACE_ID,
+    TOQAN_WORKSPACE_URL,
+    WEATHER_API_URL,
+    WEATHER_FORECAST_API_URL,
+    background_mode,
+    build_worker_bridge,
+    log_handler,
+    rate_limit_body,
+)
+
+app = Quart(__name__)
+app = cors(app)
+
+log = get_logger('toqan')
+
+
+class AsyncDespegarAIAgent(DespegarAIAgent):
+    """DespegarAIAgent con I/O no bloqueante hacia Toqan y OpenWeatherMap"""
+
+    def __init__(self):
+        super().__init__()
+        # Los clientes aiohttp se crean dentro del event loop (ver startup)
+        self.async_toqan_client = None
+        self.async_weather_client = None
+
+    async def start(self):
+        self.async_toqan_client = AsyncUpstreamClient(
+            'toqan',
+            pool_size=FreeConfig.ASYNC_TOQAN_POOL_SIZE,
+            connect_timeout=FreeConfig.TOQAN_CONNECT_TIMEOUT,
+            read_timeout=min(FreeConfig.TOQAN_READ_TIMEOUT, FreeConfig.TOQAN_LATENCY_BUDGET),
+            max_retries=FreeConfig.HTTP_MAX_RETRIES,
+            backoff_base=FreeConfig.HTTP_BACKOFF_BASE,
+            headers={
+                "Authorization": f"Bearer {TOQAN_API_KEY}",
+                "Content-Type": "application/json",
+                "User-Agent": "Despegar-AI-Chat/1.0"
+            },
+            on_response=partial(self.observe_upstream, 'toqan')
+        )
+        self.async_weather_client = AsyncUpstreamClient(
+            'openweathermap',
+            pool_size=FreeConfig.ASYNC_WEATHER_POOL_SIZE,
+            connect_timeout=FreeConfig.WEATHER_CONNECT_TIMEOUT,
+            read_timeout=FreeConfig.WEATHER_READ_TIMEOUT,
+            max_retries=FreeConfig.HTTP_MAX_RETRIES,
+            backoff_base=FreeConfig.HTTP_BACKOFF_BASE,
+            on_response=partial(self.observe_upstream, 'openweathermap')
+        )
+
+    async def stop(self):
+        await self.async_toqan_client.aclose()
+        await self.async_weather_client.aclose()
+
+    async def aget_weather_data(self, city):
+        """get_weather_data sin bloquear (mismo pronóstico y cache por ciudad)"""
+        forecast = self.forecasts.weather(city)
+        if forecast is not None:
+            return forecast
+        if not FreeConfig.CACHE_RESPONSES:
+            return await self.afetch_weather_data(city)
+        return await self.weather_cache.aget_or_fetch(city, self.afetch_weather_data)
+
+    async def afetch_forecast(self, city):
+        """fetch_forecast sin bloquear"""
+        if not self.weather_quota.try_acquire():
+            return None
+        try:
+            response = await self.async_weather_client.get(WEATHER_FORECAST_API_URL, params=self.forecast_params(city))
+            if response.status_code == 200:
+                return parse_forecast(response.json())
+            log.warning("forecast_error city=%s status=%s", city, response.status_code)
+        except Exception as e:
+            log.warning("forecast_error city=%s error=%s", city, e)
+        return None
+
+    async def afetch_weather_data(self, city):
+        if not self.weather_quota.try_acquire():
+            return self.fallback_weather_data()
+        try:
+            response = await self.async_weather_client.get(WEATHER_API_URL, params=self.weather_params(city))
+            if response.status_code == 200:
+                return self.parse_weather_data(response.json())
+        except Exception as e:
+            log.warning("weather_error city=%s error=%s", city, e)
+
+        return self.fallback_weather_data()
+
+    async def aget_toqan_response(self, user_message, user_context, use_cache=True):
+        """get_toqan_response sin bloquear"""
+        cache_key = self.response_cache_key(user_message, user_context, use_cache)
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                self.toqan_responses.inc('cached')
+                return cached
+
+        if not self.toqan_call_allowed():
+            self.toqan_responses.inc('fallback')
+            return await self.agenerate_smart_fallback_response(user_message, user_context)
+
+        try:
+            started = time.perf_counter()
+            response = await self.async_toqan_client.post(
+                TOQAN_API_URL,
+                data=self.build_toqan_payload(user_message, user_context)
+            )
+            if response.status_code == 200:
+                ai_response = self.parse_toqan_response(response.json())
+                latency = time.perf_counter() - started
+                self.toqan_breaker.record_success(latency)
+                self.remember_toqan_response(cache_key, user_message, ai_response, latency)
+                self.toqan_responses.inc('success')
+                return ai_response
+            log.warning("toqan_error status=%s", response.status_code)
+            self.toqan_breaker.record_failure(f"HTTP {response.status_code}")
+        except asyncio.CancelledError:
+            self.toqan_breaker.release()
+            raise
+        except Exception as e:
+            log.warning("toqan_exception error=%s", e)
+            self.toqan_breaker.record_failure(e)
+
+        self.toqan_responses.inc('error')
+
+        return await self.agenerate_smart_fallback_response(user_message, user_context)
+
+    async def astream_toqan_response(self, user_message, user_context, use_cache=True):
+        """stream_toqan_response sin bloquear (async generator)"""
+        cache_key = self.response_cache_key(user_message, user_context, use_cache)
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                self.toqan_responses.inc('cached')
+                yield cached
+                return
+
+        sent_any = False
+        outcome = 'fallback'
+
+        if self.toqan_call_allowed():
+            outcome = 'error'  # hasta que llegue el primer chunk
+            toqan_payload = self.build_toqan_payload(user_message, user_context, stream=True)
+            try:
+                started = time.perf_counter()
+                async with self.async_toqan_client.stream('POST', TOQAN_API_URL, data=toqan_payload) as response:
+                    self.observe_upstream('toqan', time.perf_counter() - started, f"{response.status // 100}xx")
+                    if response.status != 200:
+                        log.warning("toqan_stream_error status=%s", response.status)
+                        self.toqan_breaker.record_failure(f"HTTP {response.status}")
+                    elif is_event_stream(response.headers.get('Content-Type')):
+                        chunks = []
+                        async for line in response.content:
+                            chunk = parse_toqan_stream_line(line)
+                            if chunk is STREAM_DONE:
+                                break
+                            if chunk:
+                                if not sent_any:
+                                    self.toqan_breaker.record_success(time.perf_counter() - started)
+                                    self.toqan_responses.inc('success')
+                                sent_any = True
+                                chunks.append(chunk)
+                                yield chunk
+                        if chunks:
+                            self.remember_toqan_response(cache_key, user_message, ''.join(chunks), time.perf_counter() - started)
+                        else:
+                            self.toqan_breaker.record_failure('stream vacío')
+                    else:
+                        ai_response = self.parse_toqan_response(await response.json(content_type=None))
+                        self.toqan_breaker.record_success(time.perf_counter() - started)
+                        self.toqan_responses.inc('success')
+                        sent_any = True
+                        self.remember_toqan_response(cache_key, user_message, ai_response, time.perf_counter() - started)
+                        yield ai_response
+            except (asyncio.CancelledError, GeneratorExit):
+                if not sent_any:
+                    self.toqan_breaker.release()
+                raise
+            except Exception as e:
+                log.warning("toqan_stream_exception error=%s", e)
+                if not sent_any:
+                    self.toqan_breaker.record_failure(e)
+
+        if not sent_any:
+            self.toqan_responses.inc(outcome)
+            yield await self.agenerate_smart_fallback_response(user_message, user_context)
+
+    async def agenerate_smart_fallback_response(self, user_message, user_context):
+        weather = None
+        if self.is_weather_query(user_message):
+            weather = await self.aget_weather_data(user_context.get('destination', 'tu destino'))
+        return self.generate_smart_fallback_response(user_message, user_context, weather=weather)
+
+    async def acheck_automatic_notifications(self, user_id):
+        """check_automatic_notifications sin bloquear"""
+        session = self.active_users.get(user_id)
+        if session is None:
+            return []
+
+        weather = None
+        if session.destination:
+            weather = await self.aget_weather_data(session.destination)
+        return self.evaluate_notifications(session, weather)
+
+    async def abatch_notifications(self, user_ids):
+        """batch_notifications sin bloquear: los lookups por ciudad van en paralelo (acotado)"""
+        groups, missing = self.plan_notification_batch(user_ids)
+        current_hour = datetime.now().hour
+        phase_cache = {}
+        for user_id in missing:
+            yield user_id, None
+        if '' in groups:
+            for result in self.group_notifications(groups.pop(''), None, current_hour, phase_cache):
+                yield result
+        semaphore = asyncio.Semaphore(FreeConfig.NOTIFICATION_FETCH_PARALLELISM)
+
+        async def fetch(members):
+            async with semaphore:
+                return members, await self.aget_weather_data(members[0][1].destination)
+
+        for next_city in asyncio.as_completed([fetch(members) for members in groups.values()]):
+            members, weather = await next_city
+            for result in self.group_notifications(members, weather, current_hour, phase_cache):
+                yield result
+
+    async def apush_notifications(self, user_id):
+        """push_notifications sin bloquear"""
+        return self.notification_hub.publish(user_id, await self.acheck_automatic_notifications(user_id))
+
+
+# Instancia global del agente (modo ASGI)
+ai_agent = AsyncDespegarAIAgent()
+notification_scheduler = NotificationScheduler(
+    ai_agent,
+    interval=FreeConfig.NOTIFICATION_INTERVAL,
+    max_parallel_fetches=FreeConfig.NOTIFICATION_FETCH_PARALLELISM,
+    active_window=FreeConfig.NOTIFICATION_ACTIVE_WINDOW
+)
+
+
+@app.before_serving
+async def startup():
+    await ai_agent.start()
+    ai_agent.snapshots.restore()
+    jobs = [ai_agent.snapshots.arun_forever()]
+    if background_mode == 'inline':
+        jobs += [notification_scheduler.arun_forever(), ai_agent.forecast_prefetcher.arun_forever()]
+    else:
+        ai_agent.worker_bridge = await asyncio.to_thread(build_worker_bridge, ai_agent)
+        jobs.append(ai_agent.worker_bridge.arun_forever())
+    app.background_tasks = [asyncio.create_task(job) for job in jobs]
+
+
+@app.after_serving
+async def shutdown():
+    for task in app.background_tasks:
+        task.cancel()
+    await asyncio.to_thread(ai_agent.snapshots.save)
+    await ai_agent.stop()
+
+
+@app.before_request
+async def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+async def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        ai_agent.record_request(route, request.method, response.status_code, time.perf_counter() - started)
+    return response
+
+
+def rate_limited(user_id=None):
+    """Respuesta 429 si el usuario o la IP agotaron su token bucket; None si puede seguir"""
+    retry_after = ai_agent.check_rate_limits(user_id, request.remote_addr)
+    if not retry_after:
+        return None
+    body, headers = rate_limit_body(retry_after)
+    return jsonify(body), 429, headers
+
+
+async def bulk_items(key):
+    """Ítems de un body batch: NDJSON se lee por chunks mientras se responde, JSON de una vez"""
+    if is_ndjson(request.mimetype):
+        return andjson_items(request.body)
+    return json_items(await request.get_json(silent=True), key)
+
+
+@app.route('/')
+async def home():
+    """Página principal con el chat"""
+    return await render_template('chat.html')
+
+
+@app.route('/api/chat', methods=['POST'])
+async def chat():
+    """Endpoint principal del chat - TOQAN REAL (async)"""
+    try:
+        data = await request.get_json()
+        limited = rate_limited(data.get('user_id'))
+        if limited:
+            return limited
+        message, user_context = ai_agent.start_chat_turn(data)
+
+        ai_response = await ai_agent.aget_toqan_response(message, user_context, use_cache=data.get('cache', True) is not False)
+        ai_agent.remember_turn(user_context, message, ai_response)
+
+        return jsonify({
+            'success': True,
+            'response': ai_response,
+            'timestamp': datetime.now().isoformat(),
+            'source': 'toqan_real',
+            'space_id': TOQAN_SPACE_ID
+        })
+
+    except Exception as e:
+        log.exception("chat_endpoint_error error=%s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'response': 'Lo siento, tengo problemas técnicos temporales. ¿Puedes intentar de nuevo? 😅'
+        })
+
+
+@app.route('/api/chat/stream', methods=['POST'])
+async def chat_stream():
+    """Chat en streaming (SSE): los chunks de Toqan se reenvían apenas llegan"""
+    try:
+        data = await request.get_json()
+        limited = rate_limited(data.get('user_id'))
+        if limited:
+            return limited
+        message, user_context = ai_agent.start_chat_turn(data)
+        use_cache = data.get('cache', True) is not False
+    except Exception as e:
+        log.exception("chat_stream_endpoint_error error=%s", e)
+        return Response(sse_event('error', {'error': str(e)}), mimetype='text/event-stream')
+
+    async def events():
+        chunks = []
+        try:
+            async for chunk in ai_agent.astream_toqan_response(message, user_context, use_cache=use_cache):
+                chunks.append(chunk)
+                yield sse_event('token', {'text': chunk})
+            ai_agent.remember_turn(user_context, message, ''.join(chunks))
+        except Exception as e:
+            yield sse_event('error', {'error': str(e)})
+        yield sse_event('done', {
+            'timestamp': datetime.now().isoformat(),
+            'source': 'toqan_real',
+            'space_id': TOQAN_SPACE_ID
+        })
+
+    return Response(events(), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+
+@app.route('/api/notifications/<user_id>')
+async def get_notifications(user_id):
+    """Obtener notificaciones automáticas - GRATIS"""
+    try:
+        notifications = await ai_agent.acheck_automatic_notifications(user_id)
+        return jsonify({
+            'success': True,
+            'notifications': notifications
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'notifications': []
+        })
+
+
+@app.route('/api/notifications/batch', methods=['POST'])
+async def get_notifications_batch():
+    """Notificaciones de muchos usuarios (JSON o NDJSON) - un lookup de clima por ciudad, resultados en NDJSON"""
+    limited = rate_limited()
+    if limited:
+        return limited
+    try:
+        items = await bulk_items('user_ids')
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    @stream_with_context
+    async def results():
+        users = inactive = failed = 0
+        async for batch in abatched(items, FreeConfig.BULK_BATCH_SIZE):
+            valid, errors = split_valid(batch, parse_user_id)
+            if errors:
+                failed += len(errors)
+                yield ndjson_lines(errors)
+            async for user_id, notifications in ai_agent.abatch_notifications(user_id for _, user_id in valid):
+                users += 1
+                inactive += notifications is None
+                yield ndjson_line({
+                    'user_id': user_id,
+                    'active': notifications is not None,
+                    'notifications': notifications or []
+                })
+        yield ndjson_line({'done': True, 'users': users, 'inactive': inactive, 'errors': failed})
+
+    response = Response(results(), mimetype=NDJSON_MIMETYPE, headers=NDJSON_HEADERS)
+    response.timeout = None  # miles de usuarios pueden superar el timeout de respuesta por defecto
+    return response
+
+
+@app.route('/api/notifications/<user_id>/stream')
+async def notifications_stream(user_id):
+    """Notificaciones push (SSE) - reemplaza el polling cada 30 segundos"""
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    after_id = int(last_event_id) if last_event_id.isdigit() else 0
+
+    try:
+        await ai_agent.apush_notifications(user_id)
+    except Exception as e:
+        log.warning("notifications_error user_id=%s error=%s", user_id, e)
+
+    async def events():
+        last_id = after_id
+        hub = ai_agent.notification_hub
+        hub.connect(user_id)
+        try:
+            while True:
+                items = await hub.await_for(user_id, last_id, timeout=FreeConfig.NOTIFICATION_KEEPALIVE)
+                if not items:
+                    yield ": keepalive\n\n"
+                    continue
+                for notification_id, notification in items:
+                    last_id = notification_id
+                    yield sse_event('notification', notification, event_id=notification_id)
+        finally:
+            hub.disconnect(user_id)
+
+    response = Response(events(), mimetype='text/event-stream', headers=SSE_HEADERS)
+    response.timeout = None  # conexión de larga duración
+    return response
+
+
+@app.route('/api/user/update', methods=['POST'])
+async def update_user_context():
+    """Actualizar contexto del usuario"""
+    try:
+        data = await request.get_json()
+        user_id = data.get('user_id')
+        context = data.get('context', {})
+
+        if user_id:
+            ai_agent.update_user_context(user_id, context)
+
+        return jsonify({'success': True})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@app.route('/api/user/update/batch', methods=['POST'])
+async def update_user_contexts_batch():
+    """Actualizar el contexto de muchos usuarios (JSON o NDJSON) - un lock por lote, resultados en NDJSON"""
+    limited = rate_limited()
+    if limited:
+        return limited
+    try:
+        items = await bulk_items('updates')
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    @stream_with_context
+    async def results():
+        updated = failed = 0
+        async for batch in abatched(items, FreeConfig.BULK_BATCH_SIZE):
+            valid, errors = split_valid(batch, parse_context_update)
+            ai_agent.update_user_contexts([update for _, update in valid])
+            updated += len(valid)
+            failed += len(errors)
+            yield ndjson_lines(errors + [
+                {'index': index, 'user_id': user_id, 'success': True} for index, (user_id, _) in valid
+            ])
+        yield ndjson_line({'done': True, 'updated': updated, 'errors': failed})
+
+    response = Response(results(), mimetype=NDJSON_MIMETYPE, headers=NDJSON_HEADERS)
+    response.timeout = None  # el body NDJSON puede tardar en llegar
+    return response
+
+
+@app.route('/api/weather/<city>')
+async def get_weather(city):
+    """Obtener clima para una ciudad - API GRATUITA"""
+    limited = rate_limited(request.args.get('user_id'))
+    if limited:
+        return limited
+    weather_data = await ai_agent.aget_weather_data(city)
+    return jsonify({
+        'success': True,
+        'data': weather_data
+    })
+
+
+@app.route('/api/health')
+async def health_check():
+    """Health check para monitoreo"""
+    return jsonify({
+        'status': 'healthy',
+        'mode': 'asgi',
+        'active_users': len(ai_agent.active_users),
+        'sessions': ai_agent.active_users.stats(),
+        'weather_cache': ai_agent.weather_cache.stats(),
+        'forecast': {**ai_agent.forecasts.stats(), 'prefetch': ai_agent.forecast_prefetcher.stats()},
+        'response_cache': ai_agent.response_cache.stats(),
+        'conversations': ai_agent.conversations.stats(),
+        'snapshot': ai_agent.snapshots.stats(),
+        'latency': {
+            'routes': ai_agent.request_latency.snapshot(),
+            'upstreams': ai_agent.upstream_latency.snapshot()
+        },
+        'toqan_responses': ai_agent.toqan_responses.snapshot(),
+        'logging': log_handler.stats(),
+        'notifications': ai_agent.notification_hub.stats(),
+        'scheduler': notification_scheduler.stats(),
+        'background': {
+            'mode': background_mode,
+            'worker': ai_agent.worker_bridge.stats() if ai_agent.worker_bridge else None
+        },
+        'upstreams': {
+            'toqan': ai_agent.async_toqan_client.stats(),
+            'openweathermap': ai_agent.async_weather_client.stats()
+        },
+        'circuit_breakers': {
+            'toqan': ai_agent.toqan_breaker.stats()
+        },
+        'quotas': {
+            'toqan': ai_agent.toqan_quota.stats(),
+            'openweathermap': ai_agent.weather_quota.stats()
+        },
+        'rate_limits': {
+            'user': ai_agent.user_limiter.stats(),
+            'ip': ai_agent.ip_limiter.stats()
+        },
+        'ai_backend': 'toqan_real',
+        'space_id': TOQAN_SPACE_ID,
+        'workspace_url': TOQAN_WORKSPACE_URL,
+        'cost': '$0.00'
+    })
+
+
+@app.route('/api/metrics')
+async def metrics():
+    """Métricas en formato texto de Prometheus"""
+    return Response(ai_agent.metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/test-toqan')
+async def test_toqan():
+    """Endpoint para testear la conexión con Toqan"""
+    limited = rate_limited()
+    if limited:
+        return limited
+    toqan_config = {
+        'space_id': TOQAN_SPACE_ID,
+        'api_url': TOQAN_API_URL,
+        'has_api_key': bool(TOQAN_API_KEY and len(TOQAN_API_KEY) > 10)
+    }
+    try:
+        test_context = {
+            'destination': 'París, Francia',
+            'traveler_type': 'cultural',
+            'travel_phase': 'planning',
+            'user_id': 'test_user',
+            'session_id': 'test_session'
+        }
+
+        response = await ai_agent.aget_toqan_response("Hola, ¿cómo está el clima en París?", test_context)
+
+        return jsonify({
+            'success': True,
+            'test_response': response,
+            'toqan_config': toqan_config,
+            'circuit_breaker': ai_agent.toqan_breaker.stats()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'toqan_config': toqan_config,
+            'circuit_breaker': ai_agent.toqan_breaker.stats()
+        })
+
+
+if __name__ == '__main__':
+    print("🚀 Iniciando Despegar AI Chat - TOQAN REAL (modo ASGI)")
+    print(f"🤖 Space ID: {TOQAN_SPACE_ID}")
+    print("📍 Chat disponible en: http://localhost:5000")
+    app.run(host=FreeConfig.HOST, port=FreeConfig.PORT)
@@ -1,31 +1,251 @@
 
 # despegar_ai_chat_toqan_backend.py - INTEGRACIÓN REAL CON TOQAN
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, g, render_template, request, jsonify, stream_with_context
 from flask_cors import CORS
-import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 import json
+import math
 import os
 from datetime import datetime, timedelta
 import threading
 import time
 
+from app_logging import configure_logging, get_logger
+from background_worker import WorkerBridge, WorkerLock
+from bulk_requests import (
+    NDJSON_HEADERS,
+    NDJSON_MIMETYPE,
+    batched,
+    is_ndjson,
+    json_items,
+    ndjson_items,
+    ndjson_line,
+    ndjson_lines,
+    parse_context_update,
+    parse_user_id,
+    split_valid,
+)
+from circuit_breaker import CircuitBreaker
+from config_free import FreeConfig
+from conversation_history import ConversationStore
+from http_clients import UpstreamClient
+from intent_classifier import IntentClassifier
+from local_queue import LocalQueue
+from metrics import MetricsRegistry
+from notification_hub import NotificationHub
+from notification_scheduler import NotificationScheduler
+from prompt_templates import PromptTemplate, ToqanPayloadEncoder
+from rate_limiter import QuotaGovernor, TokenBucketLimiter
+from response_cache import ResponseCache
+from session_store import SessionStore, build_session_backend
+from streaming import SSE_HEADERS, STREAM_DONE, is_event_stream, parse_toqan_stream_line, sse_event
+from weather_cache import WeatherCache, normalize_city
+from warm_snapshot import SnapshotManager
+from weather_forecast import ForecastPrefetcher, ForecastTable, parse_forecast
+
 app = Flask(__name__)
 CORS(app)
 
+log_handler = configure_logging(FreeConfig.LOG_LEVEL, FreeConfig.LOG_BUFFER_SIZE)
+log = get_logger('toqan')
+
 # Configuración REAL de Toqan
 TOQAN_API_KEY = os.getenv('TOQAN_API_KEY', 'sk_d8bd5fce4ad6bf831cd8524e24770b84466d0ec1493d12f3e1ca5e606a354d99516432df9dd0675eab291f22bd5d4c9911f5fec23ab9c53419ca659d52ac')
 TOQAN_SPACE_ID = os.getenv('TOQAN_SPACE_ID', '29ba8bb2-ad08-48f0-9568-9e9fa1196173')
 WEATHER_API_KEY = os.getenv('WEATHER_API_KEY', 'demo_weather_key')
 
+WEATHER_API_URL = os.getenv('WEATHER_API_URL', 'http://api.openweathermap.org/data/2.5/weather')
+WEATHER_FORECAST_API_URL = os.getenv('WEATHER_FORECAST_API_URL', 'http://api.openweathermap.org/data/2.5/forecast')
+
 # URLs de Toqan (ajustar según documentación real)
 TOQAN_API_URL = os.getenv('TOQAN_API_URL', 'https://api.toqan.ai/v1/chat')
 TOQAN_WORKSPACE_URL = f"https://work.toqan.ai/?spaceId={TOQAN_SPACE_ID}"
 
 class DespegarAIAgent:
     def __init__(self):
-        self.active_users = {}
+        self.metrics = MetricsRegistry()
         self.notification_rules = self.setup_notification_rules()
+        self.intent_classifier = IntentClassifier.from_file(FreeConfig.INTENTS_PATH)
+        # Prompt compilado una vez; el body de Toqan se arma directo en bytes
+        self.toqan_payloads = ToqanPayloadEncoder(PromptTemplate.from_file(FreeConfig.PROMPTS_PATH), TOQAN_SPACE_ID)
+        # Presupuesto diario de cada upstream; al agotarse se sirve cache o fallback
+        self.weather_quota = QuotaGovernor(
+            'openweathermap',
+            daily_limit=FreeConfig.WEATHER_DAILY_QUOTA,
+            soft_ratio=FreeConfig.QUOTA_SOFT_RATIO
+        )
+        self.toqan_quota = QuotaGovernor(
+            'toqan',
+            daily_limit=FreeConfig.TOQAN_DAILY_QUOTA,
+            soft_ratio=FreeConfig.QUOTA_SOFT_RATIO
+        )
+        self.user_limiter = TokenBucketLimiter(
+            rate=FreeConfig.RATE_LIMIT_USER_PER_MINUTE / 60,
+            burst=FreeConfig.RATE_LIMIT_USER_BURST,
+            max_keys=FreeConfig.RATE_LIMIT_MAX_KEYS
+        )
+        self.ip_limiter = TokenBucketLimiter(
+            rate=FreeConfig.RATE_LIMIT_IP_PER_MINUTE / 60,
+            burst=FreeConfig.RATE_LIMIT_IP_BURST,
+            max_keys=FreeConfig.RATE_LIMIT_MAX_KEYS
+        )
+        self.weather_cache = WeatherCache(
+            max_entries=FreeConfig.WEATHER_CACHE_MAX_ENTRIES,
+            ttl=FreeConfig.WEATHER_CACHE_TTL,
+            ttl_scale=self.weather_quota.scale_ttl
+        )
+        # Pronóstico por ciudad de los destinos activos, traído en background
+        self.forecasts = ForecastTable(
+            max_cities=FreeConfig.FORECAST_MAX_CITIES,
+            max_age=FreeConfig.FORECAST_MAX_AGE,
+            alert_hours=FreeConfig.FORECAST_ALERT_HOURS
+        )
+        self.forecast_prefetcher = ForecastPrefetcher(
+            self,
+            self.forecasts,
+            interval=FreeConfig.FORECAST_PREFETCH_INTERVAL,
+            refresh_after=FreeConfig.FORECAST_REFRESH_AFTER,
+            max_parallel_fetches=FreeConfig.FORECAST_PREFETCH_PARALLELISM,
+            max_cities_per_cycle=FreeConfig.FORECAST_MAX_CITIES_PER_CYCLE,
+            active_window=FreeConfig.NOTIFICATION_ACTIVE_WINDOW
+        )
+        self.response_cache = ResponseCache(
+            max_entries=FreeConfig.RESPONSE_CACHE_MAX_ENTRIES,
+            ttls=FreeConfig.RESPONSE_CACHE_TTLS,
+            default_ttl=FreeConfig.RESPONSE_CACHE_TTLS['general']
+        )
+        self.notification_hub = NotificationHub(
+            max_items=FreeConfig.NOTIFICATION_QUEUE_SIZE,
+            dedup_window=FreeConfig.NOTIFICATION_DEDUP_WINDOW
+        )
+        self.conversations = ConversationStore(
+            max_sessions=FreeConfig.HISTORY_MAX_SESSIONS,
+            idle_ttl=FreeConfig.SESSION_IDLE_TTL,
+            max_turns=FreeConfig.HISTORY_MAX_TURNS,
+            max_tokens=FreeConfig.HISTORY_MAX_TOKENS,
+            max_chars=FreeConfig.HISTORY_MAX_CHARS,
+            turn_max_chars=FreeConfig.HISTORY_TURN_MAX_CHARS
+        )
+        # Sesiones acotadas a MAX_ACTIVE_USERS; al desalojar se libera también su cola push e historial
+        self.active_users = SessionStore(
+            backend=build_session_backend(FreeConfig.SESSION_BACKEND, FreeConfig.SESSION_DB_PATH),
+            capacity=FreeConfig.MAX_ACTIVE_USERS,
+            idle_ttl=FreeConfig.SESSION_IDLE_TTL,
+            on_evict=self.forget_user
+        )
+        self.toqan_client = UpstreamClient(
+            'toqan',
+            pool_size=FreeConfig.TOQAN_POOL_SIZE,
+            connect_timeout=FreeConfig.TOQAN_CONNECT_TIMEOUT,
+            read_timeout=min(FreeConfig.TOQAN_READ_TIMEOUT, FreeConfig.TOQAN_LATENCY_BUDGET),
+            max_retries=FreeConfig.HTTP_MAX_RETRIES,
+            backoff_base=FreeConfig.HTTP_BACKOFF_BASE,
+            headers={
+                "Authorization": f"Bearer {TOQAN_API_KEY}",
+                "Content-Type": "application/json",
+                "User-Agent": "Despegar-AI-Chat/1.0"
+            },
+            on_response=partial(self.observe_upstream, 'toqan')
+        )
+        self.toqan_breaker = CircuitBreaker(
+            'toqan',
+            window=FreeConfig.TOQAN_BREAKER_WINDOW,
+            min_calls=FreeConfig.TOQAN_BREAKER_MIN_CALLS,
+            error_threshold=FreeConfig.TOQAN_BREAKER_ERROR_RATE,
+            slow_call_seconds=FreeConfig.TOQAN_BREAKER_SLOW_CALL,
+            slow_threshold=FreeConfig.TOQAN_BREAKER_SLOW_RATE,
+            open_seconds=FreeConfig.TOQAN_BREAKER_OPEN_SECONDS,
+            half_open_probes=FreeConfig.TOQAN_BREAKER_HALF_OPEN_PROBES
+        )
+        self.weather_client = UpstreamClient(
+            'openweathermap',
+            pool_size=FreeConfig.WEATHER_POOL_SIZE,
+            connect_timeout=FreeConfig.WEATHER_CONNECT_TIMEOUT,
+            read_timeout=FreeConfig.WEATHER_READ_TIMEOUT,
+            max_retries=FreeConfig.HTTP_MAX_RETRIES,
+            backoff_base=FreeConfig.HTTP_BACKOFF_BASE,
+            on_response=partial(self.observe_upstream, 'openweathermap')
+        )
+        self.snapshots = self.setup_snapshots()
+        # Con BACKGROUND_JOBS=worker los jobs corren en background_worker.py (ver start_background)
+        self.worker_bridge = None
+        self.setup_metrics()
+
+    def setup_snapshots(self):
+        """Estado que sobrevive a un reinicio; abrir el snapshot es O(1) y lo demás se restaura a pedido"""
+        components = {
+            'weather': self.weather_cache,
+            'forecast': self.forecasts,
+            'responses': self.response_cache,
+            'conversations': self.conversations
+        }
+        # Con SQLite las sesiones ya están en disco
+        if hasattr(self.active_users.backend, 'export_snapshot'):
+            components['sessions'] = self.active_users.backend
+        snapshots = SnapshotManager(
+            FreeConfig.SNAPSHOT_PATH,
+            components,
+            # Respuestas armadas con otro prompt no se reusan
+            versions={'responses': self.toqan_payloads.template.version},
+            interval=FreeConfig.SNAPSHOT_INTERVAL
+        )
+        return snapshots
+        
+    def setup_metrics(self):
+        """Histogramas y contadores propios + métricas leídas de los stats() de cada componente"""
+        metrics = self.metrics
+        self.request_latency = metrics.histogram(
+            'http_request_duration_seconds', 'Latencia por ruta (en streaming, hasta enviar headers)',
+            ('route', 'method'))
+        self.request_count = metrics.counter(
+            'http_requests_total', 'Requests por ruta y status', ('route', 'method', 'status'))
+        self.upstream_latency = metrics.histogram(
+            'upstream_request_duration_seconds', 'Latencia de cada intento HTTP a un upstream',
+            ('upstream', 'outcome'))
+        self.toqan_responses = metrics.counter(
+            'toqan_responses_total',
+            'Respuestas de chat por origen: success, cached, error (Toqan falló -> fallback), '
+            'fallback (breaker o cuota, sin llamar a Toqan)', ('outcome',))
+        self.cycle_latency = metrics.histogram(
+            'notification_cycle_seconds', 'Duración de cada ciclo de notificaciones background',
+            buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0))
         
+        def cache_lookups(cache):
+            def collect():
+                stats = cache.stats()
+                return {result: stats[result] for result in ('hits', 'misses', 'coalesced') if result in stats}
+            return collect
+        
+        metrics.callback('weather_cache_lookups_total', 'Lookups del cache de clima por resultado',
+                         cache_lookups(self.weather_cache), kind='counter', labelnames=('result',))
+        metrics.callback('response_cache_lookups_total', 'Lookups del cache de respuestas por resultado',
+                         cache_lookups(self.response_cache), kind='counter', labelnames=('result',))
+        metrics.callback('forecast_lookups_total', 'Lecturas de la tabla de pronóstico por resultado',
+                         cache_lookups(self.forecasts), kind='counter', labelnames=('result',))
+        metrics.callback('forecast_cities', 'Ciudades con pronóstico en memoria', lambda: len(self.forecasts))
+        metrics.callback('active_sessions', 'Sesiones de usuario activas', lambda: len(self.active_users))
+        metrics.callback('conversation_sessions', 'Usuarios con historial', lambda: len(self.conversations))
+        metrics.callback('toqan_breaker_state', 'Breaker de Toqan: 0 closed, 1 half_open, 2 open',
+                         lambda: {'closed': 0, 'half_open': 1, 'open': 2}[self.toqan_breaker.state])
+        metrics.callback('toqan_breaker_short_circuited_total', 'Requests que el breaker mandó al fallback',
+                         lambda: self.toqan_breaker.short_circuited, kind='counter')
+        metrics.callback('upstream_quota_used', 'Llamadas usadas hoy del presupuesto diario',
+                         lambda: {'toqan': self.toqan_quota.used, 'openweathermap': self.weather_quota.used},
+                         labelnames=('upstream',))
+        metrics.callback('rate_limited_total', 'Requests rechazados con 429',
+                         lambda: {'ip': self.ip_limiter.limited, 'user': self.user_limiter.limited},
+                         kind='counter', labelnames=('scope',))
+        metrics.callback('log_records_dropped_total', 'Logs descartados con el buffer lleno',
+                         lambda: log_handler.dropped, kind='counter')
+    
+    def observe_upstream(self, upstream, seconds, outcome):
+        self.upstream_latency.observe(seconds, upstream, outcome)
+    
+    def record_request(self, route, method, status, seconds):
+        self.request_latency.observe(seconds, route, method)
+        self.request_count.inc(route, method, str(status))
+    
     def setup_notification_rules(self):
         """Configurar reglas para notificaciones automáticas"""
         return {
@@ -42,29 +262,70 @@ class DespegarAIAgent:
         }
     
     def get_weather_data(self, city):
-        """Obtener datos climáticos reales - API GRATUITA"""
+        """Obtener datos climáticos (pronóstico en memoria o cache por ciudad) - API GRATUITA"""
+        forecast = self.forecasts.weather(city)
+        if forecast is not None:
+            return forecast
+        if not FreeConfig.CACHE_RESPONSES:
+            return self.fetch_weather_data(city)
+        return self.weather_cache.get_or_fetch(city, self.fetch_weather_data)
+    
+    def fetch_weather_data(self, city):
+        """Obtener datos climáticos reales de OpenWeatherMap (sin cache)"""
+        if not self.weather_quota.try_acquire():
+            return self.fallback_weather_data()
         try:
-            url = f"http://api.openweathermap.org/data/2.5/weather"
-            params = {
-                'q': city,
-                'appid': WEATHER_API_KEY,
-                'units': 'metric',
-                'lang': 'es'
-            }
-            response = requests.get(url, params=params, timeout=5)
+            response = self.weather_client.get(WEATHER_API_URL, params=self.weather_params(city))
             if response.status_code == 200:
-                data = response.json()
-                return {
-                    'temperature': data['main']['temp'],
-                    'description': data['weather'][0]['description'],
-                    'humidity': data['main']['humidity'],
-                    'rain_probability': data.get('clouds', {}).get('all', 0),
-                    'success': True
-                }
+                return self.parse_weather_data(response.json())
         except Exception as e:
-            print(f"Weather API error: {e}")
+            log.warning("weather_error city=%s error=%s", city, e)
         
-        # Fallback con datos simulados realistas
+        return self.fallback_weather_data()
+    
+    def fetch_forecast(self, city):
+        """Pronóstico de OpenWeatherMap cada 3 horas ([(epoch, slot)]) o None si no se pudo"""
+        if not self.weather_quota.try_acquire():
+            return None
+        try:
+            response = self.weather_client.get(WEATHER_FORECAST_API_URL, params=self.forecast_params(city))
+            if response.status_code == 200:
+                return parse_forecast(response.json())
+            log.warning("forecast_error city=%s status=%s", city, response.status_code)
+        except Exception as e:
+            log.warning("forecast_error city=%s error=%s", city, e)
+        return None
+    
+    def forecast_params(self, city):
+        """weather_params más cnt: solo los slots de las próximas horas"""
+        return {**self.weather_params(city), 'cnt': FreeConfig.FORECAST_SLOTS}
+    
+    def weather_params(self, city):
+        """Query string para OpenWeatherMap"""
+        return {
+            'q': city,
+            'appid': WEATHER_API_KEY,
+            'units': 'metric',
+            'lang': 'es'
+        }
+    
+    def parse_weather_data(self, data):
+        """Reducir la respuesta de OpenWeatherMap a lo que usa el chat"""
+        # /weather no trae probabilidad: 100 si está precipitando ahora (ids 2xx-6xx), si no 0.
+        # Las nubes (clouds.all) no son lluvia: van aparte
+        weather_id = data['weather'][0].get('id', 800)
+        raining = 200 <= weather_id < 700 or 'rain' in data or 'snow' in data
+        return {
+            'temperature': data['main']['temp'],
+            'description': data['weather'][0]['description'],
+            'humidity': data['main']['humidity'],
+            'rain_probability': 100 if raining else 0,
+            'clouds': data.get('clouds', {}).get('all', 0),
+            'success': True
+        }
+    
+    def fallback_weather_data(self):
+        """Fallback con datos simulados realistas"""
         return {
             'temperature': 22,
             'description': 'parcialmente nublado',
@@ -73,91 +334,168 @@ class DespegarAIAgent:
             'success': False
         }
     
-    def get_toqan_response(self, user_message, user_context):
-        """Generar respuesta usando Toqan REAL"""
+    def get_toqan_response(self, user_message, user_context, use_cache=True):
+        """Generar respuesta usando Toqan REAL (o el cache de respuestas)"""
+        cache_key = self.response_cache_key(user_message, user_context, use_cache)
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                self.toqan_responses.inc('cached')
+                return cached
+        
+        # Breaker abierto o cuota agotada: no esperar a Toqan
+        if not self.toqan_call_allowed():
+            self.toqan_responses.inc('fallback')
+            return self.generate_smart_fallback_response(user_message, user_context)
+        
         try:
-            # Contexto específico para viajes con información del usuario
-            travel_prompt = f"""
-            Eres un asistente experto de viajes para Despegar.com. Tu nombre es "Despegar AI Assistant".
-            
-            CONTEXTO DEL USUARIO:
-            - Destino: {user_context.get('destination', 'No especificado')}
-            - Tipo de viajero: {user_context.get('traveler_type', 'general')}
-            - Fase del viaje: {user_context.get('travel_phase', 'planning')}
-            
-            CONSULTA DEL USUARIO: {user_message}
-            
-            INSTRUCCIONES:
-            - Responde de manera amigable, práctica y específica para viajes
-            - Usa emojis para hacer la conversación más amigable
-            - Sé conciso pero completo
-            - Si no tienes información exacta, sugiere alternativas
-            - Enfócate en ayudar con el viaje específico del usuario
-            - Siempre incluye tips prácticos y útiles
-            """
-            
-            # Preparar datos para Toqan
-            toqan_payload = {
-                "message": travel_prompt,
-                "spaceId": TOQAN_SPACE_ID,
-                "sessionId": user_context.get('session_id', f"session_{datetime.now().timestamp()}"),
-                "userId": user_context.get('user_id', 'anonymous'),
-                "context": {
-                    "destination": user_context.get('destination'),
-                    "traveler_type": user_context.get('traveler_type'),
-                    "travel_phase": user_context.get('travel_phase'),
-                    "timestamp": datetime.now().isoformat()
-                }
-            }
+            toqan_payload = self.build_toqan_payload(user_message, user_context)
+            log.debug("toqan_request space_id=%s chars=%d", TOQAN_SPACE_ID, len(user_message))
             
-            # Headers para autenticación
-            headers = {
-                "Authorization": f"Bearer {TOQAN_API_KEY}",
-                "Content-Type": "application/json",
-                "User-Agent": "Despegar-AI-Chat/1.0"
-            }
-            
-            print(f"🤖 Enviando mensaje a Toqan...")
-            print(f"📍 Space ID: {TOQAN_SPACE_ID}")
-            print(f"💬 Mensaje: {user_message[:50]}...")
-            
-            # Hacer request a Toqan
-            response = requests.post(
+            # Hacer request a Toqan (Authorization/Content-Type/User-Agent van en la session)
+            started = time.perf_counter()
+            response = self.toqan_client.post(
                 TOQAN_API_URL,
-                headers=headers,
-                json=toqan_payload,
-                timeout=15
+                data=toqan_payload
             )
             
-            print(f"📡 Status Code: {response.status_code}")
-            
             if response.status_code == 200:
-                data = response.json()
-                ai_response = data.get('response', data.get('message', data.get('content', 'Error en formato de respuesta')))
-                print(f"✅ Respuesta de Toqan recibida!")
+                ai_response = self.parse_toqan_response(response.json())
+                latency = time.perf_counter() - started
+                self.toqan_breaker.record_success(latency)
+                self.remember_toqan_response(cache_key, user_message, ai_response, latency)
+                self.toqan_responses.inc('success')
+                log.debug("toqan_response status=200 latency_ms=%.1f", latency * 1000)
                 return ai_response
             else:
-                print(f"❌ Error Toqan: {response.status_code}")
-                print(f"📄 Response: {response.text}")
+                log.warning("toqan_error status=%s body=%.200s", response.status_code, response.text)
+                self.toqan_breaker.record_failure(f"HTTP {response.status_code}")
+                self.toqan_responses.inc('error')
                 return self.generate_smart_fallback_response(user_message, user_context)
             
         except Exception as e:
-            print(f"🚨 Exception en Toqan: {str(e)}")
+            log.warning("toqan_exception error=%s", e)
+            self.toqan_breaker.record_failure(e)
+            self.toqan_responses.inc('error')
             return self.generate_smart_fallback_response(user_message, user_context)
     
-    def generate_smart_fallback_response(self, user_message, user_context):
+    def stream_toqan_response(self, user_message, user_context, use_cache=True):
+        """Generar la respuesta de Toqan en chunks a medida que llega"""
+        cache_key = self.response_cache_key(user_message, user_context, use_cache)
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                self.toqan_responses.inc('cached')
+                yield cached
+                return
+        
+        sent_any = False
+        outcome = 'fallback'
+        
+        if self.toqan_call_allowed():
+            outcome = 'error'  # hasta que llegue el primer chunk
+            toqan_payload = self.build_toqan_payload(user_message, user_context, stream=True)
+            try:
+                started = time.perf_counter()
+                with self.toqan_client.post(TOQAN_API_URL, data=toqan_payload, stream=True) as response:
+                    if response.status_code != 200:
+                        log.warning("toqan_stream_error status=%s", response.status_code)
+                        self.toqan_breaker.record_failure(f"HTTP {response.status_code}")
+                    elif is_event_stream(response.headers.get('Content-Type')):
+                        chunks = []
+                        for line in response.iter_lines():
+                            chunk = parse_toqan_stream_line(line)
+                            if chunk is STREAM_DONE:
+                                break
+                            if chunk:
+                                if not sent_any:
+                                    # Para el breaker cuenta la latencia hasta el primer chunk
+                                    self.toqan_breaker.record_success(time.perf_counter() - started)
+                                    self.toqan_responses.inc('success')
+                                sent_any = True
+                                chunks.append(chunk)
+                                yield chunk
+                        if chunks:
+                            self.remember_toqan_response(cache_key, user_message, ''.join(chunks), time.perf_counter() - started)
+                        else:
+                            self.toqan_breaker.record_failure('stream vacío')
+                    else:
+                        # Toqan respondió JSON completo: se envía como un único chunk
+                        ai_response = self.parse_toqan_response(response.json())
+                        self.toqan_breaker.record_success(time.perf_counter() - started)
+                        self.toqan_responses.inc('success')
+                        sent_any = True
+                        self.remember_toqan_response(cache_key, user_message, ai_response, time.perf_counter() - started)
+                        yield ai_response
+            except Exception as e:
+                log.warning("toqan_stream_exception error=%s", e)
+                if not sent_any:
+                    self.toqan_breaker.record_failure(e)
+        
+        # Si Toqan falla (o el breaker está abierto) antes del primer chunk, el fallback va como un solo evento
+        if not sent_any:
+            self.toqan_responses.inc(outcome)
+            yield self.generate_smart_fallback_response(user_message, user_context)
+    
+    def toqan_call_allowed(self):
+        """¿Ir a Toqan? No con el breaker abierto ni con la cuota diaria agotada"""
+        if not self.toqan_breaker.allow():
+            return False
+        if not self.toqan_quota.try_acquire():
+            self.toqan_breaker.release()
+            return False
+        return True
+    
+    def response_cache_key(self, user_message, user_context, use_cache=True):
+        """Key del cache de respuestas, o None si este request no lo usa"""
+        if not FreeConfig.CACHE_RESPONSES:
+            return None
+        # Con historial la respuesta depende de la conversación: no se comparte
+        if self.conversations.has_history(user_context.get('user_id')):
+            return None
+        # Con la cuota de Toqan en modo degradado "cache": false se ignora
+        if not use_cache and not self.toqan_quota.degraded:
+            self.response_cache.bypass()
+            return None
+        return self.response_cache.key_for(user_message, user_context)
+    
+    def remember_toqan_response(self, cache_key, user_message, ai_response, latency):
+        """Guardar una respuesta real de Toqan (nunca el fallback) con el TTL de su intención"""
+        if cache_key is not None:
+            self.response_cache.set(cache_key, ai_response, intent=self.detect_intent(user_message), latency=latency)
+    
+    def build_toqan_payload(self, user_message, user_context, stream=False):
+        """Body JSON (bytes) de Toqan con el prompt de viajes de data/prompts.json"""
+        # Historial ya armado por ConversationStore (se renderiza una vez por intercambio)
+        history = self.conversations.render(user_context.get('user_id'))
+        return self.toqan_payloads.encode(user_message, user_context, history=history, stream=stream)
+    
+    def parse_toqan_response(self, data):
+        """Extraer el texto de la respuesta de Toqan"""
+        return data.get('response', data.get('message', data.get('content', 'Error en formato de respuesta')))
+    
+    def detect_intent(self, user_message):
+        """Intención del mensaje según data/intents.json (o None)"""
+        return self.intent_classifier.classify(user_message)
+    
+    def is_weather_query(self, user_message):
+        """¿El fallback va a necesitar datos de clima para este mensaje?"""
+        return self.detect_intent(user_message) == 'weather'
+    
+    def generate_smart_fallback_response(self, user_message, user_context, weather=None):
         """Respuestas inteligentes de fallback cuando Toqan no responde"""
-        message_lower = user_message.lower()
+        intent = self.detect_intent(user_message)
         destination = user_context.get('destination', 'tu destino')
         traveler_type = user_context.get('traveler_type', 'general')
         travel_phase = user_context.get('travel_phase', 'planning')
         
         # Respuestas específicas por keywords
-        if any(word in message_lower for word in ['clima', 'tiempo', 'lluvia', 'temperatura']):
-            weather = self.get_weather_data(destination)
+        if intent == 'weather':
+            if weather is None:
+                weather = self.get_weather_data(destination)
             return f"🌤️ El clima en {destination}: {weather['temperature']}°C, {weather['description']}. Humedad: {weather['humidity']}%. {'☔ Posible lluvia' if weather['rain_probability'] > 50 else '☀️ Día despejado'}. ¡Perfecto para explorar!"
         
-        elif any(word in message_lower for word in ['restaurante', 'comida', 'comer', 'almorzar', 'cenar']):
+        elif intent == 'food':
             food_recs = {
                 'cultural': 'restaurantes tradicionales con historia local',
                 'adventure': 'lugares de comida rápida cerca de actividades',
@@ -168,22 +506,22 @@ class DespegarAIAgent:
             rec = food_recs.get(traveler_type, 'restaurantes recomendados')
             return f"🍽️ Para un viajero {traveler_type} en {destination}, te recomiendo {rec}. ¿Te interesa alguna cocina específica? También puedo sugerirte horarios ideales para evitar multitudes."
         
-        elif any(word in message_lower for word in ['hotel', 'alojamiento', 'dormir', 'check']):
+        elif intent == 'lodging':
             return f"🏨 Para tu estadía en {destination}: Check-in típicamente 15:00, check-out 11:00. Te recomiendo confirmar horarios con tu hotel. ¿Necesitas ayuda con late check-out o early check-in?"
         
-        elif any(word in message_lower for word in ['transporte', 'metro', 'taxi', 'bus', 'movimiento']):
+        elif intent == 'transport':
             return f"🚇 Transporte en {destination}: Te recomiendo apps locales de transporte y tarjetas de transporte público para ahorrar. ¿Te ayudo con rutas específicas o mejor forma de llegar a algún lugar?"
         
-        elif any(word in message_lower for word in ['moneda', 'dinero', 'cambio', 'pagar']):
+        elif intent == 'money':
             return f"💱 Para {destination}: Te recomiendo llevar efectivo local y una tarjeta internacional sin comisiones. Muchos lugares aceptan tarjeta, pero mercados y pequeños comercios prefieren efectivo."
         
-        elif any(word in message_lower for word in ['idioma', 'hablar', 'frases', 'comunicar']):
+        elif intent == 'language':
             return f"🗣️ Comunicación en {destination}: Las frases básicas más útiles son 'Hola', 'Gracias', 'Disculpe', '¿Habla inglés?', y 'La cuenta, por favor'. ¿Te ayudo con pronunciación o frases específicas?"
         
-        elif any(word in message_lower for word in ['seguridad', 'peligro', 'cuidado', 'emergencia']):
+        elif intent == 'safety':
             return f"🛡️ Seguridad en {destination}: Mantén copias de documentos importantes, evita mostrar objetos de valor, usa transporte oficial. Número de emergencias local disponible en tu hotel. ¿Necesitas info específica de tu zona?"
         
-        elif any(word in message_lower for word in ['actividades', 'hacer', 'visitar', 'turismo']):
+        elif intent == 'activities':
             activity_recs = {
                 'cultural': 'museos, sitios históricos, tours guiados',
                 'adventure': 'deportes extremos, hiking, actividades al aire libre',
@@ -215,40 +553,119 @@ class DespegarAIAgent:
     
     def check_automatic_notifications(self, user_id):
         """Verificar notificaciones automáticas - SIN COSTO"""
-        if user_id not in self.active_users:
+        session = self.active_users.get(user_id)
+        if session is None:
             return []
         
-        user_data = self.active_users[user_id]
-        notifications = []
-        
         # Check clima GRATIS
-        if user_data.get('destination'):
-            weather = self.get_weather_data(user_data['destination'])
-            
-            if weather['temperature'] < self.notification_rules['weather_alerts']['temperature_low']:
-                notifications.append({
-                    'type': 'weather_alert',
-                    'priority': 'high',
-                    'message': f"🧥 Temperatura baja: {weather['temperature']}°C en {user_data['destination']}. Recomendación: Lleva abrigo."
-                })
-            
-            if weather['temperature'] > self.notification_rules['weather_alerts']['temperature_high']:
-                notifications.append({
-                    'type': 'weather_alert',
-                    'priority': 'high',
-                    'message': f"🌡️ Temperatura alta: {weather['temperature']}°C en {user_data['destination']}. Mantente hidratado y usa protector solar."
-                })
-            
-            if weather['rain_probability'] > self.notification_rules['weather_alerts']['rain_probability']:
-                notifications.append({
-                    'type': 'weather_alert',
-                    'priority': 'medium',
-                    'message': f"☔ Probabilidad de lluvia: {weather['rain_probability']}% en {user_data['destination']}. Lleva paraguas."
-                })
+        weather = None
+        if session.destination:
+            weather = self.get_weather_data(session.destination)
         
-        # Notificaciones inteligentes basadas en tiempo
+        return self.evaluate_notifications(session, weather)
+    
+    def push_notifications(self, user_id):
+        """Calcular las notificaciones del usuario y encolarlas para entrega push"""
+        return self.notification_hub.publish(user_id, self.check_automatic_notifications(user_id))
+    
+    def evaluate_notifications(self, session, weather):
+        """Aplicar las reglas de notificación a una sesión y su clima (sin I/O)"""
+        notifications = []
+        if weather is not None:
+            notifications.extend(self.weather_notifications(session.destination, weather))
+        notifications.extend(self.time_based_notifications(session.travel_phase or 'exploring', datetime.now().hour))
+        return notifications
+    
+    def group_notifications(self, members, weather, current_hour, phase_cache):
+        """Reglas para usuarios de una misma ciudad: alertas por destino y recordatorios por fase se arman una vez"""
+        alerts_by_name = {}
+        for user_id, session in members:
+            notifications = []
+            if weather is not None:
+                # El texto usa el nombre tal como lo escribió el usuario
+                name = session.destination
+                alerts = alerts_by_name.get(name)
+                if alerts is None:
+                    alerts = alerts_by_name[name] = self.weather_notifications(name, weather)
+                notifications.extend(alerts)
+            
+            phase = session.travel_phase or 'exploring'
+            reminders = phase_cache.get(phase)
+            if reminders is None:
+                reminders = phase_cache[phase] = self.time_based_notifications(phase, current_hour)
+            notifications.extend(reminders)
+            yield user_id, notifications
+    
+    def plan_notification_batch(self, user_ids):
+        """Agrupar usuarios por ciudad normalizada: ({ciudad: [(user_id, session)]}, ids sin sesión)"""
+        user_ids = list(dict.fromkeys(user_ids))
+        groups = {}
+        missing = []
+        for user_id, session in zip(user_ids, self.active_users.get_many(user_ids)):
+            if session is None:
+                missing.append(user_id)
+            else:
+                groups.setdefault(normalize_city(session.destination), []).append((user_id, session))
+        return groups, missing
+    
+    def batch_notifications(self, user_ids):
+        """(user_id, notificaciones o None sin sesión) a medida que llega el clima: un lookup por ciudad"""
+        groups, missing = self.plan_notification_batch(user_ids)
         current_hour = datetime.now().hour
-        travel_phase = user_data.get('travel_phase', 'exploring')
+        phase_cache = {}
+        for user_id in missing:
+            yield user_id, None
+        if '' in groups:
+            yield from self.group_notifications(groups.pop(''), None, current_hour, phase_cache)
+        if not groups:
+            return
+        
+        with ThreadPoolExecutor(max_workers=min(FreeConfig.NOTIFICATION_FETCH_PARALLELISM, len(groups))) as pool:
+            # Cualquier miembro sirve para el nombre: la key ya está normalizada
+            futures = {pool.submit(self.get_weather_data, members[0][1].destination): city
+                       for city, members in groups.items()}
+            for future in as_completed(futures):
+                members = groups[futures[future]]
+                yield from self.group_notifications(members, future.result(), current_hour, phase_cache)
+    
+    def weather_notifications(self, destination, weather):
+        """Alertas de clima para un destino; iguales para todos los usuarios de esa ciudad"""
+        notifications = []
+        
+        if weather['temperature'] < self.notification_rules['weather_alerts']['temperature_low']:
+            notifications.append({
+                'type': 'weather_alert',
+                'priority': 'high',
+                'rule': 'temperature_low',
+                'destination': destination,
+                'message': f"🧥 Temperatura baja: {weather['temperature']}°C en {destination}. Recomendación: Lleva abrigo."
+            })
+        
+        if weather['temperature'] > self.notification_rules['weather_alerts']['temperature_high']:
+            notifications.append({
+                'type': 'weather_alert',
+                'priority': 'high',
+                'rule': 'temperature_high',
+                'destination': destination,
+                'message': f"🌡️ Temperatura alta: {weather['temperature']}°C en {destination}. Mantente hidratado y usa protector solar."
+            })
+        
+        # Con pronóstico cuenta la lluvia de las próximas horas, no solo la de ahora
+        rain_probability = weather.get('rain_probability_next_hours', weather['rain_probability'])
+        if rain_probability > self.notification_rules['weather_alerts']['rain_probability']:
+            notifications.append({
+                'type': 'weather_alert',
+                'priority': 'medium',
+                'rule': 'rain_probability',
+                'destination': destination,
+                'message': f"☔ Probabilidad de lluvia: {rain_probability}% en {destination}. Lleva paraguas."
+            })
+        
+        return notifications
+    
+    def time_based_notifications(self, travel_phase, current_hour):
+        """Notificaciones inteligentes basadas en tiempo"""
+        notifications = []
         
         if current_hour == 8 and travel_phase == 'exploring':
             notifications.append({
@@ -279,37 +696,133 @@ class DespegarAIAgent:
             })
         
         return notifications
+    
+    def start_chat_turn(self, data):
+        """Leer el body de /api/chat y registrar la actividad del usuario"""
+        user_id = data.get('user_id', 'anonymous')
+        message = data.get('message', '')
+        user_context = data.get('context', {})
+        
+        # Agregar user_id y session_id al contexto
+        user_context['user_id'] = user_id
+        user_context['session_id'] = user_context.get('session_id', f"session_{user_id}_{datetime.now().timestamp()}")
+        
+        # Actualizar contexto del usuario
+        self.register_chat_activity(user_id, user_context)
+        return message, user_context
+    
+    def check_rate_limits(self, user_id, ip):
+        """0.0 si el request pasa; si no, segundos de espera (primero la IP, después el usuario)"""
+        retry_after = self.ip_limiter.acquire(ip or 'unknown')
+        if retry_after or not user_id:
+            return retry_after
+        return self.user_limiter.acquire(user_id)
+    
+    def remember_turn(self, user_context, user_message, ai_response):
+        """Agregar el intercambio al historial (los anónimos no tienen historial)"""
+        user_id = user_context.get('user_id')
+        if user_id and user_id != 'anonymous':
+            self.conversations.append_exchange(user_id, user_message, ai_response)
+    
+    def forget_user(self, user_id):
+        """Sesión desalojada: liberar su cola push y su historial"""
+        self.notification_hub.forget(user_id)
+        self.conversations.forget(user_id)
+    
+    def register_chat_activity(self, user_id, user_context):
+        """Guardar el contexto del usuario al recibir un mensaje"""
+        session = self.active_users.record_chat(user_id, user_context)
+        self.background_activity('chat', user_id, user_context, session.destination)
+        return session
+    
+    def update_user_context(self, user_id, context):
+        """Mezclar el contexto nuevo con el que ya tenía el usuario"""
+        session = self.active_users.update_context(user_id, context)
+        self.background_activity('update', user_id, context, session.destination)
+        return session
+    
+    def update_user_contexts(self, updates):
+        """update_user_context para un lote [(user_id, context)] con un solo lock"""
+        sessions = self.active_users.update_contexts(updates)
+        if self.worker_bridge is not None:
+            for user_id, context in updates:
+                self.worker_bridge.record('update', user_id, context)
+        else:
+            for destination in {session.destination for session in sessions}:
+                self.forecast_prefetcher.want(destination)
+        return sessions
+
+    def background_activity(self, kind, user_id, context, destination):
+        """Avisar a los jobs background: al worker por la cola local o al prefetch de este proceso"""
+        if self.worker_bridge is not None:
+            self.worker_bridge.record(kind, user_id, context)
+        else:
+            self.forecast_prefetcher.want(destination)
 
 # Instancia global del agente
 ai_agent = DespegarAIAgent()
+notification_scheduler = NotificationScheduler(
+    ai_agent,
+    interval=FreeConfig.NOTIFICATION_INTERVAL,
+    max_parallel_fetches=FreeConfig.NOTIFICATION_FETCH_PARALLELISM,
+    active_window=FreeConfig.NOTIFICATION_ACTIVE_WINDOW
+)
 
 @app.route('/')
 def home():
     """Página principal con el chat"""
     return render_template('chat.html')
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    start_background()
+
+@app.after_request
+def record_request_metrics(response):
+    """Latencia por ruta (patrón de la regla, no la URL: cardinalidad acotada)"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        ai_agent.record_request(route, request.method, response.status_code, time.perf_counter() - started)
+    return response
+
+def rate_limit_body(retry_after):
+    """Cuerpo y headers del 429 (compartido con el modo ASGI)"""
+    return {
+        'success': False,
+        'error': 'rate_limited',
+        'retry_after': round(retry_after, 2),
+        'response': 'Estás enviando muchos mensajes seguidos. Esperá unos segundos y probá de nuevo 🙏'
+    }, {'Retry-After': str(math.ceil(retry_after))}
+
+def rate_limited(user_id=None):
+    """Respuesta 429 si el usuario o la IP agotaron su token bucket; None si puede seguir"""
+    retry_after = ai_agent.check_rate_limits(user_id, request.remote_addr)
+    if not retry_after:
+        return None
+    body, headers = rate_limit_body(retry_after)
+    return jsonify(body), 429, headers
+
+def bulk_items(key):
+    """Ítems de un body batch: NDJSON se lee línea a línea mientras se responde, JSON de una vez"""
+    if is_ndjson(request.mimetype):
+        return ndjson_items(request.stream)
+    return json_items(request.get_json(silent=True), key)
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """Endpoint principal del chat - TOQAN REAL"""
     try:
         data = request.json
-        user_id = data.get('user_id', 'anonymous')
-        message = data.get('message', '')
-        user_context = data.get('context', {})
-        
-        # Agregar user_id y session_id al contexto
-        user_context['user_id'] = user_id
-        user_context['session_id'] = user_context.get('session_id', f"session_{user_id}_{datetime.now().timestamp()}")
-        
-        # Actualizar contexto del usuario
-        ai_agent.active_users[user_id] = {
-            **user_context,
-            'last_activity': datetime.now(),
-            'message_count': ai_agent.active_users.get(user_id, {}).get('message_count', 0) + 1
-        }
+        limited = rate_limited(data.get('user_id'))
+        if limited:
+            return limited
+        message, user_context = ai_agent.start_chat_turn(data)
         
-        # Generar respuesta con Toqan REAL
-        ai_response = ai_agent.get_toqan_response(message, user_context)
+        # Generar respuesta con Toqan REAL ("cache": false en el body fuerza ir a Toqan)
+        ai_response = ai_agent.get_toqan_response(message, user_context, use_cache=data.get('cache', True) is not False)
+        ai_agent.remember_turn(user_context, message, ai_response)
         
         return jsonify({
             'success': True,
@@ -320,13 +833,44 @@ def chat():
         })
         
     except Exception as e:
-        print(f"🚨 Error en chat endpoint: {str(e)}")
+        log.exception("chat_endpoint_error error=%s", e)
         return jsonify({
             'success': False,
             'error': str(e),
             'response': 'Lo siento, tengo problemas técnicos temporales. ¿Puedes intentar de nuevo? 😅'
         })
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Chat en streaming (SSE): los chunks de Toqan se reenvían apenas llegan"""
+    try:
+        data = request.json
+        limited = rate_limited(data.get('user_id'))
+        if limited:
+            return limited
+        message, user_context = ai_agent.start_chat_turn(data)
+        use_cache = data.get('cache', True) is not False
+    except Exception as e:
+        log.exception("chat_stream_endpoint_error error=%s", e)
+        return Response(sse_event('error', {'error': str(e)}), mimetype='text/event-stream')
+    
+    def events():
+        chunks = []
+        try:
+            for chunk in ai_agent.stream_toqan_response(message, user_context, use_cache=use_cache):
+                chunks.append(chunk)
+                yield sse_event('token', {'text': chunk})
+            ai_agent.remember_turn(user_context, message, ''.join(chunks))
+        except Exception as e:
+            yield sse_event('error', {'error': str(e)})
+        yield sse_event('done', {
+            'timestamp': datetime.now().isoformat(),
+            'source': 'toqan_real',
+            'space_id': TOQAN_SPACE_ID
+        })
+    
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers=SSE_HEADERS)
+
 @app.route('/api/notifications/<user_id>')
 def get_notifications(user_id):
     """Obtener notificaciones automáticas - GRATIS"""
@@ -343,6 +887,66 @@ def get_notifications(user_id):
             'notifications': []
         })
 
+@app.route('/api/notifications/batch', methods=['POST'])
+def get_notifications_batch():
+    """Notificaciones de muchos usuarios (JSON o NDJSON) - un lookup de clima por ciudad, resultados en NDJSON"""
+    limited = rate_limited()
+    if limited:
+        return limited
+    try:
+        items = bulk_items('user_ids')
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    def results():
+        users = inactive = failed = 0
+        for batch in batched(items, FreeConfig.BULK_BATCH_SIZE):
+            valid, errors = split_valid(batch, parse_user_id)
+            if errors:
+                failed += len(errors)
+                yield ndjson_lines(errors)
+            for user_id, notifications in ai_agent.batch_notifications(user_id for _, user_id in valid):
+                users += 1
+                inactive += notifications is None
+                yield ndjson_line({
+                    'user_id': user_id,
+                    'active': notifications is not None,
+                    'notifications': notifications or []
+                })
+        yield ndjson_line({'done': True, 'users': users, 'inactive': inactive, 'errors': failed})
+    
+    return Response(stream_with_context(results()), mimetype=NDJSON_MIMETYPE, headers=NDJSON_HEADERS)
+
+@app.route('/api/notifications/<user_id>/stream')
+def notifications_stream(user_id):
+    """Notificaciones push (SSE) - reemplaza el polling cada 30 segundos"""
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    after_id = int(last_event_id) if last_event_id.isdigit() else 0
+    
+    # Primer chequeo al conectar; después las encola el thread background
+    try:
+        ai_agent.push_notifications(user_id)
+    except Exception as e:
+        log.warning("notifications_error user_id=%s error=%s", user_id, e)
+    
+    def events():
+        last_id = after_id
+        hub = ai_agent.notification_hub
+        hub.connect(user_id)
+        try:
+            while True:
+                items = hub.wait_for(user_id, last_id, timeout=FreeConfig.NOTIFICATION_KEEPALIVE)
+                if not items:
+                    yield ": keepalive\n\n"
+                    continue
+                for notification_id, notification in items:
+                    last_id = notification_id
+                    yield sse_event('notification', notification, event_id=notification_id)
+        finally:
+            hub.disconnect(user_id)
+    
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers=SSE_HEADERS)
+
 @app.route('/api/user/update', methods=['POST'])
 def update_user_context():
     """Actualizar contexto del usuario"""
@@ -352,19 +956,43 @@ def update_user_context():
         context = data.get('context', {})
         
         if user_id:
-            ai_agent.active_users[user_id] = {
-                **ai_agent.active_users.get(user_id, {}),
-                **context,
-                'last_update': datetime.now()
-            }
+            ai_agent.update_user_context(user_id, context)
             
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/user/update/batch', methods=['POST'])
+def update_user_contexts_batch():
+    """Actualizar el contexto de muchos usuarios (JSON o NDJSON) - un lock por lote, resultados en NDJSON"""
+    limited = rate_limited()
+    if limited:
+        return limited
+    try:
+        items = bulk_items('updates')
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    def results():
+        updated = failed = 0
+        for batch in batched(items, FreeConfig.BULK_BATCH_SIZE):
+            valid, errors = split_valid(batch, parse_context_update)
+            ai_agent.update_user_contexts([update for _, update in valid])
+            updated += len(valid)
+            failed += len(errors)
+            yield ndjson_lines(errors + [
+                {'index': index, 'user_id': user_id, 'success': True} for index, (user_id, _) in valid
+            ])
+        yield ndjson_line({'done': True, 'updated': updated, 'errors': failed})
+    
+    return Response(stream_with_context(results()), mimetype=NDJSON_MIMETYPE, headers=NDJSON_HEADERS)
+
 @app.route('/api/weather/<city>')
 def get_weather(city):
     """Obtener clima para una ciudad - API GRATUITA"""
+    limited = rate_limited(request.args.get('user_id'))
+    if limited:
+        return limited
     weather_data = ai_agent.get_weather_data(city)
     return jsonify({
         'success': True,
@@ -377,15 +1005,56 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'active_users': len(ai_agent.active_users),
+        'sessions': ai_agent.active_users.stats(),
+        'weather_cache': ai_agent.weather_cache.stats(),
+        'forecast': {**ai_agent.forecasts.stats(), 'prefetch': ai_agent.forecast_prefetcher.stats()},
+        'response_cache': ai_agent.response_cache.stats(),
+        'conversations': ai_agent.conversations.stats(),
+        'snapshot': ai_agent.snapshots.stats(),
+        'latency': {
+            'routes': ai_agent.request_latency.snapshot(),
+            'upstreams': ai_agent.upstream_latency.snapshot()
+        },
+        'toqan_responses': ai_agent.toqan_responses.snapshot(),
+        'logging': log_handler.stats(),
+        'notifications': ai_agent.notification_hub.stats(),
+        'scheduler': notification_scheduler.stats(),
+        'background': {
+            'mode': background_mode,
+            'worker': ai_agent.worker_bridge.stats() if ai_agent.worker_bridge else None
+        },
+        'upstreams': {
+            'toqan': ai_agent.toqan_client.stats(),
+            'openweathermap': ai_agent.weather_client.stats()
+        },
+        'circuit_breakers': {
+            'toqan': ai_agent.toqan_breaker.stats()
+        },
+        'quotas': {
+            'toqan': ai_agent.toqan_quota.stats(),
+            'openweathermap': ai_agent.weather_quota.stats()
+        },
+        'rate_limits': {
+            'user': ai_agent.user_limiter.stats(),
+            'ip': ai_agent.ip_limiter.stats()
+        },
         'ai_backend': 'toqan_real',
         'space_id': TOQAN_SPACE_ID,
         'workspace_url': TOQAN_WORKSPACE_URL,
         'cost': '$0.00'
     })
 
+@app.route('/api/metrics')
+def metrics():
+    """Métricas en formato texto de Prometheus"""
+    return Response(ai_agent.metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/test-toqan')
 def test_toqan():
     """Endpoint para testear la conexión con Toqan"""
+    limited = rate_limited()
+    if limited:
+        return limited
     try:
         test_context = {
             'destination': 'París, Francia',
@@ -404,7 +1073,9 @@ def test_toqan():
                 'space_id': TOQAN_SPACE_ID,
                 'api_url': TOQAN_API_URL,
                 'has_api_key': bool(TOQAN_API_KEY and len(TOQAN_API_KEY) > 10)
-            }
+            },
+            # Con el breaker abierto test_response es el fallback local
+            'circuit_breaker': ai_agent.toqan_breaker.stats()
         })
     except Exception as e:
         return jsonify({
@@ -414,32 +1085,44 @@ def test_toqan():
                 'space_id': TOQAN_SPACE_ID,
                 'api_url': TOQAN_API_URL,
                 'has_api_key': bool(TOQAN_API_KEY and len(TOQAN_API_KEY) > 10)
-            }
+            },
+            'circuit_breaker': ai_agent.toqan_breaker.stats()
         })
 
-def background_notifications():
-    """Envío de notificaciones en background - GRATIS"""
-    while True:
-        try:
-            for user_id in list(ai_agent.active_users.keys()):
-                user_data = ai_agent.active_users[user_id]
-                
-                # Verificar si el usuario está activo (última actividad < 2 horas)
-                if (datetime.now() - user_data.get('last_activity', datetime.now())).seconds < 7200:
-                    notifications = ai_agent.check_automatic_notifications(user_id)
-                    
-                    if notifications:
-                        print(f"Notificaciones gratuitas para {user_id}: {len(notifications)}")
-                        # Aquí se podrían enviar por WebSocket o guardar en DB
-                
-        except Exception as e:
-            print(f"Error en background notifications: {e}")
-        
-        time.sleep(600)  # Verificar cada 10 minutos (ahorro de recursos)
+def build_worker_bridge(agent):
+    """Cola local hacia el worker background (python background_worker.py)"""
+    return WorkerBridge(
+        agent,
+        LocalQueue(FreeConfig.WORKER_QUEUE_PATH),
+        WorkerLock(FreeConfig.WORKER_LOCK_PATH),
+        poll_interval=FreeConfig.WORKER_POLL_INTERVAL,
+        retention=FreeConfig.WORKER_QUEUE_RETENTION
+    )
+
+# 'worker': notificaciones y pronósticos en background_worker.py (uno por host); 'inline': en este proceso
+background_mode = FreeConfig.BACKGROUND_JOBS
+_background_lock = threading.Lock()
+_background_started = False
 
-# Iniciar thread de notificaciones background
-notification_thread = threading.Thread(target=background_notifications, daemon=True)
-notification_thread.start()
+def start_background():
+    """Threads de este proceso; se llama con el primer request, nunca al importar"""
+    # Importar el módulo (gunicorn, la app ASGI, el worker o un test) no arranca threads
+    # ni registra el snapshot al salir: no pisa el snapshot con el estado de este agente
+    global _background_started
+    if _background_started:
+        return
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+        ai_agent.snapshots.start()
+        if background_mode == 'inline':
+            jobs = (notification_scheduler.run_forever, ai_agent.forecast_prefetcher.run_forever)
+        else:
+            ai_agent.worker_bridge = build_worker_bridge(ai_agent)
+            jobs = (ai_agent.worker_bridge.run_forever,)
+        for job in jobs:
+            threading.Thread(target=job, daemon=True).start()
 
 if __name__ == '__main__':
     print("🚀 Iniciando Despegar AI Chat - TOQAN REAL")
@@ -449,4 +1132,6 @@ if __name__ == '__main__':
     print("📍 Chat disponible en: http://localhost:5000")
     print("🧪 Test Toqan: http://localhost:5000/api/test-toqan")
     print("💰 Costo total: $0.00")
+    # Servidor de desarrollo: un solo proceso, los jobs corren acá mismo
+    background_mode = 'inline'
     app.run(debug=True, host='0.0.0.0', port=5000)
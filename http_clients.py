@@ -0,0 +1,213 @@
+# http_clients.py - Clientes HTTP con pool keep-alive para Toqan y OpenWeatherMap
+import asyncio
+import json
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiohttp  # Solo necesario para el modo ASGI
+except ImportError:
+    aiohttp = None
+
+# Solo se reintentan métodos sin efectos secundarios
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+
+def jittered_backoff(attempt, base, cap):
+    """Full jitter: uniforme entre 0 y base * 2^attempt (acotado por cap)"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class UpstreamClient:
+    """Session pooled por upstream con timeouts, reintentos y métricas de reuso"""
+
+    def __init__(self, name, pool_size=10, connect_timeout=3.0, read_timeout=10.0,
+                 max_retries=2, backoff_base=0.2, backoff_max=2.0, headers=None, on_response=None):
+        self.name = name
+        self.on_response = on_response  # on_response(segundos, '2xx' | '5xx' | 'error') por intento
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.session = requests.Session()
+        if headers:
+            self.session.headers.update(headers)
+        # pool_block=False: si el pool se llena se abre una conexión extra en vez de bloquear
+        self._adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', self._adapter)
+        self.session.mount('https://', self._adapter)
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        """Hacer un request; reintenta con backoff+jitter solo si es idempotente"""
+        method = method.upper()
+        kwargs.setdefault('timeout', self.timeout)
+        attempts = 1 + (self.max_retries if method in IDEMPOTENT_METHODS else 0)
+
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            self._count('requests')
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self._observe(started, 'error')
+                if last_attempt:
+                    self._count('errors')
+                    raise
+            else:
+                self._observe(started, f"{response.status_code // 100}xx")
+                if response.status_code not in RETRY_STATUS_CODES or last_attempt:
+                    return response
+                response.close()
+
+            self._count('retries')
+            time.sleep(jittered_backoff(attempt, self.backoff_base, self.backoff_max))
+
+    def _observe(self, started, outcome):
+        if self.on_response is not None:
+            self.on_response(time.perf_counter() - started, outcome)
+
+    def _count(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def connection_stats(self):
+        """Conexiones abiertas vs requests servidos por los pools de urllib3"""
+        opened = served = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened += pool.num_connections
+            served += pool.num_requests
+        return opened, served
+
+    def stats(self):
+        """Métricas para /api/health"""
+        opened, served = self.connection_stats()
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'errors': self.errors,
+            'connections_opened': opened,
+            'connections_reused': max(served - opened, 0),
+            'reuse_ratio': round(1 - opened / served, 4) if served else 0.0,
+            'pool_size': self._adapter._pool_maxsize,
+            'timeout': {'connect': self.timeout[0], 'read': self.timeout[1]}
+        }
+
+    def close(self):
+        self.session.close()
+
+
+class UpstreamResponse:
+    """Respuesta ya leída de AsyncUpstreamClient (misma interfaz que requests)"""
+    __slots__ = ('status_code', 'content')
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AsyncUpstreamClient:
+    """Equivalente asyncio de UpstreamClient sobre aiohttp (modo ASGI)"""
+
+    def __init__(self, name, pool_size=100, connect_timeout=3.0, read_timeout=10.0,
+                 max_retries=2, backoff_base=0.2, backoff_max=2.0, headers=None, on_response=None):
+        if aiohttp is None:
+            raise RuntimeError("El modo ASGI requiere aiohttp (pip install aiohttp)")
+        self.name = name
+        self.on_response = on_response
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # Debe crearse dentro del event loop que lo va a usar
+        self.session = aiohttp.ClientSession(
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout),
+            connector=aiohttp.TCPConnector(limit=pool_size, limit_per_host=pool_size)
+        )
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    async def request(self, method, url, **kwargs):
+        """Mismas reglas de reintento que UpstreamClient, sin bloquear el event loop"""
+        method = method.upper()
+        attempts = 1 + (self.max_retries if method in IDEMPOTENT_METHODS else 0)
+
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            self.requests += 1
+            started = time.perf_counter()
+            try:
+                async with self.session.request(method, url, **kwargs) as response:
+                    status = response.status
+                    content = await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self._observe(started, 'error')
+                if last_attempt:
+                    self.errors += 1
+                    raise
+            else:
+                self._observe(started, f"{status // 100}xx")
+                if status not in RETRY_STATUS_CODES or last_attempt:
+                    return UpstreamResponse(status, content)
+
+            self.retries += 1
+            await asyncio.sleep(jittered_backoff(attempt, self.backoff_base, self.backoff_max))
+
+    def _observe(self, started, outcome):
+        if self.on_response is not None:
+            self.on_response(time.perf_counter() - started, outcome)
+
+    def stream(self, method, url, **kwargs):
+        """Context manager con la respuesta aiohttp sin leer (sin reintentos ni on_response)"""
+        self.requests += 1
+        return self.session.request(method.upper(), url, **kwargs)
+
+    def stats(self):
+        """Métricas para /api/health"""
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'errors': self.errors,
+            'pool_size': self.pool_size,
+            'timeout': {'connect': self.timeout[0], 'read': self.timeout[1]}
+        }
+
+    async def aclose(self):
+        await self.session.close()
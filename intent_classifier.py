@@ -0,0 +1,107 @@
+# intent_classifier.py - Clasificador de intenciones precompilado para el fallback
+import json
+import os
+import re
+import unicodedata
+
+DEFAULT_INTENTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'intents.json')
+
+_TOKEN = re.compile(r"[a-z0-9ñ]+")
+_WORD = re.compile(r"\w+")
+# Acentos del español/portugués/francés resueltos con translate; NFKD solo queda para lo raro
+_ACCENTS = str.maketrans('áàâäãéèêëíìîïóòôöõúùûüç¿¡', 'aaaaaeeeeiiiiooooouuuuc  ')
+_RARE = re.compile(r"[^\x00-\x7fñ]")
+
+
+def fold(text):
+    """Minúsculas y sin acentos (la ñ se conserva)"""
+    text = (text or '').lower().translate(_ACCENTS)
+    if not _RARE.search(text):
+        return text
+    text = unicodedata.normalize('NFKD', text.replace('ñ', '\0'))
+    return ''.join(ch for ch in text if not unicodedata.combining(ch)).replace('\0', 'ñ')
+
+
+def tokenize(text):
+    return _TOKEN.findall(fold(text))
+
+
+class IntentClassifier:
+    """Índice de keywords compilado una vez: palabra exacta, prefijo o frase, en una sola pasada"""
+
+    def __init__(self, table, memo_size=50000):
+        self.version = table.get('version')
+        self.intents = []
+        self._exact = {}  # token -> mejor prioridad
+        self._prefixes = {}  # prefijo -> mejor prioridad
+        self._prefix_lengths = ()
+        self._phrases = {}  # primer token -> [(resto, prioridad)]
+        # Vocabulario ya visto: palabra cruda -> (token plegado, prioridad); se vacía al llenarse
+        self._memo = {}
+        self.memo_size = memo_size
+
+        for priority, entry in enumerate(table['intents']):
+            self.intents.append(entry['intent'])
+            for keyword in entry['keywords']:
+                self._add(keyword, priority)
+        self._prefix_lengths = tuple(sorted({len(prefix) for prefix in self._prefixes}))
+
+    @classmethod
+    def from_file(cls, path=DEFAULT_INTENTS_PATH):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def _add(self, keyword, priority):
+        tokens = tokenize(keyword.rstrip('*'))
+        if not tokens:
+            return
+        if len(tokens) > 1:
+            self._phrases.setdefault(tokens[0], []).append((tuple(tokens[1:]), priority))
+        elif keyword.endswith('*'):
+            self._keep_best(self._prefixes, tokens[0], priority)
+        else:
+            self._keep_best(self._exact, tokens[0], priority)
+
+    @staticmethod
+    def _keep_best(index, key, priority):
+        if key not in index or priority < index[key]:
+            index[key] = priority
+
+    def _resolve(self, word):
+        """Palabra cruda -> (token plegado, prioridad por palabra exacta o prefijo)"""
+        token = fold(word)
+        best = self._exact.get(token, len(self.intents))
+        for length in self._prefix_lengths:
+            if length > len(token):
+                break
+            priority = self._prefixes.get(token[:length], best)
+            if priority < best:
+                best = priority
+        return token, best
+
+    def classify(self, message):
+        """Intención de mayor prioridad presente en el mensaje, o None"""
+        words = _WORD.findall(message.lower()) if message else ()
+        memo, phrases = self._memo, self._phrases
+        best = none = len(self.intents)
+        tokens = []
+
+        for word in words:
+            resolved = memo.get(word)
+            if resolved is None:
+                if len(memo) >= self.memo_size:
+                    memo.clear()
+                resolved = memo[word] = self._resolve(word)
+            tokens.append(resolved[0])
+            if resolved[1] < best:
+                best = resolved[1]
+                if best == 0:
+                    return self.intents[0]
+
+        if phrases:
+            for i, token in enumerate(tokens):
+                for rest, priority in phrases.get(token, ()):
+                    if priority < best and tuple(tokens[i + 1:i + 1 + len(rest)]) == rest:
+                        best = priority
+
+        return self.intents[best] if best < none else None
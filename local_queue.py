@@ -0,0 +1,94 @@
+# local_queue.py - Cola local en SQLite entre los workers web y el worker background del mismo host
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Web -> worker (un solo consumidor, se borra al leer)
+ACTIVITY = 'activity'
+# Worker -> web (cada worker web lee todo con su propio cursor)
+NOTIFICATIONS = 'notifications'
+FORECASTS = 'forecasts'
+
+
+class LocalQueue:
+    """Mensajes JSON por tópico en un archivo SQLite (WAL); sirve entre procesos del mismo host"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    topic TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS messages_topic ON messages (topic, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS messages_created ON messages (created)")
+
+    @contextmanager
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        yield conn
+
+    def put_many(self, topic, payloads):
+        """Encolar varios mensajes en una sola transacción"""
+        if not payloads:
+            return
+        now = time.time()
+        rows = [(topic, json.dumps(payload, ensure_ascii=False), now) for payload in payloads]
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany("INSERT INTO messages (topic, payload, created) VALUES (?, ?, ?)", rows)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def put(self, topic, payload):
+        self.put_many(topic, [payload])
+
+    def read(self, topic, after_id=0, limit=1000):
+        """[(id, payload)] con id > after_id; no borra (tópicos que leen todos los workers)"""
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT id, payload FROM messages WHERE topic = ? AND id > ? ORDER BY id LIMIT ?",
+                (topic, after_id, limit)
+            ).fetchall()
+        return [(message_id, json.loads(payload)) for message_id, payload in rows]
+
+    def take(self, topic, limit=1000):
+        """Leer y borrar en orden (tópicos con un solo consumidor)"""
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT id, payload FROM messages WHERE topic = ? ORDER BY id LIMIT ?", (topic, limit)
+            ).fetchall()
+            if rows:
+                conn.execute("DELETE FROM messages WHERE topic = ? AND id <= ?", (topic, rows[-1][0]))
+        return [json.loads(payload) for _, payload in rows]
+
+    def last_id(self, topic):
+        """Cursor para empezar a leer desde ahora"""
+        with self._connection() as conn:
+            return conn.execute("SELECT MAX(id) FROM messages WHERE topic = ?", (topic,)).fetchone()[0] or 0
+
+    def prune(self, older_than):
+        """Borrar mensajes viejos de todos los tópicos; devuelve cuántos"""
+        with self._connection() as conn:
+            return conn.execute("DELETE FROM messages WHERE created < ?", (older_than,)).rowcount
+
+    def count(self, topic=None):
+        with self._connection() as conn:
+            if topic is None:
+                return conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+            return conn.execute("SELECT COUNT(*) FROM messages WHERE topic = ?", (topic,)).fetchone()[0]
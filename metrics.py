@@ -0,0 +1,181 @@
+# metrics.py - Contadores e histogramas en proceso con salida en formato texto de Prometheus
+import bisect
+import threading
+
+# Buckets en segundos: de 1 ms (cache) a 30 s (Toqan lento)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Contador monotónico por combinación de labels"""
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, labels, value) for labels, value in items]
+
+    def snapshot(self):
+        with self._lock:
+            return {'/'.join(labels) or 'total': value for labels, value in self._values.items()}
+
+
+class Histogram:
+    """Histograma con buckets fijos; observe() es un bisect + tres sumas bajo lock"""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [conteos por bucket (+Inf al final), suma, cantidad]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def quantile(self, q, *labels):
+        """Estimación por interpolación lineal dentro del bucket (como histogram_quantile)"""
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None or not series[2]:
+                return None
+            counts, total = list(series[0]), series[2]
+        rank = q * total
+        cumulative = 0
+        for i, count in enumerate(counts):
+            if cumulative + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i == len(self.buckets):
+                    return lower  # cae en +Inf: el último bucket finito es lo mejor que hay
+                upper = self.buckets[i]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(series[0]), series[1], series[2]) for labels, series in self._series.items()]
+        out = []
+        for labels, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                out.append((f"{self.name}_bucket", labels + (_number(bound),), cumulative))
+            out.append((f"{self.name}_sum", labels, round(total, 6)))
+            out.append((f"{self.name}_count", labels, count))
+        return out
+
+    def sample_labelnames(self, sample_name):
+        return self.labelnames + ('le',) if sample_name.endswith('_bucket') else self.labelnames
+
+    def snapshot(self):
+        """p50/p95/p99 en ms por serie (para /api/health)"""
+        with self._lock:
+            keys = [(labels, series[2]) for labels, series in self._series.items()]
+        result = {}
+        for labels, count in keys:
+            result['/'.join(labels) or 'total'] = {
+                'count': count,
+                'p50_ms': round(self.quantile(0.5, *labels) * 1000, 2),
+                'p95_ms': round(self.quantile(0.95, *labels) * 1000, 2),
+                'p99_ms': round(self.quantile(0.99, *labels) * 1000, 2)
+            }
+        return result
+
+
+class CallbackMetric:
+    """Valor leído al exportar (stats() de caches, sesiones, breaker, ...)"""
+
+    def __init__(self, name, help_text, callback, kind='gauge', labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self._callback = callback
+
+    def samples(self):
+        value = self._callback()
+        if isinstance(value, dict):
+            return [(self.name, labels if isinstance(labels, tuple) else (labels,), v) for labels, v in value.items()]
+        return [(self.name, (), value)]
+
+
+class MetricsRegistry:
+    """Registro de métricas de la app; render() arma el texto de /api/metrics"""
+
+    def __init__(self, prefix='despegar'):
+        self.prefix = prefix
+        self._metrics = []
+
+    def _name(self, name):
+        return f"{self.prefix}_{name}"
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(Counter(self._name(name), help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(self._name(name), help_text, labelnames, buckets))
+
+    def callback(self, name, help_text, callback, kind='gauge', labelnames=()):
+        return self._add(CallbackMetric(self._name(name), help_text, callback, kind, labelnames))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = metric.samples()
+            except Exception:
+                continue  # un collector roto no tira abajo el endpoint
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for sample_name, labels, value in samples:
+                if hasattr(metric, 'sample_labelnames'):
+                    names = metric.sample_labelnames(sample_name)
+                else:
+                    names = metric.labelnames
+                lines.append(f"{sample_name}{_labels(names, labels)} {_number(value)}")
+        return '\n'.join(lines) + '\n'
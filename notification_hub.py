@@ -0,0 +1,150 @@
+# notification_hub.py - Cola de notificaciones por usuario para entrega push (SSE)
+import asyncio
+import threading
+import time
+from collections import deque
+
+
+def notification_fingerprint(notification):
+    """Identidad de una notificación para dedup (la temperatura exacta no cuenta)"""
+    if notification.get('rule'):
+        return (notification.get('type'), notification['rule'], notification.get('destination'))
+    return (notification.get('type'), notification.get('message'))
+
+
+class _UserChannel:
+    __slots__ = ('items', 'sent', 'waiters', 'subscribers')
+
+    def __init__(self, max_items):
+        self.items = deque(maxlen=max_items)  # (id, notification)
+        self.sent = {}  # fingerprint -> último envío (monotonic)
+        self.waiters = set()
+        self.subscribers = 0
+
+
+class NotificationHub:
+    """Notificaciones pendientes por usuario con dedup y espera bloqueante o asyncio"""
+
+    def __init__(self, max_items=50, dedup_window=3 * 3600, clock=time.monotonic, on_publish=None):
+        self.max_items = max_items
+        self.dedup_window = dedup_window
+        self._clock = clock
+        self.on_publish = on_publish  # (user_id, notificaciones que pasaron el dedup), p.ej. el worker background
+        self._channels = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self.published = 0
+        self.deduplicated = 0
+
+    def _channel(self, user_id):
+        channel = self._channels.get(user_id)
+        if channel is None:
+            channel = self._channels[user_id] = _UserChannel(self.max_items)
+        return channel
+
+    def publish(self, user_id, notifications):
+        """Encolar notificaciones nuevas; devuelve cuántas pasaron el dedup"""
+        if not notifications:
+            return 0
+        now = self._clock()
+        with self._lock:
+            channel = self._channel(user_id)
+            queued = []
+            for notification in notifications:
+                fingerprint = notification_fingerprint(notification)
+                last_sent = channel.sent.get(fingerprint)
+                if last_sent is not None and now - last_sent < self.dedup_window:
+                    self.deduplicated += 1
+                    continue
+                channel.sent[fingerprint] = now
+                channel.items.append((self._next_id, notification))
+                self._next_id += 1
+                queued.append(notification)
+
+            # Olvidar fingerprints vencidos para que el dict no crezca
+            if len(channel.sent) > self.max_items:
+                channel.sent = {fp: ts for fp, ts in channel.sent.items() if now - ts < self.dedup_window}
+
+            self.published += len(queued)
+            waiters = list(channel.waiters) if queued else []
+
+        for wake in waiters:
+            wake()
+        if queued and self.on_publish is not None:
+            self.on_publish(user_id, queued)
+        return len(queued)
+
+    def pending(self, user_id, after_id=0):
+        """Notificaciones con id > after_id (las más viejas pueden haberse descartado)"""
+        with self._lock:
+            channel = self._channels.get(user_id)
+            if channel is None:
+                return []
+            return [item for item in channel.items if item[0] > after_id]
+
+    def wait_for(self, user_id, after_id=0, timeout=15.0):
+        """Bloquear (thread) hasta que haya notificaciones nuevas o venza el timeout"""
+        event = threading.Event()
+        with self._lock:
+            channel = self._channel(user_id)
+            items = [item for item in channel.items if item[0] > after_id]
+            if items:
+                return items
+            channel.waiters.add(event.set)
+        try:
+            event.wait(timeout)
+        finally:
+            with self._lock:
+                channel.waiters.discard(event.set)
+        return self.pending(user_id, after_id)
+
+    async def await_for(self, user_id, after_id=0, timeout=15.0):
+        """Versión asyncio de wait_for (no bloquea el event loop)"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        with self._lock:
+            channel = self._channel(user_id)
+            items = [item for item in channel.items if item[0] > after_id]
+            if items:
+                return items
+            channel.waiters.add(wake)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                channel.waiters.discard(wake)
+        return self.pending(user_id, after_id)
+
+    def connect(self, user_id):
+        with self._lock:
+            self._channel(user_id).subscribers += 1
+
+    def disconnect(self, user_id):
+        with self._lock:
+            channel = self._channels.get(user_id)
+            if channel is not None:
+                channel.subscribers = max(channel.subscribers - 1, 0)
+
+    def is_connected(self, user_id):
+        channel = self._channels.get(user_id)
+        return channel is not None and channel.subscribers > 0
+
+    def forget(self, user_id):
+        """Liberar la cola de un usuario que ya no está activo"""
+        with self._lock:
+            self._channels.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'users': len(self._channels),
+                'connected': sum(1 for c in self._channels.values() if c.subscribers),
+                'published': self.published,
+                'deduplicated': self.deduplicated
+            }
@@ -0,0 +1,135 @@
+# notification_scheduler.py - Notificaciones background agrupadas por destino
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from app_logging import get_logger
+from weather_cache import normalize_city
+
+log = get_logger('scheduler')
+
+
+class NotificationScheduler:
+    """Un ciclo = un request de clima por ciudad y reglas evaluadas en batch por ciudad"""
+
+    def __init__(self, agent, interval=600, max_parallel_fetches=8, active_window=7200):
+        self.agent = agent
+        self.interval = interval
+        self.max_parallel_fetches = max_parallel_fetches
+        self.active_window = active_window
+        self.cycles = 0
+        self.last_cycle = {}
+        self._stop = threading.Event()
+
+    def plan(self):
+        """Agrupar usuarios activos por destino normalizado: {ciudad: [(user_id, session)]}"""
+        # De paso se desalojan las sesiones inactivas o por encima de la capacidad
+        self.agent.active_users.evict()
+
+        active_since = time.time() - self.active_window
+        groups = {}
+        scanned = 0
+        for user_id, session in self.agent.active_users.items():
+            scanned += 1
+            if session.last_seen < active_since:
+                continue
+            key = normalize_city(session.destination)
+            groups.setdefault(key, []).append((user_id, session))
+        return groups, scanned
+
+    def deliver(self, groups, weather_by_city):
+        """Evaluar reglas por ciudad y encolar en el hub; devuelve (notificaciones, encoladas)"""
+        hub = self.agent.notification_hub
+        current_hour = datetime.now().hour
+        phase_cache = {}
+        generated = queued = 0
+
+        for city, members in groups.items():
+            weather = weather_by_city.get(city)
+            for user_id, notifications in self.agent.group_notifications(members, weather, current_hour, phase_cache):
+                generated += len(notifications)
+                queued += hub.publish(user_id, notifications)
+
+        return generated, queued
+
+    def _record(self, started, scanned, groups, fetched, generated, queued):
+        cities = [city for city in groups if city]
+        duration = time.perf_counter() - started
+        self.agent.cycle_latency.observe(duration)
+        self.cycles += 1
+        self.last_cycle = {
+            'finished_at': datetime.now().isoformat(),
+            'duration_ms': round(duration * 1000, 2),
+            'users_scanned': scanned,
+            'users_active': sum(len(members) for members in groups.values()),
+            'cities': len(cities),
+            'weather_fetches': fetched,
+            'max_users_per_city': max((len(groups[city]) for city in cities), default=0),
+            'notifications_generated': generated,
+            'notifications_queued': queued
+        }
+        return self.last_cycle
+
+    def run_cycle(self):
+        """Un ciclo completo con threads (app Flask)"""
+        started = time.perf_counter()
+        groups, scanned = self.plan()
+        cities = [city for city in groups if city]
+        # Cualquier usuario del grupo sirve para el nombre: la key ya está normalizada
+        names = {city: groups[city][0][1].destination for city in cities}
+
+        weather_by_city = {}
+        if cities:
+            with ThreadPoolExecutor(max_workers=min(self.max_parallel_fetches, len(cities))) as pool:
+                for city, weather in zip(cities, pool.map(lambda c: self.agent.get_weather_data(names[c]), cities)):
+                    weather_by_city[city] = weather
+
+        generated, queued = self.deliver(groups, weather_by_city)
+        return self._record(started, scanned, groups, len(cities), generated, queued)
+
+    async def arun_cycle(self):
+        """Un ciclo completo en asyncio (modo ASGI), con el mismo límite de paralelismo"""
+        started = time.perf_counter()
+        groups, scanned = self.plan()
+        cities = [city for city in groups if city]
+        semaphore = asyncio.Semaphore(self.max_parallel_fetches)
+
+        async def fetch(city):
+            async with semaphore:
+                return await self.agent.aget_weather_data(groups[city][0][1].destination)
+
+        results = await asyncio.gather(*(fetch(city) for city in cities))
+        generated, queued = self.deliver(groups, dict(zip(cities, results)))
+        return self._record(started, scanned, groups, len(cities), generated, queued)
+
+    def run_forever(self):
+        """Loop del thread background; respeta NOTIFICATION_INTERVAL entre inicios de ciclo"""
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.run_cycle()
+            except Exception as e:
+                log.exception("notification_cycle_error error=%s", e)
+            self._stop.wait(max(self.interval - (time.monotonic() - started), 0))
+
+    async def arun_forever(self):
+        while True:
+            started = time.monotonic()
+            try:
+                await self.arun_cycle()
+            except Exception as e:
+                log.exception("notification_cycle_error error=%s", e)
+            await asyncio.sleep(max(self.interval - (time.monotonic() - started), 0))
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {
+            'interval_seconds': self.interval,
+            'max_parallel_fetches': self.max_parallel_fetches,
+            'cycles': self.cycles,
+            'last_cycle': self.last_cycle
+        }
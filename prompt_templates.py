@@ -0,0 +1,128 @@
+# prompt_templates.py - Prompt de Toqan compilado una vez y payload serializado directo a bytes
+import json
+import os
+import string
+from datetime import datetime
+from functools import partial
+
+try:
+    import orjson  # Opcional: encoder JSON en C, varias veces más rápido que json
+except ImportError:
+    orjson = None
+
+DEFAULT_PROMPTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'prompts.json')
+
+# Campos con pocos valores posibles: sus secciones se precodifican una vez por combinación
+STATIC_FIELDS = ('traveler_type', 'travel_phase')
+
+if orjson is not None:
+    dumps = partial(orjson.dumps, default=str)  # JSON compacto en UTF-8 (bytes)
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=str)
+
+    def dumps(value):
+        """JSON compacto en UTF-8 (bytes)"""
+        return _encoder.encode(value).encode('utf-8')
+
+
+def escape(text):
+    """Contenido de un string JSON sin las comillas: escape(a + b) == escape(a) + escape(b)"""
+    return dumps(text)[1:-1]
+
+
+class PromptTemplate:
+    """Secciones del prompt compiladas a segmentos ya escapados para JSON"""
+
+    def __init__(self, table, memo_size=256):
+        self.version = table.get('version')
+        self.defaults = table.get('defaults', {})
+        self.memo_size = memo_size
+        # Una sección opcional sale solo si su campo tiene contenido (p.ej. el historial)
+        self.optional = tuple(name for name in table['order'] if name in table.get('optional', ()))
+        self._sections = [(name, self._compile(table['sections'][name])) for name in table['order']]
+        # (traveler_type, travel_phase, secciones opcionales presentes) -> segmentos con literales unidos
+        self._memo = {}
+
+    @classmethod
+    def from_file(cls, path=DEFAULT_PROMPTS_PATH):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    @staticmethod
+    def _compile(text):
+        segments = []
+        for literal, field, _, _ in string.Formatter().parse(text):
+            if literal:
+                segments.append(escape(literal))
+            if field:
+                segments.append(field)
+        return segments
+
+    def _value(self, values, field):
+        value = values.get(field)
+        return self.defaults.get(field, '') if value is None or value == '' else value
+
+    def _plan(self, values):
+        key = (*map(values.get, STATIC_FIELDS), *map(bool, map(values.get, self.optional)))
+        plan = self._memo.get(key)
+        if plan is None:
+            static = {field: escape(str(self._value(values, field))) for field in STATIC_FIELDS}
+            plan = []
+            for name, segments in self._sections:
+                if name in self.optional and not values.get(name):
+                    continue
+                for segment in segments:
+                    segment = static.get(segment, segment)
+                    if isinstance(segment, bytes) and plan and isinstance(plan[-1], bytes):
+                        plan[-1] += segment
+                    else:
+                        plan.append(segment)
+            if len(self._memo) >= self.memo_size:
+                self._memo.clear()  # los valores vienen del cliente: no crecer sin límite
+            self._memo[key] = plan
+        return plan
+
+    def render(self, values):
+        """Prompt escapado, listo para ir entre comillas dentro del JSON (bytes)"""
+        return b''.join([
+            segment if segment.__class__ is bytes else escape(str(self._value(values, segment)))
+            for segment in self._plan(values)
+        ])
+
+    def render_text(self, values):
+        """El mismo prompt como str (para logs y benchmarks)"""
+        return json.loads(b'"' + self.render(values) + b'"')
+
+
+class ToqanPayloadEncoder:
+    """Body JSON de Toqan armado como bytes: los fragmentos fijos se codifican una sola vez"""
+
+    def __init__(self, template, space_id):
+        self.template = template
+        self._space = b'","spaceId":' + dumps(space_id) + b',"sessionId":'
+        self._version = b',"prompt_version":' + dumps(template.version) + b'}'
+
+    def encode(self, user_message, user_context, history='', stream=False):
+        """Mismo payload que armaba el dict + json de requests, sin objetos intermedios"""
+        now = datetime.now()
+        destination = user_context.get('destination')
+        traveler_type = user_context.get('traveler_type')
+        travel_phase = user_context.get('travel_phase')
+        prompt = self.template.render({
+            'destination': destination,
+            'traveler_type': traveler_type,
+            'travel_phase': travel_phase,
+            'history': history,
+            'message': user_message
+        })
+        return b''.join((
+            b'{"message":"', prompt, self._space,
+            dumps(user_context.get('session_id') or f"session_{now.timestamp()}"),
+            b',"userId":', dumps(user_context.get('user_id', 'anonymous')),
+            b',"context":{"destination":', dumps(destination),
+            b',"traveler_type":', dumps(traveler_type),
+            b',"travel_phase":', dumps(travel_phase),
+            b',"timestamp":', dumps(now.isoformat()),
+            self._version,
+            b',"stream":true}' if stream else b'}'
+        ))
@@ -0,0 +1,125 @@
+# rate_limiter.py - Token buckets por usuario/IP y cuota diaria por upstream
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucketLimiter:
+    """Un bucket por key ([tokens, último uso]) en un LRU; O(1) por request"""
+
+    def __init__(self, rate, burst, max_keys=100000, clock=time.monotonic):
+        self.rate = rate  # tokens por segundo
+        self.burst = burst
+        self.max_keys = max_keys
+        # Pasado este tiempo sin uso el bucket ya está lleno: borrarlo no cambia nada
+        self.idle_ttl = burst / rate if rate > 0 else float('inf')
+        self._clock = clock
+        self._buckets = OrderedDict()  # key -> [tokens, último uso], el menos usado primero
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.limited = 0
+        self.evictions = 0
+
+    def acquire(self, key, cost=1.0):
+        """0.0 si el request pasa; si no, segundos hasta que haya tokens (Retry-After)"""
+        now = self._clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+                self._buckets.move_to_end(key)
+            self._evict(now)
+
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                self.allowed += 1
+                return 0.0
+            self.limited += 1
+            return (cost - bucket[0]) / self.rate if self.rate > 0 else float('inf')
+
+    def _evict(self, now):
+        """Sacar del frente los buckets inactivos (ya llenos) o sobre max_keys"""
+        buckets = self._buckets
+        while buckets:
+            key = next(iter(buckets))
+            if len(buckets) <= self.max_keys and now - buckets[key][1] < self.idle_ttl:
+                break
+            del buckets[key]
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def stats(self):
+        """Métricas para /api/health"""
+        with self._lock:
+            return {
+                'keys': len(self._buckets),
+                'max_keys': self.max_keys,
+                'rate_per_minute': round(self.rate * 60, 2),
+                'burst': self.burst,
+                'allowed': self.allowed,
+                'limited': self.limited,
+                'evictions': self.evictions
+            }
+
+
+class QuotaGovernor:
+    """Presupuesto diario de llamadas a un upstream (por proceso, se reinicia a las 00:00 UTC)"""
+
+    def __init__(self, name, daily_limit, soft_ratio=0.8, ttl_stretch=6, clock=time.time):
+        self.name = name
+        self.daily_limit = daily_limit
+        self.soft_limit = int(daily_limit * soft_ratio)
+        self.ttl_stretch = ttl_stretch
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._day = self._today()
+        self.used = 0
+        self.denied = 0
+
+    def _today(self):
+        return int(self._clock() // 86400)
+
+    def _roll(self):
+        day = self._today()
+        if day != self._day:
+            self._day = day
+            self.used = 0
+            self.denied = 0
+
+    def try_acquire(self, calls=1):
+        """Reservar llamadas del presupuesto de hoy; False = usar cache o fallback"""
+        with self._lock:
+            self._roll()
+            if self.used + calls > self.daily_limit:
+                self.denied += 1
+                return False
+            self.used += calls
+            return True
+
+    @property
+    def degraded(self):
+        """Pasado el umbral blando se prioriza el cache para estirar lo que queda"""
+        with self._lock:
+            self._roll()
+            return self.used >= self.soft_limit
+
+    def scale_ttl(self, ttl):
+        """TTL de cache estirado ttl_stretch veces cuando la cuota está en modo degradado"""
+        return ttl * self.ttl_stretch if self.degraded else ttl
+
+    def stats(self):
+        """Métricas para /api/health"""
+        with self._lock:
+            self._roll()
+            return {
+                'daily_limit': self.daily_limit,
+                'used_today': self.used,
+                'remaining': max(self.daily_limit - self.used, 0),
+                'denied_today': self.denied,
+                'degraded': self.used >= self.soft_limit
+            }
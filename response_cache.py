@@ -0,0 +1,114 @@
+# response_cache.py - Cache de respuestas de Toqan por mensaje normalizado + contexto
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from warm_snapshot import SnapshotMixin
+from weather_cache import normalize_city
+
+_PUNCTUATION = re.compile(r"[^\w\s]", re.UNICODE)
+
+
+def normalize_message(message):
+    """'¿Cómo está el clima en París?' -> 'como esta el clima en paris'"""
+    folded = unicodedata.normalize('NFKD', message or '')
+    folded = ''.join(ch for ch in folded if not unicodedata.combining(ch))
+    return ' '.join(_PUNCTUATION.sub(' ', folded.lower()).split())
+
+
+class ResponseCache(SnapshotMixin):
+    """LRU acotado con TTL por categoría de intención y contabilidad de latencia ahorrada"""
+
+    def __init__(self, max_entries=2000, ttls=None, default_ttl=3600, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (expires_at, response, upstream_latency)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self.latency_saved = 0.0
+
+    def key_for(self, user_message, user_context):
+        return (
+            normalize_message(user_message),
+            normalize_city(user_context.get('destination')),
+            user_context.get('traveler_type') or 'general',
+            user_context.get('travel_phase') or 'planning'
+        )
+
+    def ttl_for(self, intent):
+        return self.ttls.get(intent or 'general', self.default_ttl)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key) or self._fault_in(key)
+            if entry is not None:
+                if entry[0] > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self.latency_saved += entry[2]
+                    return entry[1]
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, response, intent=None, latency=0.0):
+        ttl = self.ttl_for(intent)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self._clock() + ttl, response, latency)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def bypass(self):
+        """Contar un request que pidió no usar cache"""
+        with self._lock:
+            self.bypassed += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._snapshot_discard()
+
+    def snapshot_key(self, key):
+        return '\x1f'.join(key)
+
+    def entry_key(self, key):
+        return tuple(key.split('\x1f'))
+
+    def encode_snapshot(self, entry, now):
+        expires_at, response, latency = entry
+        remaining = expires_at - self._clock()
+        return [now + remaining, response, latency] if remaining > 0 else None
+
+    def decode_snapshot(self, key, value, now):
+        expires_at, response, latency = value
+        remaining = expires_at - now
+        return (self._clock() + remaining, response, latency) if remaining > 0 else None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Métricas para /api/health"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'bypassed': self.bypassed,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'latency_saved_seconds': round(self.latency_saved, 3)
+            }
@@ -0,0 +1,353 @@
+# session_store.py - Sesiones de usuario acotadas, thread-safe y con backend intercambiable
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from warm_snapshot import SnapshotMixin
+
+# Campos de contexto que se guardan como slots; el resto va a `extra`
+CONTEXT_FIELDS = ('destination', 'traveler_type', 'travel_phase', 'session_id')
+
+
+class UserSession:
+    """Sesión compacta de un usuario (slots + timestamps epoch en vez de datetime)"""
+    __slots__ = ('user_id', 'destination', 'traveler_type', 'travel_phase', 'session_id',
+                 'last_activity', 'last_update', 'message_count', 'extra')
+
+    def __init__(self, user_id, destination=None, traveler_type=None, travel_phase=None, session_id=None,
+                 last_activity=None, last_update=None, message_count=0, extra=None):
+        self.user_id = user_id
+        self.destination = destination
+        self.traveler_type = traveler_type
+        self.travel_phase = travel_phase
+        self.session_id = session_id
+        self.last_activity = last_activity  # último mensaje de chat
+        self.last_update = last_update  # último cambio de contexto
+        self.message_count = message_count
+        self.extra = extra
+
+    @property
+    def last_seen(self):
+        return max(self.last_activity or 0.0, self.last_update or 0.0)
+
+    def apply_context(self, context):
+        for key, value in context.items():
+            if key in CONTEXT_FIELDS:
+                setattr(self, key, value)
+            elif key != 'user_id':
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[key] = value
+
+    def to_dict(self):
+        data = {key: getattr(self, key) for key in self.__slots__ if key != 'extra'}
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+
+class SessionBackend:
+    """Interfaz de almacenamiento; SessionStore pone la lógica de capacidad e inactividad"""
+    shared = False  # True si todos los procesos del host ven las mismas sesiones
+
+    def atomic(self):
+        """Context manager que serializa read-modify-write (entre threads o procesos)"""
+        raise NotImplementedError
+
+    def load(self, user_id):
+        raise NotImplementedError
+
+    def load_many(self, user_ids):
+        """[UserSession o None] en el mismo orden que user_ids"""
+        return [self.load(user_id) for user_id in user_ids]
+
+    def save(self, session):
+        raise NotImplementedError
+
+    def delete(self, user_id):
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+    def sessions(self):
+        """Snapshot [(user_id, UserSession)]"""
+        raise NotImplementedError
+
+    def evict(self, capacity, idle_before):
+        """Borrar sesiones inactivas y las menos recientes por encima de capacity; devuelve ids"""
+        raise NotImplementedError
+
+
+class MemorySessionBackend(SnapshotMixin, SessionBackend):
+    """Backend en memoria del proceso (LRU por OrderedDict)"""
+    SNAPSHOT_ENTRIES = '_sessions'
+    SNAPSHOT_CAPACITY = None  # la capacidad la aplica SessionStore
+
+    def __init__(self):
+        self._sessions = OrderedDict()
+        self._lock = threading.RLock()
+
+    def atomic(self):
+        return self._lock
+
+    def load(self, user_id):
+        session = self._sessions.get(user_id)
+        if session is None and self._snapshot is not None:
+            with self._lock:
+                session = self._sessions.get(user_id) or self._fault_in(user_id)
+        return session
+
+    def save(self, session):
+        with self._lock:
+            self._sessions[session.user_id] = session
+            self._sessions.move_to_end(session.user_id)
+
+    def delete(self, user_id):
+        with self._lock:
+            self._sessions.pop(user_id, None)
+            self._snapshot_discard(user_id)
+
+    def count(self):
+        return len(self._sessions)
+
+    def sessions(self):
+        with self._lock:
+            return list(self._sessions.items())
+
+    def evict(self, capacity, idle_before):
+        evicted = []
+        with self._lock:
+            # El orden LRU deja a los inactivos al principio
+            while self._sessions:
+                user_id, session = next(iter(self._sessions.items()))
+                if len(self._sessions) <= capacity and session.last_seen >= idle_before:
+                    break
+                del self._sessions[user_id]
+                evicted.append(user_id)
+        return evicted
+
+    def encode_snapshot(self, session, now):
+        return [getattr(session, key) for key in UserSession.__slots__[1:]]
+
+    def decode_snapshot(self, user_id, value, now):
+        return UserSession(user_id, *value)
+
+
+class SqliteSessionBackend(SessionBackend):
+    """Backend SQLite en disco local: varios workers de gunicorn comparten las sesiones"""
+    shared = True
+
+    COLUMNS = ('user_id', 'destination', 'traveler_type', 'travel_phase', 'session_id',
+               'last_activity', 'last_update', 'message_count', 'extra')
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    user_id TEXT PRIMARY KEY,
+                    destination TEXT,
+                    traveler_type TEXT,
+                    travel_phase TEXT,
+                    session_id TEXT,
+                    last_activity REAL,
+                    last_update REAL,
+                    message_count INTEGER NOT NULL DEFAULT 0,
+                    extra TEXT,
+                    last_seen REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions (last_seen)")
+
+    @contextmanager
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        yield conn
+
+    @contextmanager
+    def atomic(self):
+        with self._connection() as conn:
+            if conn.in_transaction:
+                yield
+                return
+            # IMMEDIATE toma el lock de escritura ya: otro worker espera en vez de pisarnos
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _row_to_session(self, row):
+        session = UserSession(*row)
+        session.extra = json.loads(row[-1]) if row[-1] else None
+        return session
+
+    def load(self, user_id):
+        with self._connection() as conn:
+            row = conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM sessions WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return self._row_to_session(row) if row else None
+
+    def load_many(self, user_ids, chunk_size=500):
+        found = {}
+        with self._connection() as conn:
+            for start in range(0, len(user_ids), chunk_size):
+                chunk = user_ids[start:start + chunk_size]
+                rows = conn.execute(
+                    f"SELECT {', '.join(self.COLUMNS)} FROM sessions "
+                    f"WHERE user_id IN ({', '.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update((row[0], self._row_to_session(row)) for row in rows)
+        return [found.get(user_id) for user_id in user_ids]
+
+    def save(self, session):
+        values = [getattr(session, column) for column in self.COLUMNS]
+        values[-1] = json.dumps(session.extra, ensure_ascii=False) if session.extra else None
+        with self._connection() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO sessions ({', '.join(self.COLUMNS)}, last_seen) "
+                f"VALUES ({', '.join('?' * len(self.COLUMNS))}, ?)",
+                values + [session.last_seen]
+            )
+
+    def delete(self, user_id):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    def count(self):
+        with self._connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def sessions(self):
+        with self._connection() as conn:
+            rows = conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM sessions").fetchall()
+        return [(row[0], self._row_to_session(row)) for row in rows]
+
+    def evict(self, capacity, idle_before):
+        with self.atomic(), self._connection() as conn:
+            evicted = [row[0] for row in conn.execute(
+                "SELECT user_id FROM sessions WHERE last_seen < ?", (idle_before,)
+            )]
+            conn.execute("DELETE FROM sessions WHERE last_seen < ?", (idle_before,))
+            overflow = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] - capacity
+            if overflow > 0:
+                oldest = [row[0] for row in conn.execute(
+                    "SELECT user_id FROM sessions ORDER BY last_seen ASC LIMIT ?", (overflow,)
+                )]
+                conn.executemany("DELETE FROM sessions WHERE user_id = ?", [(user_id,) for user_id in oldest])
+                evicted.extend(oldest)
+        return evicted
+
+
+class SessionStore:
+    """Sesiones activas con capacidad máxima (LRU) y desalojo por inactividad"""
+
+    def __init__(self, backend=None, capacity=100, idle_ttl=86400, on_evict=None, clock=time.time):
+        self.backend = backend or MemorySessionBackend()
+        self.capacity = capacity
+        self.idle_ttl = idle_ttl
+        self.on_evict = on_evict
+        self._clock = clock
+        self.evictions = 0
+
+    def record_chat(self, user_id, context):
+        """Registrar un mensaje: reemplaza el contexto y suma message_count"""
+        now = self._clock()
+        with self.backend.atomic():
+            previous = self.backend.load(user_id)
+            session = UserSession(user_id, message_count=previous.message_count if previous else 0)
+            session.apply_context(context)
+            session.message_count += 1
+            session.last_activity = now
+            session.last_update = previous.last_update if previous else None
+            self.backend.save(session)
+            over_capacity = self.backend.count() > self.capacity
+        if over_capacity:
+            self.evict()
+        return session
+
+    def update_context(self, user_id, context):
+        """Mezclar contexto nuevo con el existente"""
+        now = self._clock()
+        with self.backend.atomic():
+            session = self.backend.load(user_id) or UserSession(user_id)
+            session.apply_context(context)
+            session.last_update = now
+            self.backend.save(session)
+            over_capacity = self.backend.count() > self.capacity
+        if over_capacity:
+            self.evict()
+        return session
+
+    def update_contexts(self, updates):
+        """update_context para muchos (user_id, context) con un solo atomic() (una transacción en SQLite)"""
+        now = self._clock()
+        sessions = []
+        with self.backend.atomic():
+            for user_id, context in updates:
+                session = self.backend.load(user_id) or UserSession(user_id)
+                session.apply_context(context)
+                session.last_update = now
+                self.backend.save(session)
+                sessions.append(session)
+            over_capacity = self.backend.count() > self.capacity
+        if over_capacity:
+            self.evict()
+        return sessions
+
+    def evict(self):
+        """Aplicar capacidad e inactividad; avisa a on_evict por cada usuario desalojado"""
+        evicted = self.backend.evict(self.capacity, self._clock() - self.idle_ttl)
+        self.evictions += len(evicted)
+        if self.on_evict:
+            for user_id in evicted:
+                self.on_evict(user_id)
+        return evicted
+
+    def get(self, user_id):
+        return self.backend.load(user_id)
+
+    def get_many(self, user_ids):
+        return self.backend.load_many(list(user_ids))
+
+    def items(self):
+        return self.backend.sessions()
+
+    def __contains__(self, user_id):
+        return self.backend.load(user_id) is not None
+
+    def __len__(self):
+        return self.backend.count()
+
+    def stats(self):
+        return {
+            'backend': type(self.backend).__name__,
+            'sessions': len(self),
+            'capacity': self.capacity,
+            'idle_ttl_seconds': self.idle_ttl,
+            'evictions': self.evictions
+        }
+
+
+def build_session_backend(name, path=None):
+    """'memory' (por proceso) o 'sqlite' (compartido entre workers del mismo host)"""
+    if name == 'memory':
+        return MemorySessionBackend()
+    if name == 'sqlite':
+        path = path or os.path.join(os.getcwd(), 'sessions.db')
+        return SqliteSessionBackend(path)
+    raise ValueError(f"SESSION_BACKEND desconocido: {name}")
@@ -0,0 +1,45 @@
+# streaming.py - Helpers de Server-Sent Events para el chat en streaming
+import json
+
+# Marca de fin de stream de Toqan ("data: [DONE]")
+STREAM_DONE = object()
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'  # que nginx/render no bufferee el stream
+}
+
+
+def sse_event(event, data, event_id=None):
+    """Serializar un evento SSE; data va como JSON para soportar saltos de línea"""
+    prefix = f"id: {event_id}\n" if event_id is not None else ''
+    return f"{prefix}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def is_event_stream(content_type):
+    return bool(content_type) and content_type.split(';', 1)[0].strip() == 'text/event-stream'
+
+
+def parse_toqan_stream_line(line):
+    """Extraer el texto de una línea SSE de Toqan; None si no trae texto"""
+    if isinstance(line, bytes):
+        line = line.decode('utf-8', errors='replace')
+    line = line.strip()
+    if not line.startswith('data:'):
+        return None
+
+    raw = line[5:].strip()
+    if raw == '[DONE]':
+        return STREAM_DONE
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        return raw or None
+
+    if isinstance(data, str):
+        return data or None
+    for key in ('delta', 'token', 'response', 'message', 'content'):
+        value = data.get(key)
+        if isinstance(value, str) and value:
+            return value
+    return None
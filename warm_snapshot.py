@@ -0,0 +1,410 @@
+# warm_snapshot.py - Snapshot en disco de sesiones y caches para arrancar en caliente
+#
+# Formato (un archivo, little-endian):
+#   MAGIC
+#   por sección: registros [u32 largo][JSON [key, value]] ... + índice [(u64 hash de la key, u64 offset)] ordenado
+#   header JSON {"created_at", "sections": {nombre: {offset, index_offset, count, version}}}
+#   [u64 offset del header][u32 largo del header] MAGIC
+# Abrirlo lee solo el trailer y el header (mmap): el costo no crece con el tamaño del snapshot.
+# Una key se busca por bisect sobre el índice y se decodifica solo ese registro.
+import asyncio
+import atexit
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+from app_logging import get_logger
+from prompt_templates import dumps
+
+log = get_logger('snapshot')
+
+MAGIC = b'DSNAP01\n'
+_LENGTH = struct.Struct('<I')
+_INDEX_ENTRY = struct.Struct('<QQ')
+_TRAILER = struct.Struct('<QI')
+
+
+def key_hash(key):
+    """Hash estable entre procesos (hash() de Python cambia en cada arranque)"""
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def write_snapshot(path, sections, versions=None):
+    """Escribir {nombre: [(key, value)]} de forma atómica; devuelve {nombre: registros}"""
+    versions = versions or {}
+    header = {'created_at': time.time(), 'sections': {}}
+    counts = {}
+    tmp_path = f"{path}.{os.getpid()}.tmp"  # cada worker escribe el suyo y reemplaza
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        for name, records in sections.items():
+            offset = f.tell()
+            index = []
+            for key, value in records:
+                record = dumps([key, value])
+                index.append((key_hash(key), f.tell()))
+                f.write(_LENGTH.pack(len(record)))
+                f.write(record)
+            index_offset = f.tell()
+            index.sort()
+            f.write(b''.join(_INDEX_ENTRY.pack(*entry) for entry in index))
+            header['sections'][name] = {
+                'offset': offset,
+                'index_offset': index_offset,
+                'count': len(index),
+                'version': versions.get(name)
+            }
+            counts[name] = len(index)
+        header_offset = f.tell()
+        encoded = dumps(header)
+        f.write(encoded)
+        f.write(_TRAILER.pack(header_offset, len(encoded)))
+        f.write(MAGIC)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return counts
+
+
+class SnapshotSection:
+    """Registros de una sección leídos del mmap: por key (bisect sobre el índice) o en orden"""
+
+    def __init__(self, data, offset, index_offset, count, version=None):
+        self._data = data
+        self.offset = offset
+        self.index_offset = index_offset
+        self.count = count
+        self.version = version
+
+    def _record(self, offset):
+        length, = _LENGTH.unpack_from(self._data, offset)
+        start = offset + _LENGTH.size
+        return json.loads(self._data[start:start + length]), start + length
+
+    def _hash_at(self, position):
+        return _INDEX_ENTRY.unpack_from(self._data, self.index_offset + position * _INDEX_ENTRY.size)
+
+    def get(self, key):
+        """Valor guardado para key o None"""
+        target = key_hash(key)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._hash_at(middle)[0] < target:
+                low = middle + 1
+            else:
+                high = middle
+        # Colisiones de hash: comparar las keys de todos los registros con el mismo hash
+        while low < self.count:
+            found, offset = self._hash_at(low)
+            if found != target:
+                break
+            (stored_key, value), _ = self._record(offset)
+            if stored_key == key:
+                return value
+            low += 1
+        return None
+
+    def __iter__(self):
+        """(key, value) en el orden en que se escribieron"""
+        offset = self.offset
+        while offset < self.index_offset:
+            (key, value), offset = self._record(offset)
+            yield key, value
+
+    def __len__(self):
+        return self.count
+
+
+class SnapshotReader:
+    """Snapshot abierto con mmap; solo el header se parsea al abrir"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            size = len(self._data)
+            trailer_at = size - _TRAILER.size - len(MAGIC)
+            if (size < len(MAGIC) + _TRAILER.size + len(MAGIC) or self._data[:len(MAGIC)] != MAGIC
+                    or self._data[size - len(MAGIC):] != MAGIC):
+                raise ValueError(f"{path}: no es un snapshot válido")
+            header_offset, header_length = _TRAILER.unpack_from(self._data, trailer_at)
+            header = json.loads(self._data[header_offset:header_offset + header_length])
+        except Exception:
+            self.close()
+            raise
+        self.created_at = header['created_at']
+        self._sections = header['sections']
+
+    def section(self, name):
+        meta = self._sections.get(name)
+        if meta is None:
+            return None
+        return SnapshotSection(self._data, meta['offset'], meta['index_offset'], meta['count'], meta.get('version'))
+
+    def close(self):
+        data = getattr(self, '_data', None)
+        if data is not None:
+            data.close()
+        self._file.close()
+
+
+class SnapshotSource:
+    """Sección pendiente de restaurar: cada key sale una sola vez, a pedido (lazy) o en el relleno de fondo"""
+
+    def __init__(self, section):
+        self.section = section
+        self._taken = set()
+        self._lock = threading.Lock()
+        self.done = False
+        self.faulted = 0
+        self.filled = 0
+
+    def take(self, key):
+        """Valor de key si todavía no se restauró (y marcarla); None si no está o ya salió"""
+        with self._lock:
+            if self.done or key in self._taken:
+                return None
+            self._taken.add(key)
+            return self.section.get(key)
+
+    def discard(self, key):
+        """La key se borró en memoria: que el relleno no la resucite"""
+        with self._lock:
+            self._taken.add(key)
+
+    def remaining(self):
+        """(key, value) que no salieron por take(), en el orden del archivo"""
+        for key, value in self.section:
+            with self._lock:
+                if self.done:
+                    return
+                if key in self._taken:
+                    continue
+                self._taken.add(key)
+                self.filled += 1
+            yield key, value
+
+    def close(self):
+        """Descartar lo que falte (terminó el relleno o se vació el cache)"""
+        with self._lock:
+            self.done = True
+            self._taken.clear()
+
+
+class SnapshotMixin:
+    """Snapshot de un OrderedDict LRU (el menos reciente primero) protegido por self._lock"""
+    # Cada clase define los atributos y encode/decode_snapshot; los vencimientos se guardan
+    # en epoch (no monotonic) para que los TTL sigan valiendo después del reinicio
+    SNAPSHOT_ENTRIES = '_entries'
+    SNAPSHOT_CAPACITY = 'max_entries'  # None: sin límite propio
+    _snapshot = None
+
+    def encode_snapshot(self, entry, now):
+        """Entrada en memoria -> valor JSON; None para no guardarla"""
+        raise NotImplementedError
+
+    def decode_snapshot(self, key, value, now):
+        """Valor guardado -> entrada en memoria; None si ya venció"""
+        raise NotImplementedError
+
+    def snapshot_key(self, key):
+        return key
+
+    def entry_key(self, key):
+        return key
+
+    def export_snapshot(self):
+        """[(key, value)] del más reciente al menos reciente"""
+        now = time.time()
+        with self._lock:
+            items = list(getattr(self, self.SNAPSHOT_ENTRIES).items())
+        records = []
+        for key, entry in reversed(items):
+            with self._lock:  # de a una: un snapshot grande no frena a los requests
+                value = self.encode_snapshot(entry, now)
+            if value is not None:
+                records.append((self.snapshot_key(key), value))
+        return records
+
+    def attach_snapshot(self, source):
+        self._snapshot = source
+
+    def _fault_in(self, key):
+        """Traer key del snapshot en su primer acceso (con self._lock tomado); None si no estaba"""
+        source = self._snapshot
+        if source is None:
+            return None
+        value = source.take(self.snapshot_key(key))
+        if value is None:
+            return None
+        entry = self.decode_snapshot(key, value, time.time())
+        if entry is not None:
+            getattr(self, self.SNAPSHOT_ENTRIES)[key] = entry
+            source.faulted += 1
+        return entry
+
+    def _snapshot_discard(self, key=None):
+        """Borrado en memoria: key=None descarta todo lo que quedaba por restaurar"""
+        source = self._snapshot
+        if source is not None:
+            if key is None:
+                source.close()
+            else:
+                source.discard(self.snapshot_key(key))
+
+    def restore_snapshot(self, records, yield_every=256):
+        """Relleno incremental: lo que no está en memoria entra como menos reciente; devuelve cuántos"""
+        entries = getattr(self, self.SNAPSHOT_ENTRIES)
+        capacity = getattr(self, self.SNAPSHOT_CAPACITY) if self.SNAPSHOT_CAPACITY else None
+        restored = 0
+        now = time.time()
+        for count, (key, value) in enumerate(records, 1):
+            key = self.entry_key(key)
+            with self._lock:
+                if capacity is not None and len(entries) >= capacity:
+                    break
+                if key not in entries:
+                    entry = self.decode_snapshot(key, value, now)
+                    if entry is not None:
+                        entries[key] = entry
+                        entries.move_to_end(key, last=False)
+                        restored += 1
+            if count % yield_every == 0:
+                time.sleep(0)  # soltar el GIL para los threads que atienden requests
+        self._snapshot = None
+        return restored
+
+
+class SnapshotManager:
+    """Snapshot periódico y al apagar; al arrancar se restaura lazy y se rellena de a poco en background"""
+
+    def __init__(self, path, components, versions=None, interval=300):
+        self.path = path
+        self.components = components  # nombre -> objeto con SnapshotMixin
+        self.versions = versions or {}  # nombre -> versión; si no coincide la sección se descarta
+        self.interval = interval
+        self.saves = 0
+        self.last_save = {}
+        self.restored = {}
+        self._reader = None
+        self._sources = {}
+        self._save_lock = threading.Lock()
+        self._fill_lock = threading.Lock()
+        self._started = False
+        self._stop = threading.Event()
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def restore(self):
+        """Abrir el snapshot y dejar cada sección lista para restaurar a pedido; no lee registros"""
+        if not self.enabled or not os.path.exists(self.path):
+            return False
+        try:
+            self._reader = SnapshotReader(self.path)
+        except (OSError, ValueError) as e:
+            log.warning("snapshot_unreadable path=%s error=%s", self.path, e)
+            return False
+        for name, component in self.components.items():
+            section = self._reader.section(name)
+            if section is None or section.version != self.versions.get(name):
+                continue
+            source = self._sources[name] = SnapshotSource(section)
+            component.attach_snapshot(source)
+        log.info("snapshot_opened path=%s age_seconds=%.0f sections=%s", self.path,
+                 time.time() - self._reader.created_at, ','.join(self._sources))
+        return True
+
+    def fill(self):
+        """Restaurar lo que nadie pidió todavía y cerrar el archivo"""
+        with self._fill_lock:
+            if self._reader is None:
+                return self.restored
+            started = time.perf_counter()
+            for name, source in self._sources.items():
+                try:
+                    self.restored[name] = self.components[name].restore_snapshot(source.remaining())
+                except Exception as e:
+                    log.exception("snapshot_fill_error section=%s error=%s", name, e)
+                    self.components[name].attach_snapshot(None)
+                self.restored[name] = self.restored.get(name, 0) + source.faulted
+                source.close()
+            self._reader.close()
+            self._reader = None
+            log.info("snapshot_filled restored=%s duration_ms=%.1f", self.restored,
+                     (time.perf_counter() - started) * 1000)
+            return self.restored
+
+    def save(self):
+        """Escribir el estado actual; primero termina el relleno para no perder lo no restaurado"""
+        if not self.enabled:
+            return None
+        self.fill()
+        with self._save_lock:
+            started = time.perf_counter()
+            sections = {name: component.export_snapshot() for name, component in self.components.items()}
+            try:
+                counts = write_snapshot(self.path, sections, self.versions)
+            except OSError as e:
+                log.warning("snapshot_save_error path=%s error=%s", self.path, e)
+                return None
+            self.saves += 1
+            self.last_save = {
+                'at': time.time(),
+                'duration_ms': round((time.perf_counter() - started) * 1000, 2),
+                'bytes': os.path.getsize(self.path),
+                'records': counts
+            }
+            return self.last_save
+
+    def start(self):
+        """Restaurar + thread de relleno y snapshot periódico + snapshot al salir (app Flask); idempotente"""
+        if self._started or not self.enabled:
+            return
+        with self._save_lock:
+            if self._started:
+                return
+            self._started = True
+        self.restore()
+        atexit.register(self.save)
+        threading.Thread(target=self.run_forever, name='snapshot', daemon=True).start()
+
+    def run_forever(self):
+        self.fill()
+        while not self._stop.wait(self.interval):
+            try:
+                self.save()
+            except Exception as e:
+                log.exception("snapshot_error error=%s", e)
+
+    async def arun_forever(self):
+        """Lo mismo para el modo ASGI: el I/O del archivo va a un thread"""
+        if not self.enabled:
+            return
+        await asyncio.to_thread(self.fill)
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.save)
+            except Exception as e:
+                log.exception("snapshot_error error=%s", e)
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {
+            'path': self.path or None,
+            'interval_seconds': self.interval,
+            'saves': self.saves,
+            'last_save': self.last_save,
+            'restoring': sorted(self._sources) if self._reader is not None else [],
+            'restored': self.restored
+        }
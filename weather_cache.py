@@ -0,0 +1,179 @@
+# weather_cache.py - Cache de clima por ciudad (TTL + LRU + coalescing)
+import asyncio
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from warm_snapshot import SnapshotMixin
+
+
+def normalize_city(city):
+    """Normalizar nombre de ciudad: 'París, Francia ' -> 'paris, francia'"""
+    if not city:
+        return ''
+    folded = unicodedata.normalize('NFKD', str(city))
+    folded = ''.join(ch for ch in folded if not unicodedata.combining(ch))
+    return ' '.join(folded.lower().split())
+
+
+class _InFlight:
+    """Request en curso compartido por todos los que piden la misma ciudad"""
+    __slots__ = ('event', 'value', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class WeatherCache(SnapshotMixin):
+    """Cache acotado por ciudad con TTL, desalojo LRU y single-flight"""
+
+    def __init__(self, max_entries=256, ttl=600, negative_ttl=60, ttl_scale=None, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.ttl_scale = ttl_scale  # p.ej. QuotaGovernor.scale_ttl: TTL más largo con poca cuota
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}
+        self._ainflight = {}  # key -> asyncio.Future (modo ASGI)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+    def get_or_fetch(self, city, fetch):
+        """Devolver el clima cacheado o llamar a fetch(city) una sola vez por key"""
+        key = normalize_city(city)
+        with self._lock:
+            entry = self._entries.get(key) or self._fault_in(key)
+            if entry is not None:
+                if entry[0] > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+            flight = self._inflight.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                flight = self._inflight[key] = _InFlight()
+                self.misses += 1
+                leader = True
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            value = fetch(city)
+            flight.value = value
+            self.set(key, value, normalized=True)
+            return value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    async def aget_or_fetch(self, city, fetch):
+        """Versión asyncio de get_or_fetch; fetch es una corrutina fetch(city)"""
+        key = normalize_city(city)
+        with self._lock:
+            entry = self._entries.get(key) or self._fault_in(key)
+            if entry is not None:
+                if entry[0] > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+            future = self._ainflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+            else:
+                self.misses += 1
+
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = self._ainflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await fetch(city)
+            self.set(key, value, normalized=True)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Evitar "exception was never retrieved" si nadie más esperaba
+            future.exception()
+            raise
+        finally:
+            self._ainflight.pop(key, None)
+
+    def set(self, city, value, ttl=None, normalized=False):
+        """Guardar un valor; los fallbacks (success=False) viven negative_ttl"""
+        key = city if normalized else normalize_city(city)
+        if ttl is None:
+            ttl = self.ttl if value.get('success', True) else self.negative_ttl
+            if self.ttl_scale is not None:
+                ttl = self.ttl_scale(ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self._clock() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, city=None):
+        """Borrar una ciudad o todo el cache"""
+        with self._lock:
+            if city is None:
+                self._entries.clear()
+                self._snapshot_discard()
+            else:
+                key = normalize_city(city)
+                self._entries.pop(key, None)
+                self._snapshot_discard(key)
+
+    def encode_snapshot(self, entry, now):
+        expires_at, value = entry
+        remaining = expires_at - self._clock()
+        return [now + remaining, value] if remaining > 0 else None
+
+    def decode_snapshot(self, key, value, now):
+        expires_at, weather = value
+        remaining = expires_at - now
+        return (self._clock() + remaining, weather) if remaining > 0 else None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Contadores para /api/health"""
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'hit_ratio': round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0
+            }
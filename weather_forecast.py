@@ -0,0 +1,314 @@
+# weather_forecast.py - Pronóstico por ciudad en memoria y prefetch de los destinos con usuarios activos
+import asyncio
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from app_logging import get_logger
+from warm_snapshot import SnapshotMixin
+from weather_cache import normalize_city
+
+log = get_logger('forecast')
+
+SLOT_SECONDS = 3 * 3600  # /data/2.5/forecast trae un punto cada 3 horas
+# Campos del contexto con la fecha de salida (ISO 8601 o epoch)
+DEPARTURE_FIELDS = ('departure_date', 'departure_time', 'departure')
+
+
+def parse_forecast(data):
+    """Respuesta de /data/2.5/forecast -> [(epoch, slot)] ordenado; la lluvia sale de `pop`, no de las nubes"""
+    slots = []
+    for item in data.get('list', ()):
+        weather = item.get('weather') or [{}]
+        slots.append((int(item['dt']), {
+            'temperature': item['main']['temp'],
+            'description': weather[0].get('description', ''),
+            'humidity': item['main'].get('humidity'),
+            'rain_probability': round(float(item.get('pop', 0)) * 100),
+            'clouds': item.get('clouds', {}).get('all', 0)
+        }))
+    slots.sort(key=lambda slot: slot[0])
+    return slots
+
+
+def departure_of(session):
+    """Epoch de salida del usuario si su contexto la trae; None si no"""
+    extra = session.extra or {}
+    for field in DEPARTURE_FIELDS:
+        value = extra.get(field)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+        if isinstance(value, str) and value:
+            try:
+                return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+            except ValueError:
+                continue
+    return None
+
+
+class CityForecast:
+    """Slots de una ciudad con sus epochs aparte para el bisect"""
+    __slots__ = ('name', 'times', 'slots', 'fetched_at')
+
+    def __init__(self, name, slots, fetched_at):
+        self.name = name
+        self.times = [epoch for epoch, _ in slots]
+        self.slots = [slot for _, slot in slots]
+        self.fetched_at = fetched_at
+
+
+class ForecastTable(SnapshotMixin):
+    """Pronóstico por ciudad indexado por tiempo; leerlo nunca hace I/O"""
+    SNAPSHOT_ENTRIES = '_cities'
+    SNAPSHOT_CAPACITY = 'max_cities'
+
+    def __init__(self, max_cities=256, max_age=3 * 3600, alert_hours=6, clock=time.time):
+        self.max_cities = max_cities
+        self.max_age = max_age  # más viejo que esto ya no se sirve
+        self.alert_hours = alert_hours
+        self._clock = clock
+        self._cities = OrderedDict()  # ciudad normalizada -> CityForecast
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def put(self, city, slots, fetched_at=None):
+        if not slots:
+            return
+        key = normalize_city(city)
+        entry = CityForecast(city, slots, self._clock() if fetched_at is None else fetched_at)
+        with self._lock:
+            self._cities[key] = entry
+            self._cities.move_to_end(key)
+            while len(self._cities) > self.max_cities:
+                self._cities.popitem(last=False)
+                self.evictions += 1
+
+    def age(self, city):
+        """Segundos desde el último fetch de la ciudad (None si nunca se trajo)"""
+        entry = self._entry(normalize_city(city))
+        return None if entry is None else self._clock() - entry.fetched_at
+
+    def weather(self, city, when=None):
+        """Clima del slot que cubre `when` (ahora) con el formato de get_weather_data; None si no hay pronóstico vigente"""
+        now = self._clock()
+        when = now if when is None else when
+        entry = self._entry(normalize_city(city))
+        if entry is None or now - entry.fetched_at > self.max_age:
+            self.misses += 1
+            return None
+        index = max(bisect.bisect_right(entry.times, when) - 1, 0)
+        if not entry.times[index] - SLOT_SECONDS <= when < entry.times[index] + SLOT_SECONDS:
+            self.misses += 1
+            return None
+
+        # Para las alertas cuenta la lluvia de las próximas horas, no solo la del slot actual
+        window_end = when + self.alert_hours * 3600
+        upcoming = max(
+            slot['rain_probability']
+            for epoch, slot in zip(entry.times[index:], entry.slots[index:])
+            if epoch < window_end or epoch == entry.times[index]
+        )
+        self.hits += 1
+        return {
+            **entry.slots[index],
+            'rain_probability_next_hours': upcoming,
+            'forecast_time': datetime.fromtimestamp(entry.times[index]).isoformat(),
+            'source': 'forecast',
+            'success': True
+        }
+
+    def _entry(self, key):
+        entry = self._cities.get(key)
+        if entry is None and self._snapshot is not None:
+            with self._lock:
+                entry = self._fault_in(key)
+        return entry
+
+    def encode_snapshot(self, entry, now):
+        return [entry.name, entry.fetched_at, entry.times, entry.slots]
+
+    def decode_snapshot(self, key, value, now):
+        name, fetched_at, times, slots = value
+        if now - fetched_at > self.max_age:
+            return None
+        return CityForecast(name, list(zip(times, slots)), fetched_at)
+
+    def __len__(self):
+        return len(self._cities)
+
+    def stats(self):
+        """Métricas para /api/health"""
+        now = self._clock()
+        with self._lock:
+            ages = [now - entry.fetched_at for entry in self._cities.values()]
+        lookups = self.hits + self.misses
+        return {
+            'cities': len(ages),
+            'max_cities': self.max_cities,
+            'fresh': sum(1 for age in ages if age <= self.max_age),
+            'oldest_seconds': round(max(ages), 1) if ages else None,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+class ForecastPrefetcher:
+    """Trae el pronóstico de los destinos activos antes de que alguien lo pida: más usuarios y salidas más próximas primero"""
+
+    def __init__(self, agent, table, interval=900, refresh_after=1800, max_parallel_fetches=4,
+                 max_cities_per_cycle=50, active_window=7200, failure_backoff=300, on_fetch=None):
+        self.agent = agent
+        self.table = table
+        self.interval = interval
+        self.refresh_after = refresh_after
+        self.max_parallel_fetches = max_parallel_fetches
+        self.max_cities_per_cycle = max_cities_per_cycle
+        self.active_window = active_window
+        self.failure_backoff = failure_backoff
+        self.on_fetch = on_fetch  # (ciudad, slots) tras cada fetch exitoso, p.ej. el worker background
+        self.cycles = 0
+        self.fetched = 0
+        self.failed = 0
+        self.last_cycle = {}
+        self._wanted = {}  # ciudad normalizada -> nombre, destinos nuevos que adelantan el ciclo
+        self._failed_until = {}  # ciudad normalizada -> epoch: no reintentar (ni gastar cuota) antes
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._awake = None  # asyncio.Event del loop de arun_forever
+        self._stop = threading.Event()
+
+    def want(self, city):
+        """Destino nuevo en una sesión: traerlo en el próximo ciclo, que arranca ya"""
+        key = normalize_city(city)
+        if not key or not self._due(key, time.time()):
+            return
+        with self._lock:
+            self._wanted[key] = city
+        self._wake.set()
+        if self._awake is not None:
+            self._awake.set()
+
+    def _due(self, key, now):
+        if self._failed_until.get(key, 0) > now:
+            return False
+        age = self.table.age(key)
+        return age is None or age >= self.refresh_after
+
+    def plan(self):
+        """Ciudades a traer en este ciclo, ordenadas por (-usuarios, salida más próxima)"""
+        now = time.time()
+        active_since = now - self.active_window
+        cities = {}  # key -> [usuarios, salida más próxima, nombre]
+        for _, session in self.agent.active_users.items():
+            if not session.destination or session.last_seen < active_since:
+                continue
+            key = normalize_city(session.destination)
+            entry = cities.get(key)
+            if entry is None:
+                entry = cities[key] = [0, float('inf'), session.destination]
+            entry[0] += 1
+            departure = departure_of(session)
+            if departure is not None and now <= departure < entry[1]:
+                entry[1] = departure
+
+        with self._lock:
+            wanted, self._wanted = self._wanted, {}
+        for key, name in wanted.items():
+            cities.setdefault(key, [0, float('inf'), name])
+
+        self._failed_until = {key: until for key, until in self._failed_until.items() if until > now}
+        due = []
+        for key, (users, departure, name) in cities.items():
+            if self._due(key, now):
+                due.append((-users, departure, name))
+        due.sort(key=lambda item: item[:2])
+        return [name for _, _, name in due[:self.max_cities_per_cycle]], len(cities)
+
+    def _store(self, name, slots):
+        if slots:
+            self.table.put(name, slots)
+            self.fetched += 1
+            if self.on_fetch is not None:
+                self.on_fetch(name, slots)
+        else:
+            self._failed_until[normalize_city(name)] = time.time() + self.failure_backoff
+            self.failed += 1
+
+    def _record(self, started, planned, cities):
+        duration = time.perf_counter() - started
+        self.cycles += 1
+        self.last_cycle = {
+            'finished_at': datetime.now().isoformat(),
+            'duration_ms': round(duration * 1000, 2),
+            'active_cities': cities,
+            'fetched': len(planned)
+        }
+        return self.last_cycle
+
+    def run_cycle(self):
+        """Un ciclo con threads (app Flask)"""
+        started = time.perf_counter()
+        planned, cities = self.plan()
+        if planned:
+            with ThreadPoolExecutor(max_workers=min(self.max_parallel_fetches, len(planned))) as pool:
+                for name, slots in zip(planned, pool.map(self.agent.fetch_forecast, planned)):
+                    self._store(name, slots)
+        return self._record(started, planned, cities)
+
+    async def arun_cycle(self):
+        """Un ciclo en asyncio (modo ASGI) con el mismo límite de paralelismo"""
+        started = time.perf_counter()
+        planned, cities = self.plan()
+        semaphore = asyncio.Semaphore(self.max_parallel_fetches)
+
+        async def fetch(name):
+            async with semaphore:
+                return await self.agent.afetch_forecast(name)
+
+        for name, slots in zip(planned, await asyncio.gather(*(fetch(name) for name in planned))):
+            self._store(name, slots)
+        return self._record(started, planned, cities)
+
+    def run_forever(self):
+        """Loop del thread background; un destino nuevo (want) adelanta el próximo ciclo"""
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self.run_cycle()
+            except Exception as e:
+                log.exception("forecast_cycle_error error=%s", e)
+            self._wake.wait(self.interval)
+
+    async def arun_forever(self):
+        self._awake = asyncio.Event()
+        while True:
+            self._awake.clear()
+            try:
+                await self.arun_cycle()
+            except Exception as e:
+                log.exception("forecast_cycle_error error=%s", e)
+            try:
+                await asyncio.wait_for(self._awake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def stats(self):
+        return {
+            'interval_seconds': self.interval,
+            'refresh_after_seconds': self.refresh_after,
+            'cycles': self.cycles,
+            'fetched': self.fetched,
+            'failed': self.failed,
+            'last_cycle': self.last_cycle
+        }